@@ -26,57 +26,51 @@
 # ----------------------------------------------------------------------------------
 
 # --- Standard Library Imports ---
+import time
+_import_started = time.perf_counter()
 import json
 import traceback
 import random
 import collections
-import time
 import re
-import os
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    try:
+        import sre_parse
+    except ImportError:
+        sre_parse = None  # Without the parser, keyword regexes can't be checked and are rejected on save.
 import threading
 import queue
+import hashlib
+import heapq
+import bisect
+import datetime
 
 # --- Chaquopy Import for Java Interoperability ---
 from java.chaquopy import dynamic_proxy
 
-# --- Base Plugin and UI Imports ---
+# --- Base Plugin Imports ---
+# Only what the message path needs is imported here. Dialog, settings and updater classes are
+# imported inside the methods that use them, so they don't slow down the client's cold start.
 from base_plugin import BasePlugin, MenuItemData, MenuItemType
-from ui.settings import Header, Text, Divider, Input
-from ui.alert import AlertDialogBuilder
 from ui.bulletin import BulletinHelper
 
 # --- Android & Chaquopy Imports ---
 from android_utils import log, run_on_ui_thread
-from android.widget import EditText, FrameLayout, CheckBox, LinearLayout, TextView, Toast, ScrollView, CompoundButton
-from android.text import InputType, Html
-from android.text.method import LinkMovementMethod
-from android.util import TypedValue
-from android.view import View, ViewGroup
-from java.util import ArrayList, HashSet, Scanner
-from android.content.res import ColorStateList
-from android.content import ClipData, ClipboardManager, Context
+from android.view import View
+from java.util import ArrayList
 from android.os import Handler, Looper
-from java.lang import Runnable, String as JavaString, Integer
-from android.content import Intent
-from android.net import Uri
-from android.graphics import Typeface
-from java.net import URL, HttpURLConnection
-from java.io import File, FileOutputStream
+from java.lang import Runnable, String as JavaString, Integer, Long
 
 # --- Telegram & Client Utilities ---
-from org.telegram.messenger import NotificationCenter, MessageObject, R, Utilities
-from org.telegram.tgnet import TLRPC
-from org.telegram.ui.ActionBar import Theme
-from com.exteragram.messenger.plugins.ui import PluginSettingsActivity
-from com.exteragram.messenger.plugins import PluginsController
+from org.telegram.messenger import NotificationCenter, MessageObject, ChatObject, R, Utilities, UserConfig, AccountInstance, MessagesController
+from org.telegram.tgnet import TLRPC, ConnectionsManager
 from client_utils import (
-    get_messages_controller,
     get_last_fragment,
-    get_account_instance,
-    send_request,
-    RequestCallback,
-    get_user_config
+    RequestCallback
 )
+_import_seconds = time.perf_counter() - _import_started
 
 # --- Plugin Metadata ---
 __id__ = "auto_forwarder"
@@ -88,15 +82,31 @@ __min_version__ = "11.9.1"
 __icon__ = "Putin_1337/14"
 
 # --- Configuration Constants ---
-FORWARDING_RULES_KEY = "forwarding_rules_v1337"
+FORWARDING_RULES_KEY = "forwarding_rules_v1337"  # Legacy single-blob storage, migrated on load.
+RULES_SCHEMA_VERSION_KEY = "forwarding_rules_schema"
+RULES_SCHEMA_VERSION = 3
+RULE_INDEX_KEY = "forwarding_rules_index_v3"
+RULE_KEY_PREFIX = "forwarding_rule_v3_"
+V2_RULE_INDEX_KEY = "forwarding_rules_index_v2"  # Per-source rules without an account, migrated on load.
+V2_RULE_KEY_PREFIX = "forwarding_rule_v2_"
+MESSAGE_ID_MAP_KEY = "message_id_map_v1"
+BACKFILL_STATE_KEY = "backfill_state_v1"
+SCHEDULED_DELIVERIES_KEY = "scheduled_deliveries_v1"
+PENDING_HANDOFF_KEY = "pending_handoff_v1"
+UPDATE_CACHE_KEY = "update_check_cache_v1"
+RESOLVER_CACHE_KEY = "destination_resolver_cache_v1"
 DEFAULT_SETTINGS = {
     "deferral_timeout_ms": 5000,
     "min_msg_length": 1,
-    "max_msg_length": 4096,
+    "max_msg_length": 0,
     "deduplication_window_seconds": 10.0,
     "album_timeout_ms": 800,
     "sequential_delay_seconds": 1.5,
-    "antispam_delay_seconds": 1.0
+    "antispam_delay_seconds": 1.0,
+    "antispam_burst": 1,
+    "backfill_rate_per_minute": 120,
+    "content_dedup_window_seconds": 0.0,
+    "chain_short_circuit": False
 }
 FILTER_TYPES = collections.OrderedDict([
     ("text", "Text Messages"),
@@ -110,6 +120,36 @@ FILTER_TYPES = collections.OrderedDict([
     ("stickers", "Stickers"),
     ("gifs", "GIFs & Animations")
 ])
+# Rule priority levels for the processing queue; lower values are served first.
+RULE_PRIORITIES = collections.OrderedDict([
+    ("high", 0),
+    ("normal", 1),
+    ("low", 2),
+])
+# Rule export/import format. Every rule option and its value when missing from an imported rule.
+RULE_CONFIG_FORMAT = "auto_forwarder_rules"
+RULE_CONFIG_VERSION = 1
+RULE_CONFIG_FIELDS = collections.OrderedDict([
+    ("enabled", True),
+    ("drop_author", True),
+    ("quote_replies", True),
+    ("destination_topic_id", 0),
+    ("keyword_pattern", ""),
+    ("author_filter", ""),
+    ("forward_users", True),
+    ("forward_bots", True),
+    ("forward_outgoing", True),
+    ("filters", {}),
+    ("near_duplicate_threshold", 0),
+    ("antispam_mode", "drop"),
+    ("digest_window_seconds", 0),
+    ("digest_max_chars", 0),
+    ("delivery_window", ""),
+    ("server_schedule", False),
+    ("priority", "normal"),
+    ("shadow", False),
+])
+
 FAQ_TEXT = """--- **Disclaimer and Responsible Usage** ---
 Please be aware that using a plugin like this automates actions on your personal Telegram account. This practice is often referred to as 'self-botting'.
 This kind of automation may be considered a violation of [Telegram's Terms of Service](https://telegram.org/tos), which can prohibit bot-like activity from user accounts.
@@ -134,16 +174,40 @@ Yes. When creating or modifying a rule, you can choose to forward messages from
 --- **✨ Advanced Features & Formatting** ---
 * **How does forwarding to a topic work?**
 Use the "Set by Replying" feature. Go into the specific comment thread (topic) you want to forward to and reply to any message there with `set`. The plugin will automatically save the correct ID for that thread.
+* **How are replies handled?**
+With "Quote Replies" enabled, a reply to a message that the same rule already forwarded is sent as a real reply to that copy in the destination. If the original was never forwarded there, a short quote of it is added on top instead.
+* **Can I forward messages that were sent before the rule existed?**
+Yes. Open the rule's "Manage Rule" dialog and tap "Backfill History...". Enter how many of the latest messages to copy, or a start date (YYYY-MM-DD). The backfill runs in the background at the "Backfill Speed" set in the General Settings, and picks up where it stopped if the app is closed.
 * **How does the Anti-Spam Firewall work?**
-It's a rate-limiter that prevents a single user from flooding your destination chat. It works by enforcing a minimum time delay between forwards *from the same person*. You can configure this delay in the General Settings.
+It's a rate-limiter that prevents a single user from flooding your destination chat. Each person gets a small allowance per source chat ("Anti-Spam Burst"), refilled at one message per "Anti-Spam Delay". Both are in the General Settings. By default, messages over the limit are dropped. Tick "Delay Rate-Limited Messages" in a rule to hold them until a slot frees up instead (for up to 5 minutes).
 * **How do the content filters work?**
 When creating or modifying a rule, you'll see checkboxes for different message types (Text, Photos, Videos, etc.). Simply uncheck any content type you *don't* want to be forwarded for that specific rule. For example, you can set up a rule to forward only photos and videos from a channel, ignoring all text messages.
+* **What does the Near-Duplicate Filter do?**
+Aggregator channels often repost the same text with small edits (different emoji, a trailing link). Enter a number of bits (1-7) in the rule's "Near-Duplicate Filter" field to drop texts that are almost identical to one forwarded by the same rule in the last few hours. Higher values catch looser copies; `2`-`3` is a good start. Leave it empty to disable.
+* **What is Digest mode?**
+For chatty groups, set a "Digest Window" (in seconds) on the rule. Text messages that arrive within the window are merged into a single message, separated by blank lines, with all formatting kept. A digest is sent early when it would grow past "Digest Max Characters" (or Telegram's 4096-character limit). Media messages are never merged. They flush any pending digest first, so the order is kept.
+* **What are Delivery Windows?**
+A rule's "Delivery Window" limits when the destination receives posts, e.g. `09:00-18:00` (your phone's local time). Several windows can be comma-separated, and a window such as `22:00-02:00` wraps past midnight. Messages that arrive outside the window are held and sent in order when it next opens. Held messages survive a restart and are refetched from Telegram. With "Let Telegram Hold Messages", they are sent right away as scheduled messages instead. Replies to scheduled messages can't be threaded.
+* **What does Queue Priority do?**
+All rules of an account share one queue, which is processed in order. A rule set to "High" jumps ahead of "Normal" and "Low" rules, so an alert channel isn't stuck behind a large media backlog. Each rule's own messages always stay in order. Waiting messages slowly gain priority, so low-priority rules are delayed but never stalled.
+* **How can I try out a rule without spamming the destination?**
+Tick "Shadow Mode" in the rule. Messages then go through the whole rule (filters, keywords, duplicate checks, headers) but nothing is sent. Open the rule's "Manage Rule" dialog and tap "Shadow Report..." to see how many messages it would have forwarded, why the others were dropped, how many send requests per minute that would cost and how much media would be sent again. Untick it when the numbers look right. Shadow rules can't backfill, and the counts reset when the plugin restarts.
+* **What happens to very long messages?**
+Texts longer than Telegram's 4096-character limit (or captions over 1024 characters) are split at paragraph, line or sentence breaks. The parts are sent one after another, with formatting kept. A long album caption continues in messages right after the album.
+* **What are rule chains and loops?**
+Rules can feed each other. With A→B and B→C, messages from A reach C through B, and B's rule treats our copy like any other message in B. If rules form a loop (A→B and B→A), messages bounce until the duplicate checks catch them, so the rules list shows a warning for every loop it finds. With "Short-Circuit Rule Chains" enabled, the echoes of the plugin's own copies are ignored. Each copy is handed straight to the next rule's queue instead, and a chain stops before it would reach a chat that already has the message, so each chat in a loop receives it once.
+* **Does it work with several logged-in accounts?**
+Yes. Each account has its own rules, created from that account's chats, and all of them run at the same time, whichever account is open. Each account has its own queue, so a flood wait on one account doesn't delay the others. The rules list shows which account a rule belongs to. Switch to that account to modify it. Accounts you log into later are picked up the next time the plugin loads.
+* **Can I copy my rules to another phone?**
+Yes. "Export Rules" (under the rules list) copies the open account's rules and any General Settings you changed to the clipboard as JSON. On the other device, copy that text and tap "Import Rules from Clipboard". The file is checked first, and nothing is saved if any part of it is invalid. Destinations are looked up in one batch, then a preview lists the new and changed rules and settings before anything is saved. Rules missing from the file are kept, unless you choose "Replace All". Destinations can be chat IDs or @usernames. The account importing the rules must be a member of the source chats.
 * **How does keyword/regex filtering work?**
 You can specify keywords or regex patterns that messages must contain to be forwarded. This works for text messages, media captions, and **document filenames**:
 - **Keywords:** Simple text matching (case-insensitive). Example: `"bitcoin"` will match messages containing "Bitcoin", "BITCOIN", etc.
 - **Regex Patterns:** Advanced pattern matching. Example: `"\\\\b(btc|bitcoin|₿)\\\\b"` will match whole words containing btc, bitcoin, or the bitcoin symbol.
 - **Leave the field empty** to disable keyword filtering (forward all messages that pass other filters).
-- If a regex pattern fails to compile, it will fall back to simple case-insensitive text matching.
+- Invalid regex patterns, and patterns prone to catastrophic backtracking such as `(a+)+` or `(a|aa)+`, are rejected when you save the rule.
+- Patterns with several repeats that can match the same characters, such as `.*a.*b.*c`, are saved with a warning: on some long messages they can be slow, and a pattern that keeps running over its time budget is suspended.
+- A pattern that keeps running too slowly on real messages is suspended for that rule until you edit it.
 * **Does the plugin support text formatting (Markdown)?**
 Yes, completely. The plugin perfectly preserves all text formatting from the original message. This includes:
 - **Bold** and *italic* text
@@ -155,12 +219,17 @@ Yes, completely. The plugin perfectly preserves all text formatting from the ori
 
 --- **⚙️ Technical Settings & Troubleshooting** ---
 * **What do the General Settings mean?**
-- **Min/Max Message Length:** Filters *text messages* based on their character count.
+- **Min/Max Message Length:** Filters *text messages* based on their character count. A maximum of `0` means no limit. Texts longer than Telegram allows are split into several messages.
 - **Media Deferral Timeout:** A safety net for media files. When a file arrives, your app might need a moment to get the data required for forwarding. This is how long the plugin waits. Increase this value if large files you receive sometimes fail to forward.
 - **Album Buffering Timeout:** When a gallery of photos/videos is sent, the plugin waits a brief moment to collect all the images before forwarding them together as a single album. This controls that waiting period.
 - **Sequential Delay:** The core setting for ordered forwarding. It's the pause between each sent message to enforce a strict sequence. Set to 0 to disable and restore high-speed parallel forwarding (which may break order).
 - **Deduplication Window:** Prevents double-forwards from client notification glitches. If Telegram sends a duplicate notification for the same message within this time window (in seconds), the plugin will ignore it.
+- **Content Deduplication Window:** Skips a photo, file or text that was already sent to the same destination within this time window, even if it came from a different source chat. Useful when mirroring channels that repost each other. Set to `0` to disable.
 - **Anti-Spam Delay:** The secondary rate-limiter. Set to `0` unless you need to slow down forwards from a specific user.
+- **Anti-Spam Burst:** How many messages one user may send back-to-back before the Anti-Spam Delay kicks in.
+- **Backfill Speed:** How many messages per minute a history backfill may forward. Lower it if backfills run into flood limits.
+* **What does "Engine Health" show?**
+One line per account's worker, with how many messages it has queued, plus the update checker. A supervisor checks them every few seconds. A worker that crashed, or that has been stuck on one message for 3 minutes (for example a network call that never returns), is replaced, and the message it was holding is retried first. If that message had already been sent to Telegram, it may have arrived, so it is not retried and the rule shows an error instead. Red lines mean something is wrong right now.
 * **Why do large files I send myself sometimes fail to forward?**
 This is a known limitation. If your file takes longer to upload than the "Media Deferral Timeout", the plugin may not be able to forward it. The feature is most reliable for forwarding messages you receive or for your own small files that upload instantly.
 """
@@ -169,26 +238,962 @@ This is a known limitation. If your file takes longer to upload than the "Media
 
 class DeferredTask(dynamic_proxy(Runnable)):
     """A proxy class to run a message processing task after a delay."""
-    def __init__(self, plugin, event_key):
+    def __init__(self, plugin, account, event_key, source_chat_id):
         super().__init__()
         self.plugin = plugin
+        self.account = account
         self.event_key = event_key
+        self.source_chat_id = source_chat_id
 
     def run(self):
-        self.plugin._process_timed_out_message(self.event_key)
+        # Timed-out messages rejoin their rule's lane, so they stay ordered and are sent off the UI thread.
+        self.plugin._get_processing_queue(self.account).put(("deferred", self.event_key, self.source_chat_id))
 
 
 class AlbumTask(dynamic_proxy(Runnable)):
     """A proxy class to run album processing after a short buffer period."""
-    def __init__(self, plugin, grouped_id):
+    def __init__(self, plugin, account, grouped_id, source_chat_id):
         super().__init__()
         self.plugin = plugin
+        self.account = account
         self.grouped_id = grouped_id
+        self.source_chat_id = source_chat_id
 
     def run(self):
         # Instead of processing, just put a reference to the complete album on the queue.
         # The worker will pick it up and process it in the correct sequential order.
-        self.plugin.processing_queue.put(("album", self.grouped_id))
+        self.plugin._get_processing_queue(self.account).put(("album", self.grouped_id, self.source_chat_id))
+
+class ThrottleReleaseTask(dynamic_proxy(Runnable)):
+    """A proxy class to hand a rate-limited message back to the worker once its send slot arrives."""
+    def __init__(self, plugin, message_object, event_key):
+        super().__init__()
+        self.plugin = plugin
+        self.message_object = message_object
+        self.event_key = event_key
+
+    def run(self):
+        self.plugin._get_processing_queue(self.message_object.currentAccount).put(("release", self.message_object, self.event_key))
+
+class DigestTask(dynamic_proxy(Runnable)):
+    """A proxy class to flush a rule's digest once its collection window closes."""
+    def __init__(self, plugin, account, source_chat_id, token):
+        super().__init__()
+        self.plugin = plugin
+        self.account = account
+        self.source_chat_id = source_chat_id
+        self.token = token
+
+    def run(self):
+        self.plugin._get_processing_queue(self.account).put(("digest", self.source_chat_id, self.token))
+
+# --- Engine Helpers ---
+
+class EngineState:
+    """
+    The mutable message state of one account. Only that account's worker thread touches it;
+    other threads hand it work by putting commands on the account's processing queue.
+    """
+    def __init__(self):
+        self.deferred_messages = {}
+        self.album_buffer = {}
+        self.processed_keys = collections.deque(maxlen=200)
+        self.digest_buffers = {}
+        self.throttled_messages = {}
+
+    def handover(self):
+        """
+        A copy for a replacement worker, so a hung predecessor that wakes up again only
+        touches the old containers. Copying a dict or deque is atomic under the GIL.
+        """
+        state = EngineState()
+        state.deferred_messages = dict(self.deferred_messages)
+        state.album_buffer = {grouped_id: {'messages': list(entry['messages']), 'task': entry['task']}
+                              for grouped_id, entry in list(self.album_buffer.items())}
+        state.processed_keys = collections.deque(list(self.processed_keys), maxlen=self.processed_keys.maxlen)
+        state.digest_buffers = {rule_key: dict(buffer, parts=list(buffer["parts"])) for rule_key, buffer in list(self.digest_buffers.items())}
+        state.throttled_messages = dict(self.throttled_messages)
+        return state
+
+
+class WorkerReplaced(Exception):
+    """Raised in a worker that lost ownership of its account's state to a replacement."""
+
+
+class LRUCache:
+    """
+    A thread-safe, OrderedDict-backed LRU cache with O(1) lookups and touches.
+    With a `ttl` (seconds), entries also expire that long after they were last written.
+    """
+    def __init__(self, capacity, ttl=None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._data = collections.OrderedDict()  # key -> (value, written_at)
+        self._lock = threading.Lock()
+
+    def _is_expired(self, written_at, now):
+        return self.ttl is not None and now - written_at > self.ttl
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            if self._is_expired(entry[1], time.time()):
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def put_if_absent(self, key, value):
+        """Stores `value` unless a live entry exists. Returns True if it was stored."""
+        with self._lock:
+            now = time.time()
+            entry = self._data.get(key)
+            if entry is not None and not self._is_expired(entry[1], now):
+                self._data.move_to_end(key)
+                return False
+            self._data[key] = (value, now)
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        """A membership test: holds for a live entry even if its value is None, and doesn't touch its recency."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False
+            if self._is_expired(entry[1], time.time()):
+                del self._data[key]
+                return False
+            return True
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TokenBucket:
+    """
+    Hands out send slots at `rate` per second with bursts of up to `capacity`.
+    Tokens may go negative: each reservation past the burst queues behind the ones before it.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.time()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, now):
+        """Takes a token if one is available right now."""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def reserve(self, now, max_wait):
+        """Reserves the next slot and returns how long to wait for it, or None if that exceeds `max_wait`."""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        if wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+
+
+class MessageIdMap:
+    """
+    Remembers which destination message each forwarded source message became.
+    A small in-memory LRU serves the hot path; misses fall through to a larger,
+    persistent index that is loaded lazily and flushed to storage in the background.
+    """
+    def __init__(self, plugin, cache_size, index_size, flush_interval):
+        self.plugin = plugin
+        self.cache = LRUCache(cache_size)
+        self.index_size = index_size
+        self.flush_interval = flush_interval
+        self._index = None
+        self._dirty = False
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(account, source_chat_id, source_msg_id, dest_id):
+        return f"{account}:{source_chat_id}:{source_msg_id}:{dest_id}"
+
+    def _ensure_index(self):
+        if self._index is not None:
+            return
+        try:
+            stored = json.loads(self.plugin.get_setting(MESSAGE_ID_MAP_KEY, "{}"))
+            # Older entries had no account (they belong to the selected one) or were keyed by
+            # source only; their value still names the destination.
+            legacy = {1: lambda k, v: f"{UserConfig.selectedAccount}:{k}:{v[0]}", 2: lambda k, v: f"{UserConfig.selectedAccount}:{k}"}
+            self._index = collections.OrderedDict(
+                (legacy[k.count(":")](k, v) if k.count(":") in legacy else k, tuple(v)) for k, v in stored.items())
+        except Exception:
+            self._index = collections.OrderedDict()
+
+    def get(self, account, source_chat_id, source_msg_id, dest_id):
+        """Returns (dest_id, dest_msg_id) for a message `account` forwarded to `dest_id`, or None."""
+        key = self._key(account, source_chat_id, source_msg_id, dest_id)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry
+        with self._lock:
+            self._ensure_index()
+            entry = self._index.get(key)
+        if entry is not None:
+            self.cache.put(key, entry)
+        return entry
+
+    def put(self, account, source_chat_id, source_msg_id, dest_id, dest_msg_id):
+        key, entry = self._key(account, source_chat_id, source_msg_id, dest_id), (dest_id, dest_msg_id)
+        self.cache.put(key, entry)
+        with self._lock:
+            self._ensure_index()
+            self._index[key] = entry
+            self._index.move_to_end(key)
+            while len(self._index) > self.index_size:
+                self._index.popitem(last=False)
+            self._dirty = True
+
+    def flush(self, force=False):
+        """Persists the index if it changed and the flush interval has passed."""
+        with self._lock:
+            if not self._dirty or (not force and time.time() - self._last_flush < self.flush_interval):
+                return
+            payload = json.dumps({k: list(v) for k, v in self._index.items()})
+            self._dirty = False
+            self._last_flush = time.time()
+        self.plugin.set_setting(MESSAGE_ID_MAP_KEY, payload)
+
+class RuleGraph:
+    """
+    The source → destination graph of the enabled rules, rebuilt whenever the rule table is
+    swapped. Nodes are (account, chat id) pairs, since a rule only sees its own account's chats.
+    Each source has one destination, so every walk either ends or enters a loop.
+    """
+    def __init__(self, rules):
+        self.edges = {(account, source_id): (account, rule["destination"]) for (account, source_id), rule in rules.items()
+                      if rule.get("enabled", False) and rule.get("destination")}
+        self.cycles = self._find_cycles()
+
+    def _find_cycles(self):
+        cycles, walk_of = [], {}
+        for start in self.edges:
+            path, node = [], start
+            while node in self.edges and node not in walk_of:
+                walk_of[node] = start
+                path.append(node)
+                node = self.edges[node]
+            # Only a loop closed during this walk is new; meeting an earlier walk is not a loop.
+            if walk_of.get(node) == start:
+                cycles.append(path[path.index(node):])
+        return cycles
+
+    def downstream(self, source_id):
+        """
+        The rule keys a message from rule `source_id` would pass through after its first hop, in
+        order. The walk stops at the first hop whose destination already has the message (the
+        origin chat, the first destination or an earlier hop), so each chat receives it once.
+        """
+        first = self.edges.get(source_id)
+        hops, served, node = [], {source_id, first}, first
+        while node in self.edges:
+            destination = self.edges[node]
+            if destination in served:
+                break
+            hops.append(node)
+            served.add(destination)
+            node = destination
+        return hops
+
+class LaneScheduler:
+    """
+    A drop-in replacement for queue.Queue that keeps one FIFO lane per source chat and
+    serves the lane whose head has the best priority. A head's priority improves the longer
+    it waits (one level per `aging_seconds`), so bulk lanes are delayed but never starved.
+    """
+    def __init__(self, classify, aging_seconds):
+        self.classify = classify
+        self.aging_seconds = aging_seconds
+        self._lanes = {}
+        self._paused = {}
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def _rank(self, head, now):
+        enqueued_at, priority, _ = head
+        return (priority - (now - enqueued_at) / self.aging_seconds, enqueued_at)
+
+    def put(self, item, front=False, enqueued_at=None):
+        """
+        Appends an item to its lane, or with `front` puts it back at the head (for retries).
+        A retry passes the `enqueued_at` it was first queued with, so it keeps the age it had.
+        """
+        lane, priority = self.classify(item)
+        with self._cond:
+            lane_items = self._lanes.setdefault(lane, collections.deque())
+            entry = (time.time() if enqueued_at is None else enqueued_at, priority, item)
+            if front:
+                lane_items.appendleft(entry)
+            else:
+                lane_items.append(entry)
+            self._size += 1
+            self._cond.notify()
+
+    def pause(self, lane, until):
+        """Holds a lane's items back until `until` (a time.time()), e.g. through a FLOOD_WAIT."""
+        with self._cond:
+            self._paused[lane] = max(until, self._paused.get(lane, 0))
+            self._cond.notify_all()
+
+    def get(self, timeout=None, include_paused=False):
+        """Pops the next item, raising queue.Empty if none arrives within `timeout`."""
+        return self.get_entry(timeout, include_paused)[0]
+
+    def get_entry(self, timeout=None, include_paused=False):
+        """Like get(), but returns (item, enqueued_at). Paused lanes are skipped unless `include_paused`."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                now = time.time()
+                self._paused = {lane: until for lane, until in self._paused.items() if until > now}
+                ready = [lane for lane in self._lanes if include_paused or lane not in self._paused]
+                if ready:
+                    break
+                waits = [until - now for lane, until in self._paused.items() if lane in self._lanes]
+                if deadline is not None:
+                    if deadline <= now:
+                        raise queue.Empty
+                    waits.append(deadline - now)
+                self._cond.wait(min(waits) if waits else None)
+            lane = min(ready, key=lambda key: self._rank(self._lanes[key][0], now))
+            lane_items = self._lanes[lane]
+            enqueued_at, _, item = lane_items.popleft()
+            if not lane_items:
+                del self._lanes[lane]
+            self._size -= 1
+            return item, enqueued_at
+
+    def task_done(self):
+        pass
+
+    def lane_sizes(self):
+        """Returns the number of queued items per lane."""
+        with self._cond:
+            return {lane: len(lane_items) for lane, lane_items in self._lanes.items()}
+
+    def qsize(self):
+        with self._cond:
+            return self._size
+
+class DeliveryScheduler:
+    """
+    A persistent min-heap of messages held until their rule's delivery window opens.
+    The worker polls it between items, so held messages cost no threads or timers.
+    Held message objects are kept in memory; after a restart they are refetched by id.
+    Holds are flushed to storage at most every `flush_interval` seconds; releases right away.
+    """
+    def __init__(self, plugin, flush_interval):
+        self.plugin = plugin
+        self.flush_interval = flush_interval
+        self._heap = None
+        self._next_seq = 0
+        self._message_objects = {}
+        self._dirty = False
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+
+    def _ensure_heap(self):
+        if self._heap is not None:
+            return
+        try:
+            stored = json.loads(self.plugin.get_setting(SCHEDULED_DELIVERIES_KEY, "[]"))
+            # Entries written before multi-account support have no account; they belong to the selected one.
+            self._heap = [(float(e[0]), int(e[1]), int(e[2]) if len(e) == 5 else UserConfig.selectedAccount, int(e[-2]), tuple(e[-1]))
+                          for e in stored]
+            heapq.heapify(self._heap)
+        except Exception:
+            self._heap = []
+        self._next_seq = max((entry[1] for entry in self._heap), default=0) + 1
+
+    def flush(self, force=False):
+        """Persists the heap if it changed and the flush interval has passed."""
+        with self._lock:
+            if not self._dirty or (not force and time.time() - self._last_flush < self.flush_interval):
+                return
+            payload = json.dumps([[due, seq, account, src, list(ids)] for due, seq, account, src, ids in self._heap])
+            self._dirty = False
+            self._last_flush = time.time()
+        self.plugin.set_setting(SCHEDULED_DELIVERIES_KEY, payload)
+
+    def hold(self, due, account, source_chat_id, message_objects):
+        """Holds a message, or an album's messages, until `due`."""
+        ids = tuple(mo.messageOwner.id for mo in message_objects)
+        with self._lock:
+            self._ensure_heap()
+            heapq.heappush(self._heap, (due, self._next_seq, account, source_chat_id, ids))
+            self._next_seq += 1
+            self._message_objects[(account, source_chat_id, ids)] = message_objects
+            self._dirty = True
+        self.flush()
+
+    def pop_due(self, now):
+        """Returns (account, source_chat_id, message_ids, message_objects or None) for every entry that is due."""
+        due_entries = []
+        with self._lock:
+            self._ensure_heap()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, account, source_chat_id, ids = heapq.heappop(self._heap)
+                due_entries.append((account, source_chat_id, ids, self._message_objects.pop((account, source_chat_id, ids), None)))
+            if due_entries:
+                self._dirty = True
+        if due_entries:
+            # Released entries are forgotten right away, so a restart can't send them twice.
+            self.flush(force=True)
+        return due_entries
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_heap()
+            return len(self._heap)
+
+class DestinationResolver:
+    """
+    Resolves destination inputs (numeric ids, @usernames, t.me links) to (storage_id, name).
+    Results are cached per account in settings for `ttl` seconds, concurrent lookups of the
+    same input share one request, and many ids resolve in a single batch.
+    """
+    def __init__(self, plugin, cache_size, ttl):
+        self.plugin = plugin
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self._cache = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(account, query):
+        if isinstance(query, int):
+            return f"{account}:id:{query}"
+        return f"{account}:name:{query.replace('@', '').split('/')[-1].strip().lower()}"
+
+    def _ensure_cache(self):
+        if self._cache is not None:
+            return
+        try:
+            self._cache = collections.OrderedDict(json.loads(self.plugin.get_setting(RESOLVER_CACHE_KEY, "{}")))
+        except Exception:
+            self._cache = collections.OrderedDict()
+
+    def _get_cached(self, key):
+        with self._lock:
+            self._ensure_cache()
+            entry = self._cache.get(key)
+            if entry and time.time() - entry[2] < self.ttl:
+                return entry[0], entry[1]
+            return None
+
+    def _store(self, results):
+        """Caches a {key: result} batch with a single settings write."""
+        if not results:
+            return
+        with self._lock:
+            self._ensure_cache()
+            now = time.time()
+            for key, result in results.items():
+                self._cache.pop(key, None)
+                self._cache[key] = [result[0], result[1], now]
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            self.plugin.set_setting(RESOLVER_CACHE_KEY, json.dumps(self._cache))
+
+    def _entity_result(self, entity):
+        return self.plugin._get_id_for_storage(entity), self.plugin._get_entity_name(entity)
+
+    def _get_local_entity(self, account, input_id):
+        """Looks an id up in the client's own cache, trying the -100 supergroup form too."""
+        controller = MessagesController.getInstance(account)
+        for chat_id in (abs(input_id), self.plugin._sanitize_chat_id_for_request(input_id)):
+            entity = controller.getChat(chat_id)
+            if entity: return entity
+        return controller.getUser(input_id) if input_id > 0 else None
+
+    def resolve(self, account, query, callback):
+        """Resolves one input; `callback(result, error_text)` gets (storage_id, name) or None."""
+        self.resolve_many(account, [query], lambda results: callback(*results[query]))
+
+    def resolve_many(self, account, queries, callback):
+        """
+        Resolves many inputs at once. Cached and locally known inputs are answered directly,
+        all unknown ids share one messages.getChats / channels.getChannels batch, and usernames
+        are resolved in parallel. `callback(results)` maps each query to (result, error_text);
+        queries that name the same chat (`@Foo` and `foo`) share one lookup and its result.
+        """
+        results, to_request, local = {}, {}, {}
+        for query in dict.fromkeys(queries):
+            key = self._key(account, query)
+            if key in to_request:
+                to_request[key].append(query)
+                continue
+            cached = local.get(key) or self._get_cached(key)
+            entity = self._get_local_entity(account, query) if cached is None and isinstance(query, int) else None
+            if cached:
+                results[query] = (cached, None)
+            elif entity:
+                local[key] = self._entity_result(entity)
+                results[query] = (local[key], None)
+            else:
+                to_request[key] = [query]
+        self._store(local)
+        if not to_request:
+            callback(results)
+            return
+
+        remaining = {"count": len(to_request)}
+        remaining_lock = threading.Lock()
+        def on_one_done(key_queries, result, error_text):
+            with remaining_lock:
+                for query in key_queries:
+                    results[query] = (result, error_text)
+                remaining["count"] -= 1
+                done = remaining["count"] == 0
+            if done:
+                callback(results)
+
+        new_ids = []
+        for key, key_queries in to_request.items():
+            with self._lock:
+                # Coalesce with a lookup of the same input that is already in flight.
+                waiters = self._pending.get(key)
+                self._pending.setdefault(key, []).append(lambda r, e, q=key_queries: on_one_done(q, r, e))
+            if waiters is not None:
+                continue
+            if isinstance(key_queries[0], int):
+                new_ids.append((key, key_queries[0]))
+            else:
+                self._request_username(account, key, key_queries[0])
+        if new_ids:
+            self._request_ids(account, new_ids)
+
+    def _complete(self, outcomes):
+        """Caches the successful (key, result, error_text) outcomes in one write, then wakes their waiters."""
+        self._store({key: result for key, result, _ in outcomes if result})
+        for key, result, error_text in outcomes:
+            with self._lock:
+                waiters = self._pending.pop(key, [])
+            for waiter in waiters:
+                try:
+                    waiter(result, error_text)
+                except Exception:
+                    log(f"[{self.plugin.id}] ERROR in resolver callback: {traceback.format_exc()}")
+
+    def _request_username(self, account, key, username):
+        def on_resolved(response, error):
+            entity = None
+            if response is not None and not error:
+                controller = MessagesController.getInstance(account)
+                if hasattr(response, 'chats') and response.chats and not response.chats.isEmpty():
+                    entity = response.chats.get(0)
+                    controller.putChats(response.chats, False)
+                elif hasattr(response, 'users') and response.users and not response.users.isEmpty():
+                    entity = response.users.get(0)
+                    controller.putUsers(response.users, False)
+            if entity:
+                self._complete([(key, self._entity_result(entity), None)])
+            else:
+                self._complete([(key, None, getattr(error, 'text', None) or "Not found")])
+        req = TLRPC.TL_contacts_resolveUsername()
+        req.username = username.replace("@", "").split("/")[-1]
+        ConnectionsManager.getInstance(account).sendRequest(req, RequestCallback(on_resolved))
+
+    def _request_ids(self, account, keyed_ids):
+        """
+        Looks up ids the client doesn't know with one messages.getChats (basic groups, every
+        id form) and one channels.getChannels (channels and supergroups) request. One bad id
+        (CHANNEL_INVALID, say) fails a whole request, so a failed batch is retried in halves
+        until the bad ids are isolated.
+        """
+        controller = MessagesController.getInstance(account)
+        chat_ids, channel_inputs, candidate_ids = [], [], {}
+        for key, input_id in keyed_ids:
+            short_id = self.plugin._sanitize_chat_id_for_request(input_id)
+            candidate_ids[key] = {short_id, abs(input_id)}
+            chat_ids.extend(chat_id for chat_id in candidate_ids[key] if chat_id not in chat_ids)
+            # Channels the client hasn't seen have no access hash; 0 still works for ones we are in.
+            cached_channel = controller.getChat(short_id)
+            input_channel = TLRPC.TL_inputChannel()
+            input_channel.channel_id = short_id
+            input_channel.access_hash = getattr(cached_channel, 'access_hash', 0) if cached_channel else 0
+            channel_inputs.append(input_channel)
+
+        def chats_request(ids):
+            req = TLRPC.TL_messages_getChats()
+            req.id = ArrayList([Long(chat_id) for chat_id in ids])
+            return req
+
+        def channels_request(inputs):
+            req = TLRPC.TL_channels_getChannels()
+            req.id = ArrayList(inputs)
+            return req
+
+        found, errors, pending = {}, [], {"count": 2}
+        found_lock = threading.Lock()
+        connections = ConnectionsManager.getInstance(account)
+        def send(make_request, batch):
+            connections.sendRequest(make_request(batch), RequestCallback(lambda response, error: on_batch(make_request, batch, response, error)))
+
+        def on_batch(make_request, batch, response, error):
+            split = response is None and error and len(batch) > 1
+            with found_lock:
+                if response is not None and hasattr(response, 'chats') and response.chats:
+                    controller.putChats(response.chats, False)
+                    for i in range(response.chats.size()):
+                        chat = response.chats.get(i)
+                        if not isinstance(chat, (TLRPC.TL_chatForbidden, TLRPC.TL_channelForbidden)):
+                            found[chat.id] = chat
+                elif error and not split:
+                    errors.append(getattr(error, 'text', None) or str(error))
+                # The halves are counted before this batch is, so the count never hits 0 early.
+                pending["count"] += 1 if split else -1
+                done = pending["count"] == 0
+            if split:
+                middle = len(batch) // 2
+                send(make_request, batch[:middle])
+                send(make_request, batch[middle:])
+                return
+            if not done:
+                return
+            outcomes = []
+            for key, ids in candidate_ids.items():
+                entity = next((found[chat_id] for chat_id in ids if chat_id in found), None)
+                if entity:
+                    outcomes.append((key, self._entity_result(entity), None))
+                else:
+                    outcomes.append((key, None, errors[0] if errors else "Not found"))
+            self._complete(outcomes)
+        send(chats_request, chat_ids)
+        send(channels_request, channel_inputs)
+
+class FilterPlan:
+    """
+    An ordered list of a rule's filter predicates that re-sorts itself by measured cost
+    and selectivity, so the cheapest, most selective checks run first. Ranking uses the
+    classic cost / drop-rate ratio, smoothed with per-predicate priors until enough
+    samples have been seen. The live worker and the backfill thread share a rule's plan,
+    so stats are recorded under a lock; predicates themselves run outside it.
+    """
+    REORDER_INTERVAL = 64
+    PRIOR_WEIGHT = 4
+
+    def __init__(self, rule, predicates):
+        self.rule = rule
+        self.predicates = list(predicates)  # (name, func, prior_cost_seconds)
+        self.stats = {name: [0, 0, 0.0] for name, _, _ in self.predicates}  # calls, drops, total seconds
+        self.evaluations = 0
+        self._lock = threading.Lock()
+
+    def evaluate(self, message_object, exclude=()):
+        """Runs the predicates in plan order, skipping `exclude`. Returns the name of the first failing one, or None."""
+        failed = None
+        for name, func, _ in self.predicates:  # A reorder swaps in a new list; this loop keeps the old one.
+            if name in exclude:
+                continue
+            started = time.perf_counter()
+            passed = func(message_object)
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stats = self.stats[name]
+                stats[0] += 1
+                stats[2] += elapsed
+                if not passed:
+                    stats[1] += 1
+            if not passed:
+                failed = name
+                break
+        with self._lock:
+            self.evaluations += 1
+            if self.evaluations % self.REORDER_INTERVAL == 0:
+                self._reorder()
+        return failed
+
+    def _reorder(self):
+        """Re-sorts the plan by rank; the caller holds the lock."""
+        def rank(predicate):
+            name, _, prior_cost = predicate
+            calls, drops, total = self.stats[name]
+            cost = (total + prior_cost * self.PRIOR_WEIGHT) / (calls + self.PRIOR_WEIGHT)
+            drop_rate = (drops + 0.5 * self.PRIOR_WEIGHT) / (calls + self.PRIOR_WEIGHT)
+            return cost / max(drop_rate, 0.001)
+        self.predicates = sorted(self.predicates, key=rank)
+
+class RegexRisk:
+    """
+    Static analysis of a keyword regex, on the parse tree of Python's own regex parser.
+    `unsafe` describes a construct that backtracks exponentially, or is None. `degree` is
+    the polynomial degree of the worst case: one for the scan over start positions, plus
+    the longest chain of unbounded repeats that can trade characters with each other
+    (like the two in `.*a.*b`).
+    Character sets are compared on a sample alphabet (Latin-1, a few other scripts and
+    every character the pattern names), which is enough to tell overlap from disjointness.
+    """
+    SAMPLE_CHARS = ''.join(map(chr, range(0x180))) + "\u00a0\u2003\u0430\u044f\u05d0\u0663\u4e2d\U0001f600"
+    CATEGORY_TESTS = {
+        "CATEGORY_DIGIT": re.compile(r"\d"), "CATEGORY_NOT_DIGIT": re.compile(r"\D"),
+        "CATEGORY_SPACE": re.compile(r"\s"), "CATEGORY_NOT_SPACE": re.compile(r"\S"),
+        "CATEGORY_WORD": re.compile(r"\w"), "CATEGORY_NOT_WORD": re.compile(r"\W"),
+        "CATEGORY_LINEBREAK": re.compile(r"\n"), "CATEGORY_NOT_LINEBREAK": re.compile(r"[^\n]"),
+    }
+    REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) if sre_parse else ()
+    POSSESSIVE_REPEAT = getattr(sre_parse, "POSSESSIVE_REPEAT", None)  # Python 3.11+
+    ATOMIC_GROUP = getattr(sre_parse, "ATOMIC_GROUP", None)  # Python 3.11+
+
+    def __init__(self, pattern):
+        """Raises re.error for an invalid pattern."""
+        if sre_parse is None:
+            raise RuntimeError("Python's regex parser is not available")
+        tree = sre_parse.parse(pattern, re.IGNORECASE)
+        self.unsafe = None
+        self.degree = 1
+        self._alphabet = set(self.SAMPLE_CHARS)
+        for op, av in self._nodes(tree):
+            if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL):
+                self._alphabet.add(chr(av))
+            elif op is sre_parse.RANGE:
+                self._alphabet.update((chr(av[0]), chr(av[1])))
+        self._sequence(tree)
+
+    def _nodes(self, items):
+        """Every node of a parse tree, depth first."""
+        for op, av in items:
+            yield op, av
+            if op is sre_parse.IN:
+                yield from self._nodes(av)
+            elif op is sre_parse.BRANCH:
+                for alternative in av[1]:
+                    yield from self._nodes(alternative)
+            elif op is sre_parse.SUBPATTERN or op is self.ATOMIC_GROUP:
+                yield from self._nodes(av[-1] if op is sre_parse.SUBPATTERN else av)
+            elif op in self.REPEATS or op is self.POSSESSIVE_REPEAT:
+                yield from self._nodes(av[2])
+            elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+                yield from self._nodes(av[1])
+            elif op is sre_parse.GROUPREF_EXISTS:
+                yield from self._nodes(av[1])
+                if av[2]: yield from self._nodes(av[2])
+
+    def _matches(self, op, av, char):
+        if op is sre_parse.LITERAL: return ord(char) == av
+        if op is sre_parse.NOT_LITERAL: return ord(char) != av
+        if op is sre_parse.ANY: return char != "\n"
+        if op is sre_parse.RANGE: return av[0] <= ord(char) <= av[1]
+        if op is sre_parse.CATEGORY: return self.CATEGORY_TESTS[str(av)].match(char) is not None
+        if op is sre_parse.IN:
+            negate = bool(av) and av[0][0] is sre_parse.NEGATE
+            return any(self._matches(item_op, item_av, char) for item_op, item_av in av[negate:]) != negate
+        return False
+
+    def _charset(self, op, av):
+        # Patterns are compiled with IGNORECASE, so either case of a sample counts.
+        return frozenset(c for c in self._alphabet if any(self._matches(op, av, v) for v in {c, c.lower(), c.upper()} if len(v) == 1))
+
+    # A shape is (first, nullable, grow, chars, ambiguous): the characters a match can start
+    # with, whether it can be empty, the characters that can extend an already complete
+    # match, every character it can consume, and whether it holds alternatives that can
+    # match the same text.
+    def _sequence(self, items):
+        shapes = [self._node(op, av) for op, av in items]
+        self._chain_repeats(items, shapes)
+        first, nullable, grow, chars, ambiguous = set(), True, set(), set(), False
+        for i, (s_first, s_nullable, s_grow, s_chars, s_ambiguous) in enumerate(shapes):
+            if nullable: first |= s_first
+            nullable = nullable and s_nullable
+            chars |= s_chars
+            ambiguous = ambiguous or s_ambiguous
+            rest = shapes[i + 1:]
+            if all(shape[1] for shape in shapes[i:]):
+                grow |= s_first  # The match can end before this element or go on into it.
+            # Growing inside this element extends the whole match only if every required
+            # element after it can shift along; a delimiter it can't consume stops that.
+            if s_grow and all(shape[1] or shape[0] & s_grow for shape in rest):
+                grow |= s_grow
+        return frozenset(first), nullable, frozenset(grow), frozenset(chars), ambiguous
+
+    def _chain_repeats(self, items, shapes):
+        """Raises `degree` to cover repeats in this sequence that can start on characters an earlier one consumed."""
+        live = []  # (chars, chain length) of the unbounded repeats a later one could compete with
+        for (op, av), shape in zip(items, shapes):
+            while op is sre_parse.SUBPATTERN and len(av[-1]) == 1:
+                op, av = av[-1][0]
+            if op in self.REPEATS and av[1] == sre_parse.MAXREPEAT:
+                chain = 1 + max((length for chars, length in live if chars & shape[0]), default=0)
+                self.degree = max(self.degree, 1 + chain)
+                live.append((shape[3], chain))
+            elif not shape[1]:
+                # A required element only the repeats that can consume it see past.
+                live = [(chars, length) for chars, length in live if chars & shape[0]]
+
+    def _node(self, op, av):
+        empty = frozenset()
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY, sre_parse.IN):
+            chars = self._charset(op, av)
+            return chars, False, empty, chars, False
+        if op is sre_parse.SUBPATTERN:
+            return self._sequence(av[-1])
+        if op is self.ATOMIC_GROUP:
+            first, nullable, _, chars, ambiguous = self._sequence(av)
+            return first, nullable, empty, chars, ambiguous  # An atomic group never gives back.
+        if op in (sre_parse.BRANCH, sre_parse.GROUPREF_EXISTS):
+            alternatives = av[1] if op is sre_parse.BRANCH else [av[1], av[2] or []]
+            shapes = [self._sequence(alternative) for alternative in alternatives]
+            first = frozenset().union(*(shape[0] for shape in shapes))
+            nullable = any(shape[1] for shape in shapes)
+            grow = frozenset().union(*(shape[2] for shape in shapes), first if nullable else empty)
+            overlapping = any(a[0] & b[0] or a[1] and b[1] for i, a in enumerate(shapes) for b in shapes[i + 1:])
+            return (first, nullable, grow, frozenset().union(*(shape[3] for shape in shapes)),
+                    overlapping or any(shape[4] for shape in shapes))
+        if op in self.REPEATS or op is self.POSSESSIVE_REPEAT:
+            low, high, body = av
+            first, nullable, grow, chars, ambiguous = self._sequence(body)
+            if op is self.POSSESSIVE_REPEAT:
+                return first, low == 0 or nullable, empty, chars, ambiguous
+            if high == sre_parse.MAXREPEAT:
+                if self.unsafe is None:
+                    if ambiguous:
+                        self.unsafe = "a repeated group has alternatives that can match the same text"
+                    elif grow & first:
+                        self.unsafe = "a repeated group can split the same text between its iterations in many ways"
+            if high > low:
+                grow = grow | first
+            return first, low == 0 or nullable, grow, chars, ambiguous
+        if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            self._sequence(av[1])  # Zero-width, but its own repeats are checked.
+        if op is sre_parse.GROUPREF:
+            everything = frozenset(self._alphabet)
+            return everything, True, empty, everything, False
+        return empty, True, empty, empty, False
+
+class SimHashIndex:
+    """
+    A time-bounded index of 64-bit SimHash fingerprints for near-duplicate lookups.
+    Fingerprints are split into `threshold + 1` bands; by the pigeonhole principle any
+    fingerprint within `threshold` bits of a query shares at least one band exactly,
+    so only same-bucket candidates need a full Hamming distance check.
+    """
+    def __init__(self, threshold, capacity, ttl):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        bands = threshold + 1
+        width = 64 // bands
+        self._bands = [(i * width, 64 - i * width if i == bands - 1 else width) for i in range(bands)]
+        self._entries = collections.deque()  # (written_at, fingerprint)
+        self._buckets = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def _band_keys(self, fingerprint):
+        return [(i, (fingerprint >> shift) & ((1 << width) - 1)) for i, (shift, width) in enumerate(self._bands)]
+
+    def _evict(self, now):
+        while self._entries and (len(self._entries) > self.capacity or now - self._entries[0][0] > self.ttl):
+            _, fingerprint = self._entries.popleft()
+            for band_key in self._band_keys(fingerprint):
+                bucket = self._buckets[band_key]
+                bucket.remove(fingerprint)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def contains(self, fingerprint):
+        """Returns True if a fingerprint within `threshold` bits of `fingerprint` is indexed."""
+        with self._lock:
+            self._evict(time.time())
+            for band_key in self._band_keys(fingerprint):
+                for candidate in self._buckets.get(band_key, ()):
+                    if bin(candidate ^ fingerprint).count('1') <= self.threshold:
+                        return True
+            return False
+
+    def add(self, fingerprint):
+        """Indexes `fingerprint`."""
+        with self._lock:
+            now = time.time()
+            self._entries.append((now, fingerprint))
+            for band_key in self._band_keys(fingerprint):
+                self._buckets[band_key].append(fingerprint)
+            self._evict(now)
+
+class ShadowReport:
+    """
+    What a rule in shadow mode would have done: messages seen and forwarded, why the rest
+    were dropped, and the send requests and payload bytes that were skipped. The account's
+    worker writes it; the settings UI reads snapshots.
+    """
+    def __init__(self):
+        self.started_at = time.time()
+        self.seen = 0
+        self.forwarded = 0
+        self.drops = collections.Counter()
+        self.requests = 0
+        self.media_bytes = 0
+        self.text_bytes = 0
+        self.peak_requests_per_minute = 0
+        self._recent_requests = collections.deque()  # send times within the last minute
+        self._lock = threading.Lock()
+
+    def record_seen(self, count=1):
+        with self._lock:
+            self.seen += count
+
+    def record_drop(self, reason, count=1):
+        with self._lock:
+            self.drops[reason] += count
+
+    def record_send(self, messages, requests, media_bytes, text_bytes):
+        with self._lock:
+            now = time.time()
+            self.forwarded += messages
+            self.requests += requests
+            self.media_bytes += media_bytes
+            self.text_bytes += text_bytes
+            self._recent_requests.extend([now] * requests)
+            while self._recent_requests and now - self._recent_requests[0] > 60:
+                self._recent_requests.popleft()
+            self.peak_requests_per_minute = max(self.peak_requests_per_minute, len(self._recent_requests))
+
+    def snapshot(self):
+        """A consistent copy of the counters, plus the average requests per minute so far."""
+        with self._lock:
+            minutes = max((time.time() - self.started_at) / 60.0, 1.0)
+            return {
+                "started_at": self.started_at, "seen": self.seen, "forwarded": self.forwarded,
+                "drops": self.drops.most_common(), "requests": self.requests,
+                "requests_per_minute": self.requests / minutes, "peak_requests_per_minute": self.peak_requests_per_minute,
+                "media_bytes": self.media_bytes, "text_bytes": self.text_bytes
+            }
 
 # --- Main Plugin Class ---
 
@@ -201,10 +1206,41 @@ class AutoForwarderPlugin(BasePlugin):
     TON_ADDRESS = "UQDx2lC9bQW3A4LAfP4lSqtSftQSnLczt87Kn_CIcmJhLicm"
     USDT_ADDRESS = "TXLJNebRRAhwBRKtELMHJPNMtTZYHeoYBo"
     USER_TIMESTAMP_CACHE_SIZE = 500
-    PROCESSED_FILES_CACHE_SIZE = 200
+    MAX_ANTISPAM_HOLD_SECONDS = 300
+    TELEGRAM_MESSAGE_LIMIT = 4096
+    TELEGRAM_CAPTION_LIMIT = 1024
+    QUEUE_AGING_SECONDS = 30
+    OWN_COPY_CACHE_SIZE = 2000
+    OWN_COPY_TTL_SECONDS = 600
+    FILE_REFERENCE_RETRY_LIMIT = 2
+    DRAIN_DEADLINE_SECONDS = 3
+    CONTENT_DEDUP_CACHE_SIZE = 2000
+    NEAR_DUPLICATE_INDEX_SIZE = 1000
+    NEAR_DUPLICATE_WINDOW_SECONDS = 6 * 60 * 60
+    NEAR_DUPLICATE_MIN_TOKENS = 4
+    MAX_NEAR_DUPLICATE_THRESHOLD = 7
+    MESSAGE_ID_CACHE_SIZE = 500
+    MESSAGE_ID_INDEX_SIZE = 5000
+    MESSAGE_ID_FLUSH_INTERVAL_SECONDS = 30
+    DELIVERY_SCHEDULE_FLUSH_INTERVAL_SECONDS = 5
+    BACKFILL_PAGE_SIZE = 100
+    BACKFILL_FORWARD_BATCH_SIZE = 100
+    REGEX_TIME_BUDGET_SECONDS = 0.05
+    REGEX_VIOLATION_LIMIT = 3
+    MAX_QUIET_REGEX_DEGREE = 2  # Patterns whose worst case grows faster than n ** 2 get a warning on save.
+    REGEX_METACHARACTERS = frozenset(".^$*+?{}[]\\|()")
     GITHUB_OWNER = "0x11DFE"
     GITHUB_REPO = "Auto-Forwarder-Plugin"
     UPDATE_INTERVAL_SECONDS = 6 * 60 * 60
+    HTTP_TIMEOUT_MS = 15000
+    DOWNLOAD_BUFFER_SIZE = 64 * 1024
+    RESOLVER_CACHE_SIZE = 500
+    RESOLVER_CACHE_TTL_SECONDS = 24 * 60 * 60
+    RULES_PAGE_SIZE = 25
+    RULE_NAME_INDEX_TTL_SECONDS = 10 * 60
+    IMPORT_PREVIEW_LINES = 15
+    SUPERVISOR_INTERVAL_SECONDS = 15
+    WORKER_STUCK_SECONDS = 180
 
     # --- Nested Proxy Classes ---
     class InstallCallback(dynamic_proxy(Utilities.Callback)):
@@ -237,27 +1273,60 @@ class AutoForwarderPlugin(BasePlugin):
         super().__init__()
         self.id = __id__
         self.lock = threading.Lock()
+        self.rules_lock = threading.Lock()
         self.forwarding_rules = {}
+        self.rule_graph = RuleGraph({})
+        self.rule_name_index = None
+        self.rule_name_index_built_at = 0.0
+        self.rule_list_query = ""
+        self.rule_list_page = 0
+        self.rule_errors = {}
+        self.shadow_reports = {}
+        self.own_copies = LRUCache(self.OWN_COPY_CACHE_SIZE, ttl=self.OWN_COPY_TTL_SECONDS)
+        self.chain_origins = LRUCache(self.OWN_COPY_CACHE_SIZE, ttl=self.OWN_COPY_TTL_SECONDS)  # (account, chat, message id) -> origin rule key
         self.error_message = None
-        self.deferred_messages = {}
-        self.album_buffer = {}
-        self.processed_keys = collections.deque(maxlen=200)
         self.handler = Handler(Looper.getMainLooper())
-        self.user_last_message_time = collections.OrderedDict()
-        self.processed_files_cache = collections.OrderedDict()
+        self.author_rate_buckets = LRUCache(self.USER_TIMESTAMP_CACHE_SIZE)
+        self.content_dedup_cache = LRUCache(self.CONTENT_DEDUP_CACHE_SIZE)
+        self.content_claims = LRUCache(self.CONTENT_DEDUP_CACHE_SIZE)  # (account, source chat, message id) -> claimed content key
+        self.filter_plans = {}
+        self.near_duplicate_indexes = {}
+        self.expired_media_sends = {}
+        self.expired_media_lock = threading.Lock()
+        self.compiled_keyword_patterns = {}
+        self.regex_budget_violations = collections.Counter()
+        self.suspended_regex_rules = set()
+        self.message_id_map = MessageIdMap(self, self.MESSAGE_ID_CACHE_SIZE, self.MESSAGE_ID_INDEX_SIZE, self.MESSAGE_ID_FLUSH_INTERVAL_SECONDS)
+        self.delivery_scheduler = DeliveryScheduler(self, self.DELIVERY_SCHEDULE_FLUSH_INTERVAL_SECONDS)
+        self.destination_resolver = DestinationResolver(self, self.RESOLVER_CACHE_SIZE, self.RESOLVER_CACHE_TTL_SECONDS)
         
-        self.processing_queue = queue.Queue()
-        self.worker_thread = None
+        # One processing queue and worker per account, so each account's flood limits run in parallel.
+        self.account_context = threading.local()
+        self.processing_queues = {}
+        self.engine_states = {}
+        self.worker_threads = {}
+        self.worker_health = {}
+        self.queues_lock = threading.Lock()
+        self.handoff_lock = threading.Lock()
         self.stop_worker_thread = threading.Event()
         
         self.updater_thread = None
         self.stop_updater_thread = threading.Event()
+        self.last_update_check = 0.0
+
+        self.supervisor_thread = None
+        self.stop_supervisor_thread = threading.Event()
+
+        self.backfill_jobs = {}
+        self.backfill_thread = None
+        self.stop_backfill_thread = threading.Event()
         
         self.is_listening_for_reply = False
         self.reply_listener_context = {}
         self.reply_listener_timeout_task = None
         
         self.message_listener = None
+        self.observed_accounts = []
 
         self._load_configurable_settings()
 
@@ -279,7 +1348,7 @@ class AutoForwarderPlugin(BasePlugin):
             messages_list = args[1]
             
             # --- "SET BY REPLYING" LISTENER ---
-            if self.plugin.is_listening_for_reply:
+            if self.plugin.is_listening_for_reply and account == UserConfig.selectedAccount:
                 for i in range(messages_list.size()):
                     msg_obj = messages_list.get(i)
                     msg = msg_obj.messageOwner
@@ -310,51 +1379,145 @@ class AutoForwarderPlugin(BasePlugin):
     # --- Plugin Lifecycle Methods ---
     def on_plugin_load(self):
         """Called when the plugin is loaded or reloaded."""
+        load_started = time.perf_counter()
         log(f"[{self.id}] Loading version {__version__}...")
         self._load_configurable_settings()
         self._load_forwarding_rules()
         self._add_chat_menu_item()
 
         self.stop_worker_thread.clear()
-        if self.worker_thread is None or not self.worker_thread.is_alive():
-            self.worker_thread = threading.Thread(target=self._worker_loop)
-            self.worker_thread.daemon = True
-            self.worker_thread.start()
+        for account in self._get_active_accounts():
+            self._get_processing_queue(account)
+        self._resume_handoff()
             
+        # The updater is started by the supervisor once the workers are idle, so it stays off the startup path.
         self.stop_updater_thread.clear()
-        if self.updater_thread is None or not self.updater_thread.is_alive():
-            self.updater_thread = threading.Thread(target=self._updater_loop)
-            self.updater_thread.daemon = True
-            self.updater_thread.start()
-            log(f"[{self.id}] Auto-updater thread started.")
+
+        self.stop_backfill_thread.clear()
+        self._load_backfill_jobs()
+        if self.backfill_jobs:
+            log(f"[{self.id}] Resuming {len(self.backfill_jobs)} unfinished backfill job(s).")
+            self._ensure_backfill_thread()
+
+        self.stop_supervisor_thread.clear()
+        if self.supervisor_thread is None or not self.supervisor_thread.is_alive():
+            self.supervisor_thread = threading.Thread(target=self._supervisor_loop)
+            self.supervisor_thread.daemon = True
+            self.supervisor_thread.start()
 
         def register_observer():
-            account_instance = get_account_instance()
-            if account_instance:
-                self.message_listener = self.MessageListener(self)
-                account_instance.getNotificationCenter().addObserver(self.message_listener, NotificationCenter.didReceiveNewMessages)
-                log(f"[{self.id}] Message observer successfully registered.")
+            self.message_listener = self.MessageListener(self)
+            self.observed_accounts = self._get_active_accounts()
+            for account in self.observed_accounts:
+                AccountInstance.getInstance(account).getNotificationCenter().addObserver(self.message_listener, NotificationCenter.didReceiveNewMessages)
+            log(f"[{self.id}] Message observer registered for account(s) {self.observed_accounts}.")
 
         run_on_ui_thread(register_observer)
+        log(f"[{self.id}] Startup took {(time.perf_counter() - load_started) * 1000:.1f} ms "
+            f"(module imports {_import_seconds * 1000:.1f} ms).")
 
     def on_plugin_unload(self):
         """Called when the plugin is unloaded."""
+        # Workers get a short deadline to send what they can; the rest is handed to the next load.
+        # Pending timers are cancelled first: the state they point to is drained or handed over.
+        self.stop_supervisor_thread.set()
         self.stop_worker_thread.set()
-        self.processing_queue.put(None) # Unblock the worker's get() call
+        self.handler.removeCallbacksAndMessages(None)
+        deadline = time.time() + self.DRAIN_DEADLINE_SECONDS
+        with self.queues_lock:
+            for processing_queue in self.processing_queues.values():
+                processing_queue.put(("drain", deadline))
+                processing_queue.put(None) # Unblock the worker's get() call
+            worker_threads = list(self.worker_threads.values())
+            self.processing_queues, self.engine_states, self.worker_threads = {}, {}, {}
+        for worker_thread in worker_threads:
+            worker_thread.join(max(0.0, deadline - time.time()) + 0.5)
+        self.worker_health = {}
         
         self.stop_updater_thread.set()
         log(f"[{self.id}] Auto-updater thread stopped.")
+        self.stop_backfill_thread.set()
+        self.message_id_map.flush(force=True)
+        self.delivery_scheduler.flush(force=True)
 
         def unregister_observer():
-            account_instance = get_account_instance()
-            if account_instance and self.message_listener:
-                account_instance.getNotificationCenter().removeObserver(self.message_listener, NotificationCenter.didReceiveNewMessages)
+            if self.message_listener:
+                for account in self.observed_accounts:
+                    AccountInstance.getInstance(account).getNotificationCenter().removeObserver(self.message_listener, NotificationCenter.didReceiveNewMessages)
                 self.message_listener = None
+                self.observed_accounts = []
                 log(f"[{self.id}] Message observer successfully removed.")
 
         run_on_ui_thread(unregister_observer)
         self.handler.removeCallbacksAndMessages(None)
 
+    # --- Accounts ---
+    # Worker and backfill threads bind themselves to one account through `account_context`;
+    # everything else (UI, network callbacks) acts for the account selected in the app.
+    def _active_account(self):
+        """The account the calling thread works for."""
+        account = getattr(self.account_context, "account", None)
+        return UserConfig.selectedAccount if account is None else account
+
+    def _messages_controller(self):
+        return MessagesController.getInstance(self._active_account())
+
+    def _user_config(self):
+        return UserConfig.getInstance(self._active_account())
+
+    def _send_request(self, req, callback):
+        """Sends a request over the active account's connection."""
+        health = getattr(self.account_context, "health", None)
+        if health is not None and isinstance(req, self._delivering_request_types()):
+            # Once a copy may have gone out, the supervisor must not retry the item.
+            health["item_sends"] += 1
+        ConnectionsManager.getInstance(self._active_account()).sendRequest(req, callback)
+
+    @staticmethod
+    def _delivering_request_types():
+        return (TLRPC.TL_messages_sendMessage, TLRPC.TL_messages_sendMedia, TLRPC.TL_messages_sendMultiMedia, TLRPC.TL_messages_forwardMessages)
+
+    def _get_active_accounts(self):
+        """The indexes of all logged-in accounts."""
+        return [account for account in range(UserConfig.MAX_ACCOUNT_COUNT) if UserConfig.getInstance(account).isClientActivated()]
+
+    def _rule_key(self, source_chat_id, account=None):
+        """Rules, lanes and per-rule state are keyed by (account, source chat id)."""
+        return (self._active_account() if account is None else account, source_chat_id)
+
+    def _get_rule(self, source_chat_id, account=None):
+        return self.forwarding_rules.get(self._rule_key(source_chat_id, account))
+
+    def _engine_state(self):
+        """Returns the engine state owned by the calling worker thread. A replaced worker gets WorkerReplaced."""
+        health = getattr(self.account_context, "health", None)
+        if health is not None and health["owner"] is not threading.current_thread():
+            raise WorkerReplaced()
+        return self.account_context.state
+
+    def _get_processing_queue(self, account):
+        """Returns the account's processing queue, starting its worker thread on first use."""
+        with self.queues_lock:
+            processing_queue = self.processing_queues.get(account)
+            if processing_queue is None:
+                processing_queue = LaneScheduler(lambda item: self._classify_queue_item(item, account), self.QUEUE_AGING_SECONDS)
+                self.processing_queues[account] = processing_queue
+                self.engine_states[account] = EngineState()
+                self.worker_health[account] = {"owner": None, "heartbeat": time.time(), "item": None, "item_started": 0.0, "item_enqueued_at": None, "item_sends": 0, "restarts": 0}
+            worker_thread = self.worker_threads.get(account)
+            if (worker_thread is None or not worker_thread.is_alive()) and not self.stop_worker_thread.is_set():
+                self._start_worker_thread(account)
+            return processing_queue
+
+    def _start_worker_thread(self, account):
+        """Starts a worker for the account's queue and state; the caller holds `queues_lock`."""
+        worker_thread = threading.Thread(target=self._worker_loop, args=(account, self.processing_queues[account], self.engine_states[account]))
+        worker_thread.daemon = True
+        # A replaced worker notices it lost ownership at its next item and exits.
+        self.worker_health[account]["owner"] = worker_thread
+        self.worker_threads[account] = worker_thread
+        worker_thread.start()
+
     # --- Settings and Configuration ---
     def _load_configurable_settings(self):
         """Loads user-configurable settings from storage into memory."""
@@ -366,79 +1529,501 @@ class AutoForwarderPlugin(BasePlugin):
         self.deduplication_window_seconds = float(self.get_setting("deduplication_window_seconds", str(DEFAULT_SETTINGS["deduplication_window_seconds"])))
         self.sequential_delay_seconds = float(self.get_setting("sequential_delay_seconds", str(DEFAULT_SETTINGS["sequential_delay_seconds"])))
         self.antispam_delay_seconds = float(self.get_setting("antispam_delay_seconds", str(DEFAULT_SETTINGS["antispam_delay_seconds"])))
+        self.antispam_burst = max(1, int(self.get_setting("antispam_burst", str(DEFAULT_SETTINGS["antispam_burst"]))))
+        self.backfill_rate_per_minute = int(self.get_setting("backfill_rate_per_minute", str(DEFAULT_SETTINGS["backfill_rate_per_minute"])))
+        self.content_dedup_window_seconds = float(self.get_setting("content_dedup_window_seconds", str(DEFAULT_SETTINGS["content_dedup_window_seconds"])))
+        self.content_dedup_cache.ttl = self.content_dedup_window_seconds
+        self.chain_short_circuit = bool(self.get_setting("chain_short_circuit", DEFAULT_SETTINGS["chain_short_circuit"]))
+
+    # Rules live under one key each (RULE_KEY_PREFIX + account + source id) plus a small
+    # index of (account, source id) pairs, so a single edit only rewrites that rule. The
+    # in-memory table is never mutated in place: writers build a new dict and swap the
+    # reference, so readers on the worker threads always see a complete snapshot.
+    def _rule_storage_key(self, rule_key):
+        account, source_id = rule_key
+        return f"{RULE_KEY_PREFIX}{account}_{source_id}"
 
     def _load_forwarding_rules(self):
-        """Loads all forwarding rules from JSON storage."""
+        """Loads all forwarding rules from per-rule storage, migrating older layouts if needed."""
+        with self.rules_lock:
+            try:
+                schema_version = int(self.get_setting(RULES_SCHEMA_VERSION_KEY, "1"))
+                if schema_version < 2:
+                    self._migrate_legacy_rules()
+                if schema_version < 3:
+                    self._migrate_rules_to_accounts()
+                rules = {}
+                for account, source_id in json.loads(self.get_setting(RULE_INDEX_KEY, "[]")):
+                    rule_key = (int(account), int(source_id))
+                    rule_str = self.get_setting(self._rule_storage_key(rule_key), "")
+                    if rule_str:
+                        rules[rule_key] = json.loads(rule_str)
+                self.forwarding_rules = rules
+            except Exception:
+                log(f"[{self.id}] ERROR loading forwarding rules: {traceback.format_exc()}")
+                self.forwarding_rules = {}
+            self.rule_graph = RuleGraph(self.forwarding_rules)
+            self.rule_name_index = None
+            for cycle in self.rule_graph.cycles:
+                log(f"[{self.id}] WARNING: rules of account {cycle[0][0]} form a forwarding loop: {' -> '.join(str(chat_id) for _, chat_id in cycle + cycle[:1])}")
+
+    def _migrate_legacy_rules(self):
+        """Splits the legacy single-blob rules into per-rule keys. The old blob is left untouched."""
         try:
-            rules_str = self.get_setting(FORWARDING_RULES_KEY, "{}")
-            self.forwarding_rules = {int(k): v for k, v in json.loads(rules_str).items()}
-        except Exception: 
-            self.forwarding_rules = {}
-
-    def _save_forwarding_rules(self):
-        """Saves all forwarding rules to JSON storage."""
-        self.set_setting(FORWARDING_RULES_KEY, json.dumps({str(k): v for k, v in self.forwarding_rules.items()}))
-        self._load_forwarding_rules()
+            legacy_rules = json.loads(self.get_setting(FORWARDING_RULES_KEY, "{}"))
+        except Exception:
+            legacy_rules = {}
+        for source_id, rule_data in legacy_rules.items():
+            self.set_setting(f"{V2_RULE_KEY_PREFIX}{int(source_id)}", json.dumps(rule_data))
+        self.set_setting(V2_RULE_INDEX_KEY, json.dumps([int(k) for k in legacy_rules]))
+        self.set_setting(RULES_SCHEMA_VERSION_KEY, "2")
+        log(f"[{self.id}] Migrated {len(legacy_rules)} rule(s) to schema v2.")
+
+    def _migrate_rules_to_accounts(self):
+        """
+        Assigns per-source rules, which predate multi-account support, to the selected account.
+        The v2 keys are left untouched.
+        """
+        account = UserConfig.selectedAccount
+        index = []
+        for source_id in json.loads(self.get_setting(V2_RULE_INDEX_KEY, "[]")):
+            rule_str = self.get_setting(f"{V2_RULE_KEY_PREFIX}{source_id}", "")
+            if rule_str:
+                self.set_setting(self._rule_storage_key((account, int(source_id))), rule_str)
+                index.append([account, int(source_id)])
+        self.set_setting(RULE_INDEX_KEY, json.dumps(index))
+        self.set_setting(RULES_SCHEMA_VERSION_KEY, str(RULES_SCHEMA_VERSION))
+        log(f"[{self.id}] Migrated {len(index)} rule(s) to schema v{RULES_SCHEMA_VERSION} under account {account}.")
+
+    def _save_rule(self, source_id, rule_data):
+        """Stores a single rule of the active account and swaps in a new rule table containing it."""
+        self._save_rules({source_id: rule_data})
+
+    def _save_rules(self, rules_by_source, removed_sources=()):
+        """
+        Stores several rules of the active account, and deletes `removed_sources`, with one
+        index write and one rule table swap, so a bulk import doesn't rebuild the graph per rule.
+        """
+        with self.rules_lock:
+            new_rules = dict(self.forwarding_rules)
+            removed_keys = [self._rule_key(source_id) for source_id in removed_sources if self._rule_key(source_id) in new_rules]
+            for rule_key in removed_keys:
+                del new_rules[rule_key]
+            added = False
+            for source_id, rule_data in rules_by_source.items():
+                rule_key = self._rule_key(source_id)
+                added = added or rule_key not in new_rules
+                new_rules[rule_key] = rule_data
+                self.set_setting(self._rule_storage_key(rule_key), json.dumps(rule_data))
+            if added or removed_keys:
+                self.set_setting(RULE_INDEX_KEY, json.dumps([list(k) for k in new_rules]))
+            for rule_key in removed_keys:
+                self.set_setting(self._rule_storage_key(rule_key), "")
+            self.forwarding_rules = new_rules
+            self.rule_graph = RuleGraph(new_rules)
+            self.rule_name_index = None
+
+    def _remove_rule(self, source_id):
+        """Removes a single rule of the active account from storage and swaps in a new rule table without it."""
+        rule_key = self._rule_key(source_id)
+        with self.rules_lock:
+            if rule_key not in self.forwarding_rules:
+                return
+            new_rules = dict(self.forwarding_rules)
+            del new_rules[rule_key]
+            # Drop it from the index first, so an interrupted delete never leaves a dangling entry.
+            self.set_setting(RULE_INDEX_KEY, json.dumps([list(k) for k in new_rules]))
+            self.set_setting(self._rule_storage_key(rule_key), "")
+            self.forwarding_rules = new_rules
+            self.rule_graph = RuleGraph(new_rules)
+            self.rule_name_index = None
 
     # --- Core Logic: Sequential Processing ---
-    def _worker_loop(self):
+    def _worker_loop(self, account, processing_queue, state):
         """
-        A dedicated worker thread that processes messages one by one from a queue
-        to ensure sequential ordering.
+        A dedicated worker thread that processes one account's messages one by one
+        from its queue to ensure sequential ordering. It is the sole owner of the
+        account's EngineState, so deferrals, albums and digests need no locking.
         """
-        log(f"[{self.id}] Sequential worker thread started.")
-        while not self.stop_worker_thread.is_set():
+        self.account_context.account = account
+        self.account_context.state = state
+        health = self.account_context.health = self.worker_health[account]
+        log(f"[{self.id}] Sequential worker thread started for account {account}.")
+        while True:  # Unload always ends the loop with a drain command or None.
+            if health["owner"] is not threading.current_thread():
+                log(f"[{self.id}] Worker for account {account} was replaced by the supervisor, exiting.")
+                return
+            health["heartbeat"] = time.time()
             try:
-                item = self.processing_queue.get(timeout=1)
+                item, enqueued_at = processing_queue.get_entry(timeout=1)
                 
                 if item is None:
                     break
 
-                if isinstance(item, tuple) and item[0] == "album":
-                    _, grouped_id = item
-                    self._process_album(grouped_id)
-                else:
-                    message_object = item
-                    self.super_handle_message_event(message_object)
-                
-                # If sequential delay is enabled, pause between each processed item.
-                if self.sequential_delay_seconds > 0:
+                if isinstance(item, tuple) and item[0] == "drain":
+                    self._drain_worker(processing_queue, item[1])
+                    break
+
+                # Held messages whose window just opened go out before anything that arrived after them.
+                self._release_due_deliveries()
+                health["item"], health["item_started"], health["item_enqueued_at"], health["item_sends"] = item, time.time(), enqueued_at, 0
+                sent = self._handle_queue_item(item)
+                if health["owner"] is not threading.current_thread():
+                    continue  # Replaced while stuck; the supervisor already settled this item.
+                health["item"] = None
+                # If sequential delay is enabled, pause between each processed item that may have sent.
+                if sent and self.sequential_delay_seconds > 0:
                     time.sleep(self.sequential_delay_seconds)
                 
-                self.processing_queue.task_done()
+                processing_queue.task_done()
+                self.message_id_map.flush()
+                self.delivery_scheduler.flush()
 
             except queue.Empty:
+                self.message_id_map.flush()
+                self.delivery_scheduler.flush()
+                self._release_due_deliveries()
                 continue
+            except WorkerReplaced:
+                continue  # The ownership check at the top ends the loop.
             except Exception:
+                health["item"] = None
                 log(f"[{self.id}] ERROR in worker thread: {traceback.format_exc()}")
                 
-        log(f"[{self.id}] Sequential worker thread stopped.")
+        log(f"[{self.id}] Sequential worker thread stopped for account {account}.")
+
+    def _handle_queue_item(self, item):
+        """Runs one command from the worker's queue. Returns False for pure bookkeeping that sent nothing."""
+        if isinstance(item, tuple) and item[0] == "album_part":
+            self._buffer_album_part(item[1])
+            return False
+        if isinstance(item, tuple) and item[0] == "retry":
+            # An item a stuck worker was holding; its dedup key must not block the second attempt.
+            if not isinstance(item[1], tuple):
+                self._forget_processed_event(item[1])
+            return self._handle_queue_item(item[1])
+        if isinstance(item, tuple) and item[0] == "album":
+            _, grouped_id, _ = item
+            self._process_album(grouped_id)
+        elif isinstance(item, tuple) and item[0] == "deferred":
+            _, event_key, _ = item
+            self._process_timed_out_message(event_key)
+        elif isinstance(item, tuple) and item[0] == "digest":
+            _, source_chat_id, token = item
+            self._flush_digest(source_chat_id, token)
+        elif isinstance(item, tuple) and item[0] == "refresh":
+            _, source_chat_id = item
+            self._retry_expired_media_sends(source_chat_id)
+        elif isinstance(item, tuple) and item[0] == "held":
+            _, source_chat_id, message_ids, message_objects = item
+            self._release_held_messages(source_chat_id, message_ids, message_objects)
+        elif isinstance(item, tuple) and item[0] == "resume":
+            _, source_chat_id, message_ids, stage = item
+            self._resume_handoff_entry(source_chat_id, message_ids, stage)
+        elif isinstance(item, tuple) and item[0] == "parts":
+            _, source_chat_id, to_peer_id, requests, source_msg_id = item
+            self._send_in_order(requests, to_peer_id, (source_chat_id, source_msg_id))
+        elif isinstance(item, tuple) and item[0] == "hop":
+            _, source_chat_id, message_ids = item
+            self._ingest_chain_hop(source_chat_id, message_ids)
+        elif isinstance(item, tuple) and item[0] == "release":
+            _, message_object, event_key = item
+            self._engine_state().throttled_messages.pop(event_key, None)
+            rule = self._get_rule(self._get_id_from_peer(message_object.messageOwner.peer_id))
+            if rule and rule.get("enabled", False):
+                self._dispatch_message(message_object, rule, event_key)
+        else:
+            message_object = item
+            self.super_handle_message_event(message_object)
+        return True
+
+    # --- Supervisor ---
+    def _supervisor_loop(self):
+        """A background thread that restarts dead or stuck workers and background threads."""
+        log(f"[{self.id}] Supervisor started.")
+        while not self.stop_supervisor_thread.wait(self.SUPERVISOR_INTERVAL_SECONDS):
+            try:
+                self._check_worker_health()
+                if self.updater_thread is None:
+                    if not self.stop_updater_thread.is_set() and self._workers_idle():
+                        self._ensure_updater_thread()
+                elif not self.stop_updater_thread.is_set() and not self.updater_thread.is_alive():
+                    log(f"[{self.id}] Supervisor: auto-updater thread died, restarting it.")
+                    self._ensure_updater_thread()
+                if self.backfill_jobs and not self.stop_backfill_thread.is_set() and not self.backfill_thread.is_alive():
+                    log(f"[{self.id}] Supervisor: backfill thread died, restarting it.")
+                    self._ensure_backfill_thread()
+            except Exception:
+                log(f"[{self.id}] ERROR in supervisor: {traceback.format_exc()}")
+        log(f"[{self.id}] Supervisor stopped.")
+
+    def _workers_idle(self):
+        """True when no worker has anything queued or in hand."""
+        with self.queues_lock:
+            return all(q.qsize() == 0 for q in self.processing_queues.values()) and all(h["item"] is None for h in self.worker_health.values())
+
+    def _check_worker_health(self):
+        """
+        Replaces workers that died, or that have been stuck on one item for WORKER_STUCK_SECONDS
+        (say, a native call that never returns). A hung thread can't be killed, so its replacement
+        gets a copy of the state, and the old thread exits once it returns and sees it was replaced.
+        The stuck item goes back to the head of its lane, unless it already issued a send: that
+        copy may have arrived, so the item is dropped and reported as a rule error instead.
+        """
+        now = time.time()
+        with self.queues_lock:
+            if self.stop_worker_thread.is_set():
+                return
+            for account, health in self.worker_health.items():
+                worker_thread = self.worker_threads.get(account)
+                stuck_item = health["item"]
+                if worker_thread is not None and worker_thread.is_alive():
+                    if stuck_item is None or now - health["item_started"] < self.WORKER_STUCK_SECONDS:
+                        continue
+                    log(f"[{self.id}] Supervisor: worker for account {account} stuck for {int(now - health['item_started'])}s, replacing it.")
+                    self.engine_states[account] = self.engine_states[account].handover()
+                else:
+                    log(f"[{self.id}] Supervisor: worker for account {account} died, restarting it.")
+                health["item"] = None
+                health["restarts"] += 1
+                if stuck_item is not None and health["item_sends"]:
+                    self._abandon_stuck_item(account, stuck_item)
+                elif stuck_item is not None:
+                    self.processing_queues[account].put(("retry", stuck_item), front=True, enqueued_at=health["item_enqueued_at"])
+                self._start_worker_thread(account)
+
+    def _abandon_stuck_item(self, account, item):
+        """
+        Drops a stuck item whose send may have gone out, from the state the replacement worker
+        inherits (it hasn't started yet), and records the failure on its rule.
+        """
+        state = self.engine_states[account]
+        kind = item[0] if isinstance(item, tuple) else None
+        if kind == "retry":
+            return self._abandon_stuck_item(account, item[1])
+        if kind == "album":
+            state.album_buffer.pop(item[1], None)
+        elif kind == "deferred":
+            state.deferred_messages.pop(item[1], None)
+        source_chat_id = self._classify_queue_item(item, account)[0]
+        log(f"[{self.id}] Supervisor: not retrying the stuck item from {source_chat_id}, its send may have been delivered.")
+        if source_chat_id:
+            self.rule_errors[(account, source_chat_id)] = (time.time(), "Send stuck; not retried to avoid a duplicate")
+
+    def _get_health_rows(self):
+        """Returns (text, is_problem) rows describing the workers and the updater, for the settings screen."""
+        now, rows = time.time(), []
+        with self.queues_lock:
+            accounts = sorted(self.worker_health.items())
+            queue_sizes = {account: self.processing_queues[account].qsize() for account, _ in accounts}
+            alive = {account: self.worker_threads.get(account) is not None and self.worker_threads[account].is_alive() for account, _ in accounts}
+        for account, health in accounts:
+            busy_for = now - health["item_started"] if health["item"] is not None else 0
+            if not alive[account]:
+                status, problem = "stopped", True
+            elif busy_for >= 30:
+                status, problem = f"busy on one item for {int(busy_for)}s", busy_for >= self.WORKER_STUCK_SECONDS / 2
+            elif now - health["heartbeat"] > 30 and health["item"] is None:
+                status, problem = "not responding", True
+            else:
+                status, problem = "running", False
+            restarts = f", restarted {health['restarts']}x" if health["restarts"] else ""
+            rows.append((f"{self._get_account_label(account)}: {status}, {queue_sizes[account]} queued{restarts}", problem))
+        updater_alive = self.updater_thread is not None and self.updater_thread.is_alive()
+        if self.updater_thread is None:
+            rows.append(("Update checks: start once forwarding is idle", False))
+        elif not updater_alive:
+            rows.append(("Update checks: stopped", True))
+        elif self.last_update_check:
+            rows.append((f"Update checks: last one {int((now - self.last_update_check) // 60)} min ago", False))
+        else:
+            rows.append(("Update checks: waiting for the first one", False))
+        return rows
+
+    # --- Drain & Handoff ---
+    def _drain_worker(self, processing_queue, deadline):
+        """
+        Runs on the worker at unload. Flushes buffered albums and digests, sends queued items
+        until `deadline`, and persists everything left so the next load can resume it.
+        """
+        state = self._engine_state()
+        pending, parked = [], []
+        def take_queued():
+            while True:
+                try:
+                    item = processing_queue.get(timeout=0, include_paused=True)
+                except queue.Empty:
+                    break
+                if item is None or (isinstance(item, tuple) and item[0] == "drain"):
+                    continue
+                if isinstance(item, tuple) and item[0] == "album_part":
+                    self._buffer_album_part(item[1])  # Whole albums are flushed below.
+                elif isinstance(item, tuple) and item[0] == "parts":
+                    parked.append(item)  # Waiting out a FLOOD_WAIT; sending now would only hit it again.
+                elif not (isinstance(item, tuple) and item[0] in ("album", "deferred", "digest")):
+                    pending.append(item)  # Timer commands are covered by the state they point to.
+        take_queued()
+        try:
+            for grouped_id in list(state.album_buffer):
+                if time.time() >= deadline: break
+                self.handler.removeCallbacks(state.album_buffer[grouped_id]['task'])
+                self._process_album(grouped_id)
+            while pending and time.time() < deadline:
+                self._handle_queue_item(pending.pop(0))
+            for rule_key in list(state.digest_buffers):
+                if time.time() >= deadline: break
+                self._flush_digest(rule_key[1])
+        except Exception:
+            log(f"[{self.id}] ERROR while draining the worker: {traceback.format_exc()}")
+        take_queued()  # Sends above may have parked parts through a FLOOD_WAIT.
+        self.message_id_map.flush(force=True)
+        self.delivery_scheduler.flush(force=True)
+        self._save_handoff(self._collect_handoff(state, pending + parked))
+
+    def _collect_handoff(self, state, pending):
+        """Reduces unsent work to [account, source, message_ids, stage] entries, oldest first.
+        Stage "new" still has to pass the rule's filters; "ready" already did."""
+        account = self._active_account()
+        entries = []
+        def add(source_chat_id, message_ids, stage):
+            if message_ids:
+                entries.append([account, source_chat_id, list(message_ids), stage])
+        for rule_key, buffer in state.digest_buffers.items():
+            for _, _, message_id in buffer["parts"]:
+                add(rule_key[1], [message_id], "ready")
+        for message_object, _ in list(state.deferred_messages.values()) + [(mo, None) for mo in state.throttled_messages.values()]:
+            add(self._get_id_from_peer(message_object.messageOwner.peer_id), [message_object.messageOwner.id], "ready")
+        for album_data in state.album_buffer.values():
+            messages = sorted(album_data['messages'], key=lambda m: m.messageOwner.id)
+            if messages:
+                add(self._get_id_from_peer(messages[0].messageOwner.peer_id), [m.messageOwner.id for m in messages], "new")
+        with self.expired_media_lock:
+            expired_keys = [key for key in self.expired_media_sends if key[0] == account]
+            expired = [(key[1], entry) for key in expired_keys for entry in self.expired_media_sends.pop(key)]
+        for source_chat_id, (_, sent_map, _, _) in expired:
+            add(source_chat_id, self._get_sent_map_message_ids(sent_map), "ready")
+        for item in pending:
+            if isinstance(item, tuple) and item[0] == "held":
+                add(item[1], item[2], "ready")
+            elif isinstance(item, tuple) and item[0] == "resume":
+                add(item[1], item[2], item[3])
+            elif isinstance(item, tuple) and item[0] == "release":
+                add(self._get_id_from_peer(item[1].messageOwner.peer_id), [item[1].messageOwner.id], "ready")
+            elif isinstance(item, tuple) and item[0] == "hop":
+                add(item[1], item[2], "new")
+            elif isinstance(item, tuple) and item[0] == "parts":
+                # Only a message whose first part is unsent can be resent whole; trailing text parts are lost.
+                sent_maps = [sent_map for _, sent_map in item[3] if sent_map]
+                add(item[1], [i for sent_map in sent_maps for i in self._get_sent_map_message_ids(sent_map)], "ready")
+            elif not isinstance(item, tuple):
+                add(self._get_id_from_peer(item.messageOwner.peer_id), [item.messageOwner.id], "new")
+        return entries
+
+    def _save_handoff(self, entries):
+        """Appends a worker's unsent work to the persisted handoff; several workers may drain at once."""
+        if not entries:
+            return
+        with self.handoff_lock:
+            try:
+                stored = json.loads(self.get_setting(PENDING_HANDOFF_KEY, "[]"))
+            except Exception:
+                stored = []
+            self.set_setting(PENDING_HANDOFF_KEY, json.dumps(stored + entries))
+        log(f"[{self.id}] Handed {len(entries)} unsent item(s) of account {entries[0][0]} over to the next load.")
+
+    def _resume_handoff(self):
+        """Queues the work a previous unload could not finish, ahead of anything new."""
+        with self.handoff_lock:
+            try:
+                entries = json.loads(self.get_setting(PENDING_HANDOFF_KEY, "[]"))
+            except Exception:
+                entries = []
+            if not entries:
+                return
+            self.set_setting(PENDING_HANDOFF_KEY, "[]")
+        active_accounts = self._get_active_accounts()
+        for account, source_chat_id, message_ids, stage in entries:
+            if account in active_accounts:
+                self._get_processing_queue(account).put(("resume", int(source_chat_id), tuple(message_ids), stage))
+        log(f"[{self.id}] Resuming {len(entries)} item(s) left over from the last unload.")
+
+    def _resume_handoff_entry(self, source_chat_id, message_ids, stage):
+        """Refetches handed-over messages and sends them through the stage they had reached."""
+        try:
+            rule = self._get_rule(source_chat_id)
+            if not rule or not rule.get("enabled", False):
+                return
+            message_objects = self._fetch_messages_sync(source_chat_id, message_ids)
+            if not message_objects:
+                log(f"[{self.id}] Dropping handed-over messages {list(message_ids)} from {source_chat_id}: could not refetch them.")
+                return
+            if len(message_ids) > 1:
+                self._deliver_album(source_chat_id, message_objects, rule)
+            elif stage == "new":
+                self.super_handle_message_event(message_objects[0])
+            else:
+                self._process_and_send(message_objects[0], rule)
+        except Exception:
+            log(f"[{self.id}] ERROR resuming handed-over messages from {source_chat_id}: {traceback.format_exc()}")
+
+    def _classify_queue_item(self, item, account):
+        """Returns the (lane, priority) of an item in `account`'s processing queue. Lanes are source chats."""
+        if item is None:
+            return None, float("-inf")  # The stop signal jumps every lane.
+        source_chat_id = 0
+        if isinstance(item, tuple):
+            kind = item[0]
+            # Items carry their source chat, so classifying never reads the worker's state.
+            if kind == "drain":
+                return None, float("-inf")
+            if kind == "retry":
+                return self._classify_queue_item(item[1], account)
+            if kind in ("album", "deferred"):
+                source_chat_id = item[2]
+            elif kind in ("digest", "held", "refresh", "resume", "parts", "hop"):
+                source_chat_id = item[1]
+            elif kind in ("release", "album_part"):
+                source_chat_id = self._get_id_from_peer(item[1].messageOwner.peer_id)
+        else:
+            source_chat_id = self._get_id_from_peer(item.messageOwner.peer_id)
+        rule = self._get_rule(source_chat_id, account) or {}
+        return source_chat_id, RULE_PRIORITIES.get(rule.get("priority", "normal"), RULE_PRIORITIES["normal"])
 
     def handle_message_event(self, message_object):
         """
         This function is the triage center. It groups albums together BEFORE
         putting them on the sequential processing queue.
         """
-        source_chat_id = self._get_id_from_peer(message_object.messageOwner.peer_id)
-        rule = self.forwarding_rules.get(source_chat_id)
+        message = message_object.messageOwner
+        source_chat_id = self._get_id_from_peer(message.peer_id)
+        account = message_object.currentAccount
+        if self.chain_short_circuit and message.out and self._is_own_copy(account, source_chat_id, message):
+            # Our own copy echoing back; the sender already handed it to the next rule's lane.
+            return
+        rule = self._get_rule(source_chat_id, account)
         if not rule or not rule.get("enabled", False):
             return
             
-        message = message_object.messageOwner
         grouped_id = getattr(message, 'grouped_id', 0)
 
         if grouped_id != 0:
-            with self.lock:
-                if grouped_id not in self.album_buffer:
-                    log(f"[{self.id}] Triage: Detected start of new album: {grouped_id}")
-                    album_task = AlbumTask(self, grouped_id)
-                    self.album_buffer[grouped_id] = {'messages': [], 'task': album_task}
-                    self.handler.postDelayed(album_task, self.album_timeout_ms)
-                
-                self.album_buffer[grouped_id]['messages'].append(message_object)
+            # The worker owns the album buffer; parts reach it in order through the rule's lane.
+            self._get_processing_queue(account).put(("album_part", message_object))
         else:
-            self.processing_queue.put(message_object)
-            
+            self._get_processing_queue(account).put(message_object)
+
+    def _buffer_album_part(self, message_object):
+        """Adds an album part to the worker's buffer, starting the album's timer on its first part."""
+        album_buffer = self._engine_state().album_buffer
+        grouped_id = message_object.messageOwner.grouped_id
+        if grouped_id not in album_buffer:
+            log(f"[{self.id}] Triage: Detected start of new album: {grouped_id}")
+            source_chat_id = self._get_id_from_peer(message_object.messageOwner.peer_id)
+            album_task = AlbumTask(self, self._active_account(), grouped_id, source_chat_id)
+            album_buffer[grouped_id] = {'messages': [], 'task': album_task}
+            self.handler.postDelayed(album_task, self.album_timeout_ms)
+        album_buffer[grouped_id]['messages'].append(message_object)
+
     def super_handle_message_event(self, message_object):
         """
         The main handler for processing a single incoming message object.
@@ -446,146 +2031,822 @@ class AutoForwarderPlugin(BasePlugin):
         """
         message = message_object.messageOwner
         source_chat_id = self._get_id_from_peer(message.peer_id)
-        rule = self.forwarding_rules.get(source_chat_id)
+        rule = self._get_rule(source_chat_id)
+        if not rule:
+            return
 
-        with self.lock:
-            event_key = None
-            if message.out:
-                event_key = ("outgoing", message.random_id)
-            else:
-                event_key = (source_chat_id, message.id)
+        report = self._get_shadow_report(source_chat_id, rule)
+        if report: report.record_seen()
 
-            current_time = time.time()
-            while self.processed_keys and current_time - self.processed_keys[0][1] > self.deduplication_window_seconds:
-                self.processed_keys.popleft()
+        event_key = self._get_event_key(message)
+        processed_keys = self._engine_state().processed_keys
+        current_time = time.time()
+        while processed_keys and current_time - processed_keys[0][1] > self.deduplication_window_seconds:
+            processed_keys.popleft()
 
-            if any(key == event_key for key, ts in self.processed_keys):
-                log(f"[{self.id}] Deduplicating event via lock, ignoring: {event_key}")
-                return
+        if any(key == event_key for key, ts in processed_keys):
+            log(f"[{self.id}] Deduplicating event, ignoring: {event_key}")
+            if report: report.record_drop("duplicate notification")
+            return
 
-            self.processed_keys.append((event_key, current_time))
-
-        # Filter by author type
-        author_type = self._get_author_type(message)
-        if author_type == "outgoing" and not rule.get("forward_outgoing", True): return
-        if author_type == "user" and not rule.get("forward_users", True): return
-        if author_type == "bot" and not rule.get("forward_bots", True): return
-
-        # Filter by specific author
-        author_filter = rule.get("author_filter", "").strip()
-        if author_filter and (author_type == "user" or author_type == "bot"):
-            author_id = self._get_id_from_peer(message.from_id)
-            author_entity = self._get_chat_entity(author_id)
-            allowed_authors = [t.strip().lower().lstrip('@') for t in author_filter.split(',') if t.strip()]
-            match_found = False
-            if str(author_id) in allowed_authors:
-                match_found = True
-            if not match_found and author_entity and hasattr(author_entity, 'username') and author_entity.username:
-                if author_entity.username.lower() in allowed_authors:
-                    match_found = True
-            if not match_found:
-                log(f"[{self.id}] Dropping message from '{self._get_entity_name(author_entity)}' due to author filter.")
-                return
+        processed_keys.append((event_key, current_time))
+
+        # All filters run before deferral, so dropped messages never wait or cost a send.
+        failed_filter = self._evaluate_filter_plan(source_chat_id, rule, message_object)
+        if failed_filter:
+            if report: report.record_drop(f"{failed_filter} filter")
+            return
+
+        near_duplicate_index, fingerprint = self._near_duplicate_entry(source_chat_id, rule, message)
+        if fingerprint is not None and near_duplicate_index.contains(fingerprint):
+            log(f"[{self.id}] Dropping message {message.id} from {source_chat_id}: near-duplicate of a recent text.")
+            if report: report.record_drop("near-duplicate")
+            return
 
         # Apply anti-spam rate limit
         if self.antispam_delay_seconds > 0:
-            author_id = get_user_config().getClientUserId() if message.out else self._get_id_from_peer(message.from_id)
-            if author_id:
-                current_time = time.time()
-                last_time = self.user_last_message_time.get(author_id)
-                if last_time and (current_time - last_time) < self.antispam_delay_seconds:
-                    log(f"[{self.id}] Dropping message from user {author_id} due to anti-spam rate limit.")
-                    return
-                self.user_last_message_time[author_id] = current_time
-                if len(self.user_last_message_time) > self.USER_TIMESTAMP_CACHE_SIZE:
-                    self.user_last_message_time.popitem(last=False)
+            wait = self._reserve_antispam_slot(source_chat_id, rule, message)
+            if wait is None:
+                log(f"[{self.id}] Dropping message {message.id} from {source_chat_id} due to anti-spam rate limit.")
+                if report: report.record_drop("anti-spam limit")
+                return
+            if wait > 0:
+                log(f"[{self.id}] Holding message {message.id} from {source_chat_id} for {wait:.1f}s due to anti-spam rate limit.")
+                if fingerprint is not None:
+                    near_duplicate_index.add(fingerprint)
+                self._engine_state().throttled_messages[event_key] = message_object
+                self.handler.postDelayed(ThrottleReleaseTask(self, message_object, event_key), int(wait * 1000))
+                return
+
+        # Only accepted messages are fingerprinted; a dropped one must not suppress its next repost.
+        if fingerprint is not None:
+            near_duplicate_index.add(fingerprint)
+        self._dispatch_message(message_object, rule, event_key)
+
+    def _get_event_key(self, message):
+        """The dedup key of a message event. Two accounts can see the same channel message, so keys include the account."""
+        if message.out and getattr(message, 'random_id', 0):
+            return (self._active_account(), "outgoing", message.random_id)
+        return self._rule_key(self._get_id_from_peer(message.peer_id)) + (message.id,)
+
+    def _forget_processed_event(self, message_object):
+        """Drops a message's dedup key, so the worker processes it again."""
+        event_key = self._get_event_key(message_object.messageOwner)
+        processed_keys = self._engine_state().processed_keys
+        for entry in [entry for entry in processed_keys if entry[0] == event_key]:
+            processed_keys.remove(entry)
+
+    def _reserve_antispam_slot(self, source_chat_id, rule, message):
+        """
+        Applies the per-author token bucket of the rule's source chat. Returns 0 to send now,
+        a positive delay in seconds (delay mode), or None if the message should be dropped.
+        """
+        author_id = self._user_config().getClientUserId() if message.out else self._get_id_from_peer(message.from_id)
+        if not author_id:
+            return 0
+        bucket_key = self._rule_key(source_chat_id) + (author_id,)
+        rate = 1.0 / self.antispam_delay_seconds
+        with self.lock:
+            bucket = self.author_rate_buckets.get(bucket_key)
+            if bucket is None:
+                bucket = TokenBucket(rate, self.antispam_burst)
+                self.author_rate_buckets.put(bucket_key, bucket)
+            bucket.rate, bucket.capacity = rate, self.antispam_burst
+            now = time.time()
+            if rule.get("antispam_mode", "drop") == "delay":
+                return bucket.reserve(now, self.MAX_ANTISPAM_HOLD_SECONDS)
+            return 0 if bucket.try_take(now) else None
+
+    def _dispatch_message(self, message_object, rule, event_key):
+        """Sends a message that passed ingestion, deferring it first if its media or reply data isn't ready."""
+        message = message_object.messageOwner
 
         # Defer forwarding if media is incomplete or reply object is missing
         is_media = hasattr(message, 'media') and message.media and not isinstance(message.media, TLRPC.TL_messageMediaEmpty)
         is_incomplete_media = is_media and not self._is_media_complete(message)
         is_reply = hasattr(message, 'reply_to') and message.reply_to is not None
-        is_reply_object_missing = is_reply and not (hasattr(message_object, 'replyMessageObject') and message_object.replyMessageObject)
+        # A reply that maps to an earlier forward is threaded natively and needs no quote data.
+        is_reply_object_missing = (is_reply and rule.get("quote_replies", True)
+                                   and not (hasattr(message_object, 'replyMessageObject') and message_object.replyMessageObject)
+                                   and not self._get_mapped_reply_id(message, rule["destination"]))
+        deferred_messages = self._engine_state().deferred_messages
         if is_incomplete_media or is_reply_object_missing:
-            if event_key not in self.deferred_messages:
+            if event_key not in deferred_messages:
                 reason = "incomplete media" if is_incomplete_media else "missing reply object"
                 log(f"[{self.id}] Deferring message due to {reason}. Key: {event_key}")
-                deferred_task = DeferredTask(self, event_key)
-                self.deferred_messages[event_key] = (message_object, deferred_task)
+                source_chat_id = self._get_id_from_peer(message.peer_id)
+                deferred_task = DeferredTask(self, self._active_account(), event_key, source_chat_id)
+                deferred_messages[event_key] = (message_object, deferred_task)
                 self.handler.postDelayed(deferred_task, self.deferral_timeout_ms)
             return
 
-        if event_key in self.deferred_messages:
-            _, deferred_task = self.deferred_messages[event_key]
-            self.handler.removeCallbacks(deferred_task)
-            del self.deferred_messages[event_key]
+        deferred = deferred_messages.pop(event_key, None)
+        if deferred:
+            self.handler.removeCallbacks(deferred[1])
         
         self._process_and_send(message_object, rule)
 
     def _process_and_send(self, message_object, rule):
-        """Performs final content checks and sends the message."""
+        """Sends a message that has already passed the rule's filter plan."""
+        source_chat_id = self._get_id_from_peer(message_object.messageOwner.peer_id)
+        if self._hold_for_delivery_window(source_chat_id, [message_object], rule):
+            return
+        report = self._get_shadow_report(source_chat_id, rule)
+        if self._is_digestible(message_object, rule):
+            self._add_to_digest(source_chat_id, message_object, rule)
+        else:
+            # Anything that can't join the digest flushes it first, so the rule's order is kept.
+            self._flush_digest(source_chat_id)
+            self._send_forwarded_message(message_object, rule, report)
+
+    def _remember_own_copies(self, random_ids=(), sent_messages=(), account=None):
+        """
+        Records the random ids and (chat, message id) pairs of copies this plugin sent from an account, so their
+        echoes can be dropped at ingress when chains are short-circuited. Entries expire after OWN_COPY_TTL_SECONDS.
+        """
+        account = self._active_account() if account is None else account
+        for random_id in random_ids:
+            self.own_copies.put((account, random_id), True)
+        for chat_id, message_id in sent_messages:
+            self.own_copies.put((account, chat_id, message_id), True)
+
+    def _is_own_copy(self, account, chat_id, message):
+        """Whether an incoming message is a copy this plugin sent itself from `account`."""
+        random_id = getattr(message, 'random_id', 0)
+        return (bool(random_id) and (account, random_id) in self.own_copies) or (account, chat_id, message.id) in self.own_copies
+
+    # --- Shadow Mode ---
+    def _get_shadow_report(self, source_chat_id, rule, account=None):
+        """The report of a rule in shadow mode, created on first use. None for rules that really send."""
+        if not rule.get("shadow", False):
+            return None
+        rule_key = self._rule_key(source_chat_id, account)
+        report = self.shadow_reports.get(rule_key)
+        if report is None:
+            report = self.shadow_reports.setdefault(rule_key, ShadowReport())
+        return report
+
+    def _format_bytes(self, size):
+        for unit in ("B", "KB", "MB"):
+            if size < 1024:
+                return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+            size /= 1024.0
+        return f"{size:.1f} GB"
+
+    # --- Digest Mode ---
+    def _is_digestible(self, message_object, rule):
+        """Only plain text messages are merged into digests."""
+        if int(rule.get("digest_window_seconds", 0) or 0) <= 0:
+            return False
         message = message_object.messageOwner
-        
-        # Filter by content type (text, photo, etc.)
-        if not self._is_message_allowed_by_filters(message_object, rule):
+        if not message.message:
+            return False
+        return not message.media or isinstance(message.media, (TLRPC.TL_messageMediaEmpty, TLRPC.TL_messageMediaWebPage))
+
+    def _get_digest_limit(self, rule):
+        """The maximum digest length in UTF-16 units, bounded by the rule, the settings and Telegram."""
+        limit = self.TELEGRAM_MESSAGE_LIMIT
+        if self.max_msg_length > 0: limit = min(limit, self.max_msg_length)
+        max_chars = int(rule.get("digest_max_chars", 0) or 0)
+        if max_chars > 0: limit = min(limit, max_chars)
+        return limit
+
+    def _add_to_digest(self, source_chat_id, message_object, rule):
+        """Adds a text message to the rule's pending digest, flushing it first if the new part won't fit."""
+        message = message_object.messageOwner
+        report = self._get_shadow_report(source_chat_id, rule)
+        if not self._claim_content(rule["destination"], rule.get("destination_topic_id", 0), None, message.message, record=not report,
+                                   source=(source_chat_id, message.id)):
+            log(f"[{self.id}] Skipping message {message.id}: same content was already sent to {rule['destination']}.")
+            if report: report.record_drop("same content already sent")
+            return
+        # Digest parts are never threaded as native replies, so they keep their quotes.
+        prefix_text, prefix_entities = self._build_message_prefix(message_object, rule, 0)
+        part_text = f"{prefix_text}\n\n{message.message}".strip()
+        part_entities = self._prepare_final_entities(prefix_text, prefix_entities, message.entities)
+        part_length, limit = self._get_java_len(part_text), self._get_digest_limit(rule)
+
+        full_buffer, rule_key = None, self._rule_key(source_chat_id)
+        digest_buffers = self._engine_state().digest_buffers
+        buffer = digest_buffers.get(rule_key)
+        if buffer and (buffer["length"] + 2 + part_length > limit or part_length > limit):
+            full_buffer = digest_buffers.pop(rule_key)
+            self.handler.removeCallbacks(full_buffer["task"])
+            buffer = None
+        if part_length <= limit:
+            if buffer is None:
+                token = object()
+                buffer = {"parts": [], "length": -2, "rule": rule, "token": token, "task": DigestTask(self, rule_key[0], source_chat_id, token)}
+                digest_buffers[rule_key] = buffer
+                self.handler.postDelayed(buffer["task"], int(float(rule["digest_window_seconds"]) * 1000))
+            buffer["parts"].append((part_text, part_entities, message.id))
+            buffer["length"] += 2 + part_length
+
+        if full_buffer:
+            self._send_digest(source_chat_id, full_buffer)
+        if part_length > limit:
+            self._send_forwarded_message(message_object, rule, report)
+
+    def _flush_digest(self, source_chat_id, token=None):
+        """Sends the rule's pending digest. With a `token`, only flushes the digest that timer belongs to."""
+        rule_key = self._rule_key(source_chat_id)
+        digest_buffers = self._engine_state().digest_buffers
+        buffer = digest_buffers.get(rule_key)
+        if not buffer or (token is not None and buffer["token"] is not token):
             return
+        del digest_buffers[rule_key]
+        self.handler.removeCallbacks(buffer["task"])
+        self._send_digest(source_chat_id, buffer)
 
-        # Filter by keywords/regex
-        keyword_pattern = rule.get("keyword_pattern", "").strip()
-        if keyword_pattern:
-            text_to_check = message.message or ""
-            if message_object.isDocument():
-                doc = getattr(message.media, 'document', None)
-                filename = self._get_document_filename(doc)
-                if filename:
-                    text_to_check = f"{text_to_check} {filename}".strip()
-            if not self._passes_keyword_filter(text_to_check, keyword_pattern):
+    def _send_digest(self, source_chat_id, buffer):
+        """Merges the buffered parts, shifting each part's entities, and sends them as one message."""
+        rule = buffer["rule"]
+        to_peer_id = rule["destination"]
+        try:
+            text, entities = "", ArrayList()
+            for part_text, part_entities, _ in buffer["parts"]:
+                if not text:
+                    text, entities = part_text, part_entities
+                else:
+                    entities = self._prepare_final_entities(text, entities, part_entities)
+                    text = f"{text}\n\n{part_text}"
+            if not text:
                 return
-        
-        # Filter by message length
-        is_text_based = not message.media or isinstance(message.media, (TLRPC.TL_messageMediaEmpty, TLRPC.TL_messageMediaWebPage))
-        if is_text_based:
-            if not (self.min_msg_length <= len(message.message or "") <= self.max_msg_length):
+
+            req = self._build_text_request(rule, text, entities)
+            report = self._get_shadow_report(source_chat_id, rule)
+            if report:
+                report.record_send(len(buffer["parts"]), 1, 0, len(text.encode("utf-8")))
                 return
+            sent_map = {req.random_id: [(source_chat_id, msg_id) for _, _, msg_id in buffer["parts"]]}
+            log(f"[{self.id}] Sending digest of {len(buffer['parts'])} message(s) from {source_chat_id}.")
+            self._send_copy(req, sent_map, to_peer_id)
+        except Exception:
+            log(f"[{self.id}] ERROR in _send_digest: {traceback.format_exc()}")
+
+    # --- Near-Duplicate Suppression ---
+    def _near_duplicate_entry(self, source_chat_id, rule, message):
+        """Returns the rule's SimHash index and the message's fingerprint, or (None, None) if the rule doesn't check."""
+        threshold = int(rule.get("near_duplicate_threshold", 0) or 0)
+        if threshold <= 0 or not message.message:
+            return None, None
+        fingerprint = self._compute_simhash(message.message)
+        if fingerprint is None:
+            return None, None
+        index = self.near_duplicate_indexes.get(self._rule_key(source_chat_id))
+        if index is None or index.threshold != threshold:
+            index = SimHashIndex(threshold, self.NEAR_DUPLICATE_INDEX_SIZE, self.NEAR_DUPLICATE_WINDOW_SECONDS)
+            self.near_duplicate_indexes[self._rule_key(source_chat_id)] = index
+        return index, fingerprint
+
+    def _compute_simhash(self, text):
+        """
+        Computes a 64-bit SimHash over the words and word pairs of normalized text, so emoji,
+        punctuation, casing and trailing links don't change the fingerprint much.
+        Returns None for texts too short to fingerprint reliably.
+        """
+        normalized = re.sub(r'(https?://|t\.me/|www\.)\S+', ' ', text.lower())
+        tokens = re.findall(r'\w+', normalized)
+        if len(tokens) < self.NEAR_DUPLICATE_MIN_TOKENS:
+            return None
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        weights = [0] * 64
+        for feature in features:
+            feature_hash = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+            for bit in range(64):
+                weights[bit] += 1 if (feature_hash >> bit) & 1 else -1
+        return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+    # --- Filter Planning ---
+    def _evaluate_filter_plan(self, source_chat_id, rule, message_object, exclude=()):
+        """Runs the rule's filter plan. Returns the name of the filter that dropped the message, or None."""
+        plan = self.filter_plans.get(self._rule_key(source_chat_id))
+        if plan is None or plan.rule is not rule:
+            # Rules are swapped, never mutated, so identity tells us when to rebuild.
+            plan = FilterPlan(rule, self._build_filter_predicates(source_chat_id, rule))
+            self.filter_plans[self._rule_key(source_chat_id)] = plan
+        failed = plan.evaluate(message_object, exclude)
+        if failed:
+            log(f"[{self.id}] Dropping message {message_object.messageOwner.id} from {source_chat_id} due to {failed} filter.")
+        return failed
+
+    def _build_filter_predicates(self, source_chat_id, rule):
+        """
+        Compiles a rule into (name, predicate, prior cost) tuples. Filters that cannot drop
+        anything under the rule's settings are left out, and the author checks only
+        resolve entities when the answer actually depends on them.
+        """
+        predicates = []
+
+        disabled_types = frozenset(key for key, enabled in rule.get("filters", {}).items() if not enabled and key != "media_captions")
+        if disabled_types:
+            predicates.append(("type", lambda mo: self._get_message_type_key(mo) not in disabled_types, 2e-6))
+
+        def passes_length(mo):
+            message = mo.messageOwner
+            if message.media and not isinstance(message.media, (TLRPC.TL_messageMediaEmpty, TLRPC.TL_messageMediaWebPage)):
+                return True
+            length = len(message.message or "")
+            return self.min_msg_length <= length and (self.max_msg_length <= 0 or length <= self.max_msg_length)
+        predicates.append(("length", passes_length, 1e-6))
+
+        allow_outgoing = rule.get("forward_outgoing", True)
+        allow_users, allow_bots = rule.get("forward_users", True), rule.get("forward_bots", True)
+        if not (allow_outgoing and allow_users and allow_bots):
+            def passes_author_type(mo):
+                message = mo.messageOwner
+                if message.out: return allow_outgoing
+                if allow_users == allow_bots: return allow_users
+                return allow_bots if self._get_author_type(message) == "bot" else allow_users
+            predicates.append(("author_type", passes_author_type, 2e-5))
+
+        allowed_authors = frozenset(t.strip().lower().lstrip('@') for t in rule.get("author_filter", "").split(',') if t.strip())
+        if allowed_authors:
+            needs_username = any(not t.lstrip('-').isdigit() for t in allowed_authors)
+            def passes_author_set(mo):
+                message = mo.messageOwner
+                if message.out: return True
+                author_id = self._get_id_from_peer(message.from_id)
+                if str(author_id) in allowed_authors: return True
+                if not needs_username: return False
+                author_entity = self._get_chat_entity(author_id)
+                username = getattr(author_entity, 'username', None) if author_entity else None
+                return bool(username) and username.lower() in allowed_authors
+            predicates.append(("author", passes_author_set, 3e-5))
+
+        keyword_pattern = rule.get("keyword_pattern", "").strip()
+        if keyword_pattern:
+            def passes_keyword(mo):
+                message = mo.messageOwner
+                text_to_check = message.message or ""
+                if mo.isDocument():
+                    filename = self._get_document_filename(getattr(message.media, 'document', None))
+                    if filename:
+                        text_to_check = f"{text_to_check} {filename}".strip()
+                return self._passes_keyword_filter(text_to_check, keyword_pattern, source_chat_id)
+            predicates.append(("keyword", passes_keyword, 5e-5))
+
+        return predicates
+
+    def _filter_album_parts(self, source_chat_id, rule, message_objects, report=None):
+        """
+        Runs the rule's filter plan on each album part, so albums get the same author, length
+        and type checks as single messages. The keyword filter is left to _send_album, which
+        matches it against the whole album's text.
+        """
+        passed = []
+        for message_object in message_objects:
+            failed_filter = self._evaluate_filter_plan(source_chat_id, rule, message_object, exclude=("keyword",))
+            if failed_filter:
+                if report: report.record_drop(f"{failed_filter} filter")
+            else:
+                passed.append(message_object)
+        return passed
 
-        self._send_forwarded_message(message_object, rule)
-    
     def _process_timed_out_message(self, event_key):
         """Processes a message that was deferred after the timeout has passed."""
-        if event_key in self.deferred_messages:
+        deferred_messages = self._engine_state().deferred_messages
+        deferred = deferred_messages.get(event_key)
+        if deferred:
             log(f"[{self.id}] Processing deferred message after timeout. Key: {event_key}")
-            message_object, _ = self.deferred_messages[event_key]
+            message_object, _ = deferred
             source_chat_id = self._get_id_from_peer(message_object.messageOwner.peer_id)
-            rule = self.forwarding_rules.get(source_chat_id)
-            if rule:
-                self._process_and_send(message_object, rule)
-            del self.deferred_messages[event_key]
+            rule = self._get_rule(source_chat_id)
+            try:
+                if rule:
+                    self._process_and_send(message_object, rule)
+            finally:
+                # Dropped only once handled, so a supervisor retry of a stuck send still finds it.
+                deferred_messages.pop(event_key, None)
 
     def _process_album(self, grouped_id):
         """Processes a collection of messages as a single album."""
         log(f"[{self.id}] Processing album {grouped_id} after timeout.")
-        album_data = self.album_buffer.pop(grouped_id, None)
-        if not album_data or not album_data['messages']:
+        album_buffer = self._engine_state().album_buffer
+        album_data = album_buffer.get(grouped_id)
+        try:
+            if not album_data or not album_data['messages']:
+                return
+
+            album_data['messages'].sort(key=lambda m: m.messageOwner.id)
+
+            first_message_obj = album_data['messages'][0]
+            first_message = first_message_obj.messageOwner
+            source_chat_id = self._get_id_from_peer(first_message.peer_id)
+            rule = self._get_rule(source_chat_id)
+            if not rule:
+                return
+            report = self._get_shadow_report(source_chat_id, rule)
+            if report: report.record_seen(len(album_data['messages']))
+
+            self._deliver_album(source_chat_id, album_data['messages'], rule)
+        finally:
+            # Dropped only once handled, so a supervisor retry of a stuck send still finds it.
+            album_buffer.pop(grouped_id, None)
+
+    def _deliver_album(self, source_chat_id, message_objects, rule):
+        """Sends an album, unless the rule's delivery window holds it."""
+        if self._hold_for_delivery_window(source_chat_id, message_objects, rule):
             return
-        
-        album_data['messages'].sort(key=lambda m: m.messageOwner.id)
-        
-        first_message_obj = album_data['messages'][0]
-        first_message = first_message_obj.messageOwner
-        source_chat_id = self._get_id_from_peer(first_message.peer_id)
-        rule = self.forwarding_rules.get(source_chat_id)
-        if not rule:
+        report = self._get_shadow_report(source_chat_id, rule)
+        message_objects = self._filter_album_parts(source_chat_id, rule, message_objects, report)
+        if not message_objects:
+            return
+        self._flush_digest(source_chat_id)
+        self._send_album(message_objects, rule, report)
+
+    # --- Delivery Windows ---
+    def _parse_delivery_windows(self, spec):
+        """
+        Parses "HH:MM-HH:MM[, HH:MM-HH:MM...]" into (start, end) minute-of-day pairs.
+        A window whose end is before its start wraps past midnight. Raises ValueError.
+        """
+        windows = []
+        for part in (spec or "").split(","):
+            part = part.strip()
+            if not part:
+                continue
+            match = re.fullmatch(r"(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})", part)
+            if not match:
+                raise ValueError(f"'{part}' is not in HH:MM-HH:MM format")
+            h1, m1, h2, m2 = (int(g) for g in match.groups())
+            if h1 > 23 or h2 > 23 or m1 > 59 or m2 > 59:
+                raise ValueError(f"'{part}' is not a valid time range")
+            start, end = h1 * 60 + m1, h2 * 60 + m2
+            if start == end:
+                raise ValueError(f"'{part}' is an empty window")
+            windows.append((start, end))
+        return windows
+
+    def _get_delivery_windows(self, rule):
+        """The rule's parsed delivery windows; an unparsable spec means no windows."""
+        try:
+            return self._parse_delivery_windows(rule.get("delivery_window", ""))
+        except ValueError:
+            return []
+
+    def _get_delivery_window_opening(self, rule, now=None):
+        """Returns 0 if the rule may deliver now, otherwise the timestamp its next window opens."""
+        windows = self._get_delivery_windows(rule)
+        if not windows:
+            return 0
+        now = now or time.time()
+        local_now = datetime.datetime.fromtimestamp(now)
+        minute = local_now.hour * 60 + local_now.minute
+        for start, end in windows:
+            if (start <= minute < end) if start < end else (minute >= start or minute < end):
+                return 0
+        openings = []
+        for start, _ in windows:
+            for day in (0, 1):
+                opening = (local_now.replace(hour=start // 60, minute=start % 60, second=0, microsecond=0)
+                           + datetime.timedelta(days=day)).timestamp()
+                if opening > now:
+                    openings.append(opening)
+        return min(openings)
+
+    def _hold_for_delivery_window(self, source_chat_id, message_objects, rule):
+        """
+        Holds messages in the delivery scheduler while the rule's window is closed.
+        Rules that use server-side scheduling are never held here; their sends carry a schedule_date instead.
+        """
+        if rule.get("server_schedule", False):
+            return False
+        opening = self._get_delivery_window_opening(rule)
+        if not opening:
+            return False
+        self.delivery_scheduler.hold(opening, self._active_account(), source_chat_id, message_objects)
+        log(f"[{self.id}] Holding {len(message_objects)} message(s) from {source_chat_id} until {time.strftime('%H:%M', time.localtime(opening))}.")
+        return True
+
+    def _apply_delivery_schedule(self, req, rule):
+        """Lets Telegram hold a send until the rule's delivery window opens (schedule_date, flags bit 10)."""
+        if not rule.get("server_schedule", False):
+            return
+        opening = self._get_delivery_window_opening(rule)
+        if opening:
+            req.schedule_date = int(opening)
+            req.flags |= 1024
+
+    def _release_due_deliveries(self):
+        """
+        Sends every held message whose delivery window has opened. Whichever worker finds them due
+        sends its own account's messages right away and hands the rest to their account's queue.
+        """
+        for account, source_chat_id, message_ids, message_objects in self.delivery_scheduler.pop_due(time.time()):
+            if account == self._active_account():
+                self._release_held_messages(source_chat_id, message_ids, message_objects)
+            else:
+                self._get_processing_queue(account).put(("held", source_chat_id, message_ids, message_objects))
+
+    def _release_held_messages(self, source_chat_id, message_ids, message_objects):
+        """Sends messages released from the delivery scheduler, refetching any lost to a restart."""
+        try:
+            rule = self._get_rule(source_chat_id)
+            if not rule or not rule.get("enabled", False):
+                return
+            if message_objects is None:
+                message_objects = self._fetch_messages_sync(source_chat_id, message_ids)
+                if not message_objects:
+                    log(f"[{self.id}] Dropping held messages {list(message_ids)} from {source_chat_id}: could not refetch them.")
+                    return
+            if len(message_ids) > 1:
+                self._deliver_album(source_chat_id, message_objects, rule)
+            else:
+                self._process_and_send(message_objects[0], rule)
+        except Exception:
+            log(f"[{self.id}] ERROR releasing held messages from {source_chat_id}: {traceback.format_exc()}")
+
+    def _fetch_messages_sync(self, chat_id, message_ids):
+        """Refetches messages by id, so media file references are fresh. Returns MessageObjects in id order."""
+        chat = self._get_chat_entity(chat_id) if chat_id < 0 else None
+        if chat is not None and ChatObject.isChannel(chat):
+            req = TLRPC.TL_channels_getMessages()
+            req.channel = self._messages_controller().getInputChannel(-chat_id)
+        else:
+            req = TLRPC.TL_messages_getMessages()
+        ids = ArrayList()
+        for message_id in message_ids:
+            input_message = TLRPC.TL_inputMessageID()
+            input_message.id = message_id
+            ids.add(input_message)
+        req.id = ids
+        response, error = self._send_request_sync(req)
+        if error or not response:
+            log(f"[{self.id}] Refetching messages from {chat_id} failed: {getattr(error, 'text', error)}")
+            return []
+        self._messages_controller().putUsers(response.users, False)
+        self._messages_controller().putChats(response.chats, False)
+        account = self._active_account()
+        messages = [response.messages.get(i) for i in range(response.messages.size())]
+        return [MessageObject(account, m, False, False) for m in sorted(messages, key=lambda m: m.id)
+                if not isinstance(m, (TLRPC.TL_messageEmpty, TLRPC.TL_messageService))]
+
+    # --- History Backfill ---
+    def _load_backfill_jobs(self):
+        """Loads the persisted backfill cursors so interrupted jobs can resume."""
+        try:
+            jobs_str = self.get_setting(BACKFILL_STATE_KEY, "{}")
+            # Keys are "account:source"; bare source ids predate multi-account support.
+            jobs = {}
+            for k, v in json.loads(jobs_str).items():
+                account, _, source_id = k.rpartition(":")
+                jobs[(int(account) if account else UserConfig.selectedAccount, int(source_id))] = v
+        except Exception:
+            jobs = {}
+        with self.lock:
+            self.backfill_jobs = jobs
+
+    def _save_backfill_jobs(self):
+        """Persists the cursor of every active backfill job."""
+        with self.lock:
+            jobs_str = json.dumps({f"{account}:{source_id}": v for (account, source_id), v in self.backfill_jobs.items()})
+        self.set_setting(BACKFILL_STATE_KEY, jobs_str)
+
+    def _start_backfill(self, source_id, limit=0, since_ts=0):
+        """Queues a history backfill of the last `limit` messages or everything since `since_ts`."""
+        with self.lock:
+            self.backfill_jobs[self._rule_key(source_id)] = {"cursor": None, "end_id": None, "limit": limit, "since": since_ts, "sent": 0}
+        self._save_backfill_jobs()
+        self._ensure_backfill_thread()
+
+    def _stop_backfill(self, source_id):
+        """Cancels a running backfill job and forgets its cursor."""
+        with self.lock:
+            self.backfill_jobs.pop(self._rule_key(source_id), None)
+        self._save_backfill_jobs()
+
+    def _ensure_backfill_thread(self):
+        """Starts the backfill thread if it is not already running."""
+        if self.backfill_thread is None or not self.backfill_thread.is_alive():
+            self.backfill_thread = threading.Thread(target=self._backfill_loop)
+            self.backfill_thread.daemon = True
+            self.backfill_thread.start()
+
+    def _backfill_loop(self):
+        """A background thread that works through the persisted backfill jobs one at a time."""
+        log(f"[{self.id}] Backfill thread started.")
+        while not self.stop_backfill_thread.is_set():
+            with self.lock:
+                rule_key = next(iter(self.backfill_jobs), None)
+            if rule_key is None:
+                break
+            account, source_id = rule_key
+            self.account_context.account = account
+            try:
+                self._run_backfill_job(source_id)
+            except Exception:
+                log(f"[{self.id}] ERROR in backfill for {source_id}: {traceback.format_exc()}")
+                self._stop_backfill(source_id)
+            if rule_key in self.backfill_jobs:
+                # The job was interrupted by a network failure; back off before retrying it.
+                self.stop_backfill_thread.wait(60)
+        log(f"[{self.id}] Backfill thread stopped.")
+
+    def _run_backfill_job(self, source_id):
+        """Pages forward through a chat's history from the job's cursor, forwarding what passes the rule's filters."""
+        job = self.backfill_jobs.get(self._rule_key(source_id))
+        rule = self._get_rule(source_id)
+        if not job or not rule or rule.get("shadow", False):
+            self._stop_backfill(source_id)
             return
+        peer = self._messages_controller().getInputPeer(source_id)
+
+        if job["end_id"] is None:
+            newest = self._fetch_history_page(peer, limit=1)
+            job["end_id"] = newest[0].id if newest else 0
+        if job["cursor"] is None:
+            # The cursor is the newest message *before* the requested range, so paging starts right after it.
+            if job.get("since"):
+                boundary = self._fetch_history_page(peer, offset_date=int(job["since"]), limit=1)
+            else:
+                boundary = self._fetch_history_page(peer, add_offset=int(job.get("limit", 0)), limit=1)
+            job["cursor"] = boundary[0].id if boundary else 0
+        self._save_backfill_jobs()
+        log(f"[{self.id}] Backfilling {source_id} from message {job['cursor']} to {job['end_id']}.")
+
+        while not self.stop_backfill_thread.is_set() and self._rule_key(source_id) in self.backfill_jobs:
+            page = self._fetch_history_page(peer, offset_id=job["cursor"] + 1, add_offset=-self.BACKFILL_PAGE_SIZE, limit=self.BACKFILL_PAGE_SIZE)
+            if page is None:
+                return  # Network failure; the job stays persisted and is retried on the next run.
+            page = sorted((m for m in page if job["cursor"] < m.id <= job["end_id"]), key=lambda m: m.id)
+            if not page:
+                break
+            trailing_group = getattr(page[-1], 'grouped_id', 0)
+            if trailing_group and page[-1].id < job["end_id"]:
+                # The album may continue on the next page; hold it back so it is fetched and sent whole.
+                cut = len(page)
+                while cut > 0 and getattr(page[cut - 1], 'grouped_id', 0) == trailing_group:
+                    cut -= 1
+                if cut > 0:
+                    page = page[:cut]
+
+            account = self._active_account()
+            rule = self._get_rule(source_id) or rule
+            if rule.get("shadow", False):
+                log(f"[{self.id}] Stopping backfill for {source_id}: the rule was switched to shadow mode.")
+                self._stop_backfill(source_id)
+                return
+            passed = []
+            for message in page:
+                if isinstance(message, TLRPC.TL_messageService):
+                    continue
+                message_object = MessageObject(account, message, False, False)
+                if not self._evaluate_filter_plan(source_id, rule, message_object):
+                    passed.append(message_object)
+
+            for batch in self._split_backfill_batches(passed, rule):
+                if self.stop_backfill_thread.is_set() or self._rule_key(source_id) not in self.backfill_jobs:
+                    return
+                if not self._send_backfill_batch(batch, rule):
+                    # The cursor stays before this batch, so the next run sends it again.
+                    log(f"[{self.id}] Backfill for {source_id} paused at message {job['cursor']}: the batch was not confirmed.")
+                    return
+                job["sent"] += len(batch)
+                job["cursor"] = batch[-1].messageOwner.id
+                self._save_backfill_jobs()
+                if self.backfill_rate_per_minute > 0:
+                    self.stop_backfill_thread.wait(len(batch) * 60.0 / self.backfill_rate_per_minute)
+
+            job["cursor"] = page[-1].id
+            self._save_backfill_jobs()
+
+        if not self.stop_backfill_thread.is_set() and self._rule_key(source_id) in self.backfill_jobs:
+            log(f"[{self.id}] Backfill for {source_id} complete. {job['sent']} message(s) forwarded.")
+            self._stop_backfill(source_id)
+
+    def _split_backfill_batches(self, message_objects, rule):
+        """
+        Packs messages into forward batches of at most BACKFILL_FORWARD_BATCH_SIZE without
+        splitting an album. Rules that can't use forwardMessages get one message or album per batch.
+        """
+        batch_size = self.BACKFILL_FORWARD_BATCH_SIZE if self._uses_backfill_forward(rule) else 1
+        units = []
+        for message_object in message_objects:
+            grouped_id = getattr(message_object.messageOwner, 'grouped_id', 0)
+            if grouped_id and units and getattr(units[-1][-1].messageOwner, 'grouped_id', 0) == grouped_id:
+                units[-1].append(message_object)
+            else:
+                units.append([message_object])
+        batches = []
+        for unit in units:
+            if batches and len(batches[-1]) + len(unit) <= batch_size:
+                batches[-1].extend(unit)
+            else:
+                batches.append(unit)
+        return batches
+
+    def _fetch_history_page(self, peer, offset_id=0, offset_date=0, add_offset=0, limit=100):
+        """Fetches one page of history synchronously, honoring FLOOD_WAIT. Returns None on failure."""
+        req = TLRPC.TL_messages_getHistory()
+        req.peer, req.offset_id, req.offset_date = peer, offset_id, offset_date
+        req.add_offset, req.limit, req.max_id, req.min_id, req.hash = add_offset, limit, 0, 0, 0
+        while not self.stop_backfill_thread.is_set():
+            response, error = self._send_request_sync(req)
+            flood_wait = self._get_flood_wait_seconds(error)
+            if flood_wait:
+                log(f"[{self.id}] Backfill hit FLOOD_WAIT, sleeping {flood_wait}s.")
+                self.stop_backfill_thread.wait(flood_wait)
+                continue
+            if error or not response:
+                log(f"[{self.id}] Backfill history request failed: {getattr(error, 'text', error)}")
+                return None
+            self._messages_controller().putUsers(response.users, False)
+            self._messages_controller().putChats(response.chats, False)
+            return [response.messages.get(i) for i in range(response.messages.size())]
+        return None
+
+    def _send_backfill_batch(self, message_objects, rule):
+        """
+        Sends a batch of backfilled messages. Plain copy rules use a single server-side
+        forwardMessages call per batch; rules that need headers or quotes get one message or
+        album per batch, built by the regular senders and sent here one request at a time.
+        Returns False if anything in the batch may not have been sent.
+        """
+        to_peer_id = rule["destination"]
+        if not self._uses_backfill_forward(rule):
+            outbox = []
+            if len(message_objects) > 1:
+                self._send_album(message_objects, rule, outbox=outbox)
+            else:
+                self._send_forwarded_message(message_objects[0], rule, outbox=outbox)
+            return all(self._send_backfill_request(req, sent_map, to_peer_id) for req, sent_map in outbox)
+
+        filters = rule.get("filters", {})
+        req = TLRPC.TL_messages_forwardMessages()
+        req.from_peer = self._messages_controller().getInputPeer(self._get_id_from_peer(message_objects[0].messageOwner.peer_id))
+        req.to_peer = self._messages_controller().getInputPeer(to_peer_id)
+        req.drop_author = True
+        req.flags |= 2048
+        if not filters.get("media_captions", True):
+            req.drop_media_captions = True
+            req.flags |= 4096
+        topic_id = rule.get("destination_topic_id", 0)
+        if topic_id > 0:
+            req.top_msg_id = topic_id
+            req.flags |= 512
+        id_list, random_ids, sent_map = ArrayList(), ArrayList(), {}
+        for message_object in message_objects:
+            message = message_object.messageOwner
+            random_id = random.getrandbits(63)
+            id_list.add(Integer(message.id))
+            random_ids.add(Long(random_id))
+            sent_map[random_id] = [(self._get_id_from_peer(message.peer_id), message.id)]
+        req.id, req.random_id = id_list, random_ids
+        return self._send_backfill_request(req, sent_map, to_peer_id)
+
+    def _send_backfill_request(self, req, sent_map, to_peer_id):
+        """Sends one backfill request synchronously, sleeping through FLOOD_WAIT. Returns True once it is confirmed."""
+        sent_map = sent_map or {req.random_id: []}
+        self._remember_own_copies(random_ids=sent_map)
+        while not self.stop_backfill_thread.is_set():
+            response, error = self._send_request_sync(req)
+            if response is None and error is None:
+                # Timed out and the outcome is unknown; the retry must not be skipped as a duplicate.
+                self._settle_content_claims(sent_map, sent=False)
+                return False
+            flood_wait = self._get_flood_wait_seconds(error)
+            if not flood_wait:
+                self._on_messages_sent(response, error, sent_map, to_peer_id)
+                return not error
+            log(f"[{self.id}] Backfill hit FLOOD_WAIT, sleeping {flood_wait}s.")
+            self.stop_backfill_thread.wait(flood_wait)
+        return False
 
-        self._send_album(album_data['messages'], rule)
+    def _uses_backfill_forward(self, rule):
+        """Whether a rule's backfill can use server-side forwardMessages: a plain copy without headers or quotes."""
+        return rule.get("drop_author", True) and not rule.get("quote_replies", True)
 
     # --- Message Sending and Formatting ---
-    def _send_forwarded_message(self, message_object, rule):
-        """Constructs and sends a single forwarded/copied message."""
+    def _send_request_sync(self, req, timeout=30):
+        """Sends a request and blocks the calling background thread until it completes."""
+        done, result = threading.Event(), {}
+        def on_complete(response, error):
+            result['response'], result['error'] = response, error
+            done.set()
+        self._send_request(req, RequestCallback(on_complete))
+        if not done.wait(timeout):
+            log(f"[{self.id}] Request {type(req).__name__} timed out after {timeout}s.")
+            return None, None
+        return result.get('response'), result.get('error')
+
+    def _get_flood_wait_seconds(self, error):
+        """Returns the wait time of a FLOOD_WAIT_X error, or 0 for any other result."""
+        error_text = getattr(error, 'text', None) or ""
+        if error_text.startswith("FLOOD_WAIT_"):
+            try: return int(error_text.rsplit("_", 1)[-1])
+            except ValueError: return 30
+        return 0
+
+    def _send_forwarded_message(self, message_object, rule, report=None, outbox=None):
+        """
+        Constructs and sends a single forwarded/copied message. With a shadow `report`, only records it.
+        With an `outbox` list, the (request, sent_map) pairs are appended to it instead of sent.
+        """
         message = message_object.messageOwner
         if not message: return
         
         to_peer_id = rule["destination"]
-        drop_author = rule.get("drop_author", True)
         quote_replies = rule.get("quote_replies", True)
         topic_id = rule.get("destination_topic_id", 0)
         
@@ -594,6 +2855,12 @@ class AutoForwarderPlugin(BasePlugin):
             has_media = bool(input_media)
             has_text = bool(message.message)
 
+            if not self._claim_content(to_peer_id, topic_id, input_media, None if has_media else message.message, record=not report,
+                                       source=(self._get_id_from_peer(message.peer_id), message.id)):
+                log(f"[{self.id}] Skipping message {message.id}: same content was already sent to {to_peer_id}.")
+                if report: report.record_drop("same content already sent")
+                return
+
             original_text = ""
             if has_text:
                 filters = rule.get("filters", {})
@@ -603,28 +2870,16 @@ class AutoForwarderPlugin(BasePlugin):
                     original_text = message.message
             original_entities = message.entities if original_text else None
 
-            prefix_text, prefix_entities = "", ArrayList()
-            if not drop_author:
-                source_entity = self._get_chat_entity(self._get_id_from_peer(message.peer_id))
-                author_entity = self._get_chat_entity(self._get_id_from_peer(message.from_id))
-                if source_entity:
-                    header_text, header_entities = self._build_forward_header(message, source_entity, author_entity)
-                    if header_text: prefix_text += header_text
-                    if header_entities: prefix_entities.addAll(header_entities)
-            
-            if quote_replies:
-                quote_text, quote_entities = self._build_reply_quote(message_object)
-                if quote_text:
-                    if prefix_text: prefix_text += "\n\n"
-                    if quote_entities:
-                        for i in range(quote_entities.size()):
-                            entity = quote_entities.get(i)
-                            entity.offset += self._get_java_len(prefix_text)
-                        prefix_entities.addAll(quote_entities)
-                    prefix_text += quote_text
-            
+            reply_to_msg_id = self._get_mapped_reply_id(message, to_peer_id) if quote_replies else 0
+            prefix_text, prefix_entities = self._build_message_prefix(message_object, rule, reply_to_msg_id)
             message_text = f"{prefix_text}\n\n{original_text}".strip()
             entities = self._prepare_final_entities(prefix_text, prefix_entities, original_entities)
+            follow_ups = []
+            limit = self.TELEGRAM_CAPTION_LIMIT if input_media else self.TELEGRAM_MESSAGE_LIMIT
+            if self._get_java_len(message_text) > limit:
+                chunks = self._split_text_with_entities(message_text, entities, limit, self.TELEGRAM_MESSAGE_LIMIT)
+                (message_text, entities), follow_ups = chunks[0], chunks[1:]
+                log(f"[{self.id}] Message {message.id} is too long, splitting it into {len(chunks)} parts.")
 
             req = None
             if input_media:
@@ -633,27 +2888,44 @@ class AutoForwarderPlugin(BasePlugin):
             elif message_text.strip():
                 req = TLRPC.TL_messages_sendMessage()
                 req.message = message_text
+            elif report:
+                report.record_drop("nothing left to send")
             
             if req:
-                req.peer = get_messages_controller().getInputPeer(to_peer_id)
+                req.peer = self._messages_controller().getInputPeer(to_peer_id)
                 req.random_id = random.getrandbits(63)
-                if topic_id > 0:
-                    req.reply_to = TLRPC.TL_inputReplyToMessage()
-                    req.reply_to.reply_to_msg_id = topic_id
+                reply_to = self._build_input_reply_to(reply_to_msg_id, topic_id)
+                if reply_to:
+                    req.reply_to = reply_to
                     req.flags |= 1
                 if entities and not entities.isEmpty():
                     req.entities = entities
                     req.flags |= 8
-                send_request(req, RequestCallback(lambda r, e: None))
+                self._apply_delivery_schedule(req, rule)
+                if report:
+                    text_bytes = sum(len(text.encode("utf-8")) for text in [message_text] + [t for t, _ in follow_ups])
+                    report.record_send(1, 1 + len(follow_ups), self._get_media_size(message) if input_media else 0, text_bytes)
+                    return
+                source_chat_id = self._get_id_from_peer(message.peer_id)
+                sent_map = {req.random_id: [(source_chat_id, message.id)]}
+                requests = [(req, sent_map)] + [(self._build_text_request(rule, t, e), None) for t, e in follow_ups]
+                if outbox is not None:
+                    outbox.extend(requests)
+                elif follow_ups:
+                    self._send_in_order(requests, to_peer_id)
+                else:
+                    self._send_copy(req, sent_map, to_peer_id)
         except Exception:
             log(f"[{self.id}] ERROR in _send_forwarded_message: {traceback.format_exc()}")
             
-    def _send_album(self, message_objects, rule):
-        """Constructs and sends a multi-media message (album)."""
+    def _send_album(self, message_objects, rule, report=None, outbox=None):
+        """
+        Constructs and sends a multi-media message (album). With a shadow `report`, only records it.
+        With an `outbox` list, the (request, sent_map) pairs are appended to it instead of sent.
+        """
         if not message_objects: return
         
         to_peer_id = rule["destination"]
-        drop_author = rule.get("drop_author", True)
         quote_replies = rule.get("quote_replies", True)
         filters = rule.get("filters", {})
         keyword_pattern = rule.get("keyword_pattern", "").strip()
@@ -670,16 +2942,23 @@ class AutoForwarderPlugin(BasePlugin):
                         doc = getattr(msg.media, 'document', None)
                         filename = self._get_document_filename(doc)
                         if filename: full_text_to_check += f" {filename}"
-                if not self._passes_keyword_filter(full_text_to_check.strip(), keyword_pattern): return
+                source_chat_id = self._get_id_from_peer(message_objects[0].messageOwner.peer_id)
+                if not self._passes_keyword_filter(full_text_to_check.strip(), keyword_pattern, source_chat_id):
+                    if report: report.record_drop("keyword filter", len(message_objects))
+                    return
+
+            first_message_obj, first_message = message_objects[0], message_objects[0].messageOwner
+            reply_to_msg_id = self._get_mapped_reply_id(first_message, to_peer_id) if quote_replies else 0
 
             req = TLRPC.TL_messages_sendMultiMedia()
-            req.peer = get_messages_controller().getInputPeer(to_peer_id)
-            if topic_id > 0:
-                req.reply_to = TLRPC.TL_inputReplyToMessage()
-                req.reply_to.reply_to_msg_id = topic_id
+            req.peer = self._messages_controller().getInputPeer(to_peer_id)
+            reply_to = self._build_input_reply_to(reply_to_msg_id, topic_id)
+            if reply_to:
+                req.reply_to = reply_to
                 req.flags |= 1
                 
             multi_media_list = ArrayList()
+            sent_map = {}
             album_caption, album_entities = "", None
             if filters.get("media_captions", True):
                 for msg_obj in message_objects:
@@ -687,59 +2966,404 @@ class AutoForwarderPlugin(BasePlugin):
                         album_caption, album_entities = msg_obj.messageOwner.message, msg_obj.messageOwner.entities
                         break
 
-            first_message_obj, first_message = message_objects[0], message_objects[0].messageOwner
-            
-            prefix_text, prefix_entities = "", ArrayList()
-            if not drop_author:
-                source_entity = self._get_chat_entity(self._get_id_from_peer(first_message.peer_id))
-                author_entity = self._get_chat_entity(self._get_id_from_peer(first_message.from_id))
-                if source_entity:
-                    header_text, header_entities = self._build_forward_header(first_message, source_entity, author_entity)
-                    if header_text: prefix_text += header_text
-                    if header_entities: prefix_entities.addAll(header_entities)
-            
-            if quote_replies:
-                quote_text, quote_entities = self._build_reply_quote(first_message_obj)
-                if quote_text:
-                    if prefix_text: prefix_text += "\n\n"
-                    if quote_entities:
-                        for i in range(quote_entities.size()):
-                            entity = quote_entities.get(i)
-                            entity.offset += self._get_java_len(prefix_text)
-                        prefix_entities.addAll(quote_entities)
-                    prefix_text += quote_text
+            prefix_text, prefix_entities = self._build_message_prefix(first_message_obj, rule, reply_to_msg_id)
+            final_caption = f"{prefix_text}\n\n{album_caption}".strip()
+            final_entities = self._prepare_final_entities(prefix_text, prefix_entities, album_entities)
+            follow_ups = []
+            if self._get_java_len(final_caption) > self.TELEGRAM_CAPTION_LIMIT:
+                # The overflow of a long caption follows the album as regular messages.
+                chunks = self._split_text_with_entities(final_caption, final_entities, self.TELEGRAM_CAPTION_LIMIT, self.TELEGRAM_MESSAGE_LIMIT)
+                (final_caption, final_entities), follow_ups = chunks[0], chunks[1:]
             
             header_attached = False
+            media_bytes = 0
             for original_msg_obj in message_objects:
                 current_msg_obj = original_msg_obj
-                if not self._is_message_allowed_by_filters(current_msg_obj, rule): continue
+                if not self._is_message_allowed_by_filters(current_msg_obj, rule):
+                    if report: report.record_drop("type filter")
+                    continue
                 input_media = self._get_input_media(current_msg_obj)
                 if not input_media: 
                     log(f"[{self.id}] Album item dropped – failed to build InputMedia for msg {original_msg_obj.messageOwner.id}")
+                    if report: report.record_drop("unsupported media")
+                    continue
+                if not self._claim_content(to_peer_id, topic_id, input_media, None, record=not report,
+                                           source=(self._get_id_from_peer(original_msg_obj.messageOwner.peer_id), original_msg_obj.messageOwner.id)):
+                    log(f"[{self.id}] Album item {original_msg_obj.messageOwner.id} skipped: same media was already sent to {to_peer_id}.")
+                    if report: report.record_drop("same content already sent")
+                    continue
+                media_bytes += self._get_media_size(original_msg_obj.messageOwner)
+
+                single_media = TLRPC.TL_inputSingleMedia()
+                single_media.media = input_media
+                single_media.random_id = random.getrandbits(63)
+                sent_map[single_media.random_id] = [(self._get_id_from_peer(original_msg_obj.messageOwner.peer_id), original_msg_obj.messageOwner.id)]
+
+                if not header_attached:
+                    single_media.message = final_caption
+                    if final_entities and not final_entities.isEmpty():
+                        single_media.entities = final_entities
+                        single_media.flags |= 1
+                    header_attached = True
+                else:
+                    single_media.message = ""
+                multi_media_list.add(single_media)
+
+            if not multi_media_list.isEmpty():
+                req.multi_media = multi_media_list
+                self._apply_delivery_schedule(req, rule)
+                if report:
+                    text_bytes = sum(len(text.encode("utf-8")) for text in [final_caption] + [t for t, _ in follow_ups])
+                    report.record_send(multi_media_list.size(), 1 + len(follow_ups), media_bytes, text_bytes)
+                    return
+                requests = [(req, sent_map)] + [(self._build_text_request(rule, t, e), None) for t, e in follow_ups]
+                if outbox is not None:
+                    outbox.extend(requests)
+                elif follow_ups:
+                    self._send_in_order(requests, to_peer_id)
+                else:
+                    self._send_copy(req, sent_map, to_peer_id)
+        except Exception:
+            log(f"[{self.id}] ERROR in _send_album: {traceback.format_exc()}")
+            
+    def _build_text_request(self, rule, text, entities):
+        """Builds a plain text send to the rule's destination (and topic), used for digests and split-off parts."""
+        req = TLRPC.TL_messages_sendMessage()
+        req.peer = self._messages_controller().getInputPeer(rule["destination"])
+        req.message = text
+        req.random_id = random.getrandbits(63)
+        reply_to = self._build_input_reply_to(0, rule.get("destination_topic_id", 0))
+        if reply_to:
+            req.reply_to = reply_to
+            req.flags |= 1
+        if entities and not entities.isEmpty():
+            req.entities = entities
+            req.flags |= 8
+        self._apply_delivery_schedule(req, rule)
+        return req
+
+    def _send_copy(self, req, sent_map, to_peer_id, attempt=0):
+        """Sends a forwarded copy asynchronously, recording where it landed once the server answers."""
+        self._remember_own_copies(random_ids=sent_map)
+        account = self._active_account()
+        def on_complete(response, error):
+            if self._is_file_reference_error(error) and attempt < self.FILE_REFERENCE_RETRY_LIMIT:
+                self._queue_expired_media_send(account, req, sent_map, to_peer_id, attempt)
+                return
+            self._on_messages_sent(response, error, sent_map, to_peer_id, account)
+        self._send_request(req, RequestCallback(on_complete))
+
+    def _send_in_order(self, requests, to_peer_id, source=None):
+        """
+        Sends (request, sent_map) pairs one at a time, each after the previous one completed,
+        so the parts of a split message can't interleave with the next item in the lane.
+        Blocks the worker thread; stops at the first failure. On FLOOD_WAIT the unsent parts
+        go back to the head of the source's lane, which pauses while the other lanes go on.
+        `source` is the (chat, message id) being sent, taken from the first request if not given.
+        """
+        source = source or next((pair for pairs in (requests[0][1] or {}).values() for pair in pairs), (0, 0))
+        source_chat_id = source[0]
+        for index, (req, sent_map) in enumerate(requests):
+            sent_map = sent_map or {req.random_id: []}
+            self._remember_own_copies(random_ids=sent_map)
+            response, error = self._send_request_sync(req)
+            for _ in range(self.FILE_REFERENCE_RETRY_LIMIT):
+                if not self._is_file_reference_error(error):
+                    break
+                # Already on the worker, so the refetch happens inline and the parts stay in order.
+                source_chat_id = self._get_sent_map_source(sent_map)
+                fresh = self._fetch_messages_sync(source_chat_id, self._get_sent_map_message_ids(sent_map))
+                fresh_sent_map = self._rebind_request_media(req, sent_map, {mo.messageOwner.id: mo for mo in fresh})
+                if fresh_sent_map is None:
+                    break
+                sent_map = fresh_sent_map
+                self._remember_own_copies(random_ids=sent_map)
+                response, error = self._send_request_sync(req)
+            flood_wait = self._get_flood_wait_seconds(error)
+            if flood_wait and source_chat_id:
+                log(f"[{self.id}] Send to {to_peer_id} hit FLOOD_WAIT, pausing the lane of {source_chat_id} for {flood_wait}s.")
+                processing_queue = self._get_processing_queue(self._active_account())
+                processing_queue.put(("parts", source_chat_id, to_peer_id, requests[index:], source[1]), front=True)
+                processing_queue.pause(source_chat_id, time.time() + flood_wait)
+                return
+            if error or response is None:
+                log(f"[{self.id}] Send to {to_peer_id} failed, dropping the remaining parts: {getattr(error, 'text', error)}")
+                self._record_rule_error(sent_map, getattr(error, 'text', None) or "No response")
+                self._settle_content_claims(sent_map, sent=False)
+                return
+            self._on_messages_sent(response, error, sent_map, to_peer_id, source=source)
+
+    def _is_file_reference_error(self, error):
+        """True for FILE_REFERENCE_* errors, which a refetch of the source message can fix."""
+        return (getattr(error, 'text', None) or "").startswith("FILE_REFERENCE_")
+
+    def _get_sent_map_source(self, sent_map):
+        """Returns the source chat of the messages a send copies."""
+        for sources in sent_map.values():
+            for source_chat_id, _ in sources:
+                return source_chat_id
+        return 0
+
+    def _get_sent_map_message_ids(self, sent_map):
+        """Returns the source message ids a send copies, in id order."""
+        return sorted({message_id for sources in sent_map.values() for _, message_id in sources})
+
+    def _queue_expired_media_send(self, account, req, sent_map, to_peer_id, attempt):
+        """
+        Parks a send whose file reference expired and schedules a refresh in its rule's lane.
+        Sends that expire before the worker gets to the refresh share its single refetch.
+        """
+        source_chat_id = self._get_sent_map_source(sent_map)
+        if not source_chat_id:
+            log(f"[{self.id}] Send to {to_peer_id} failed with an expired file reference and can't be refreshed.")
+            return
+        with self.expired_media_lock:
+            pending = self.expired_media_sends.setdefault((account, source_chat_id), [])
+            pending.append((req, sent_map, to_peer_id, attempt))
+            schedule_refresh = len(pending) == 1
+        log(f"[{self.id}] File reference expired for a send to {to_peer_id}, refreshing it from {source_chat_id}.")
+        if schedule_refresh:
+            self._get_processing_queue(account).put(("refresh", source_chat_id))
+
+    def _retry_expired_media_sends(self, source_chat_id):
+        """Refetches every parked message of a source chat in one call, rebuilds their media and resends them."""
+        with self.expired_media_lock:
+            pending = self.expired_media_sends.pop((self._active_account(), source_chat_id), [])
+        if not pending:
+            return
+        try:
+            message_ids = sorted({message_id for _, sent_map, _, _ in pending for message_id in self._get_sent_map_message_ids(sent_map)})
+            fresh = {}
+            for i in range(0, len(message_ids), 100):  # getMessages accepts up to 100 ids per call.
+                for message_object in self._fetch_messages_sync(source_chat_id, message_ids[i:i + 100]):
+                    fresh[message_object.messageOwner.id] = message_object
+            for req, sent_map, to_peer_id, attempt in pending:
+                new_sent_map = self._rebind_request_media(req, sent_map, fresh)
+                if new_sent_map is None:
+                    log(f"[{self.id}] Dropping a send to {to_peer_id}: its source messages in {source_chat_id} are gone.")
+                    self._settle_content_claims(sent_map, sent=False)
                     continue
+                self._send_copy(req, new_sent_map, to_peer_id, attempt + 1)
+        except Exception:
+            log(f"[{self.id}] ERROR retrying sends with expired file references: {traceback.format_exc()}")
 
-                single_media = TLRPC.TL_inputSingleMedia()
-                single_media.media = input_media
-                single_media.random_id = random.getrandbits(63)
-
-                if not header_attached:
-                    final_caption = f"{prefix_text}\n\n{album_caption}".strip()
-                    final_entities = self._prepare_final_entities(prefix_text, prefix_entities, album_entities)
-                    single_media.message = final_caption
-                    if final_entities and not final_entities.isEmpty():
-                        single_media.entities = final_entities
-                        single_media.flags |= 1
-                    header_attached = True
-                else:
-                    single_media.message = ""
-                multi_media_list.add(single_media)
+    def _rebind_request_media(self, req, sent_map, fresh_messages):
+        """
+        Swaps fresh input media into a sendMedia or sendMultiMedia request and gives it new random ids.
+        Returns the matching sent_map, or None if any source message could no longer be fetched.
+        """
+        if isinstance(req, TLRPC.TL_messages_sendMultiMedia):
+            items = [req.multi_media.get(i) for i in range(req.multi_media.size())]
+        elif isinstance(req, TLRPC.TL_messages_sendMedia):
+            items = [req]
+        else:
+            return None
+        new_sent_map = {}
+        for item in items:
+            sources = sent_map.get(item.random_id, [])
+            fresh = fresh_messages.get(sources[0][1]) if sources else None
+            input_media = self._get_input_media(fresh) if fresh else None
+            if not input_media:
+                return None
+            item.media = input_media
+            item.random_id = random.getrandbits(63)
+            new_sent_map[item.random_id] = sources
+        return new_sent_map
+
+    def _split_text_with_entities(self, text, entities, first_limit, limit):
+        """
+        Splits text into chunks of at most `first_limit` (then `limit`) UTF-16 units, cutting at
+        paragraph, line, sentence or word boundaries where possible. Entities are clipped to each
+        chunk and re-based onto it, so one straddling a boundary is split across both chunks.
+        Returns a list of (text, entities) pairs.
+        """
+        units = [0]
+        for char in text:
+            units.append(units[-1] + (2 if ord(char) > 0xFFFF else 1))
+        chunks, start, chunk_limit = [], 0, first_limit
+        while start < len(text):
+            end = bisect.bisect_right(units, units[start] + chunk_limit) - 1
+            if end < len(text):
+                window = text[start:end]
+                for separator in ("\n\n", "\n", ". ", "! ", "? ", " "):
+                    cut = window.rfind(separator)
+                    if cut >= len(window) // 2:
+                        end = start + cut + len(separator)
+                        break
+            chunk_start, chunk_end = start, end
+            while chunk_start < chunk_end and text[chunk_start].isspace(): chunk_start += 1
+            while chunk_end > chunk_start and text[chunk_end - 1].isspace(): chunk_end -= 1
+            if chunk_end > chunk_start:
+                unit_start, unit_end = units[chunk_start], units[chunk_end]
+                chunk_entities = ArrayList()
+                if entities:
+                    for i in range(entities.size()):
+                        entity = entities.get(i)
+                        clipped_start, clipped_end = max(entity.offset, unit_start), min(entity.offset + entity.length, unit_end)
+                        if clipped_end > clipped_start:
+                            chunk_entities.add(self._copy_entity(entity, clipped_start - unit_start, clipped_end - clipped_start))
+                chunks.append((text[chunk_start:chunk_end], chunk_entities))
+            start, chunk_limit = end, limit
+        return chunks
+
+    def _build_message_prefix(self, message_object, rule, reply_to_msg_id):
+        """Builds the optional 'Forwarded from' header and reply quote that precede a copied message."""
+        message = message_object.messageOwner
+        prefix_text, prefix_entities = "", ArrayList()
+        if not rule.get("drop_author", True):
+            source_entity = self._get_chat_entity(self._get_id_from_peer(message.peer_id))
+            author_entity = self._get_chat_entity(self._get_id_from_peer(message.from_id))
+            if source_entity:
+                header_text, header_entities = self._build_forward_header(message, source_entity, author_entity)
+                if header_text: prefix_text += header_text
+                if header_entities: prefix_entities.addAll(header_entities)
+
+        if rule.get("quote_replies", True) and not reply_to_msg_id:
+            quote_text, quote_entities = self._build_reply_quote(message_object)
+            if quote_text:
+                if prefix_text: prefix_text += "\n\n"
+                if quote_entities:
+                    for i in range(quote_entities.size()):
+                        entity = quote_entities.get(i)
+                        entity.offset += self._get_java_len(prefix_text)
+                    prefix_entities.addAll(quote_entities)
+                prefix_text += quote_text
+        return prefix_text, prefix_entities
+
+    def _claim_content(self, to_peer_id, topic_id, input_media, text, record=True, source=None):
+        """
+        Content-level deduplication across sources. Returns False if the same photo/document,
+        or the same normalized text, was already sent to this destination by the same account within the window.
+        Otherwise records it (unless `record` is False, for shadow sends) and returns True.
+        The claim is kept for `source`, a (chat id, message id) pair, until its send settles:
+        a failed send gives the content back.
+        """
+        if self.content_dedup_window_seconds <= 0:
+            return True
+        content_key = None
+        if input_media is not None and getattr(input_media, 'id', None) is not None:
+            kind = "photo" if isinstance(input_media, TLRPC.TL_inputMediaPhoto) else "document"
+            content_key = (kind, input_media.id.id)
+        elif text:
+            normalized = re.sub(r'\s+', ' ', text).strip().lower()
+            if normalized:
+                content_key = ("text", hashlib.sha1(normalized.encode('utf-8')).hexdigest())
+        if content_key is None:
+            return True
+        account = self._active_account()
+        claim_key = (account, to_peer_id, topic_id) + content_key
+        if not record:
+            return claim_key not in self.content_dedup_cache
+        if not self.content_dedup_cache.put_if_absent(claim_key, True):
+            return False
+        if source is not None:
+            self.content_claims.put((account,) + tuple(source), claim_key)
+        return True
+
+    def _settle_content_claims(self, sent_map, sent, account=None):
+        """Ends the content claims of a send's source messages; if it wasn't `sent`, the content is free again."""
+        account = self._active_account() if account is None else account
+        for sources in sent_map.values():
+            for source in sources:
+                claim_key = self.content_claims.pop((account,) + tuple(source))
+                if claim_key is not None and not sent:
+                    self.content_dedup_cache.pop(claim_key)
+
+    def _build_input_reply_to(self, reply_to_msg_id, topic_id):
+        """Builds the reply header for a send request, threading into a topic if one is set."""
+        if not reply_to_msg_id and topic_id <= 0:
+            return None
+        reply_to = TLRPC.TL_inputReplyToMessage()
+        reply_to.reply_to_msg_id = reply_to_msg_id or topic_id
+        if reply_to_msg_id and topic_id > 0:
+            reply_to.top_msg_id = topic_id
+            reply_to.flags |= 1
+        return reply_to
+
+    def _get_mapped_reply_id(self, message, to_peer_id):
+        """Returns the destination copy of the message being replied to, or 0 if it was never forwarded there."""
+        reply_header = getattr(message, 'reply_to', None)
+        reply_to_msg_id = getattr(reply_header, 'reply_to_msg_id', 0) if reply_header else 0
+        if not reply_to_msg_id:
+            return 0
+        entry = self.message_id_map.get(self._active_account(), self._get_id_from_peer(message.peer_id), reply_to_msg_id, to_peer_id)
+        return entry[1] if entry else 0
 
-            if not multi_media_list.isEmpty():
-                req.multi_media = multi_media_list
-                send_request(req, RequestCallback(lambda r, e: None))
+    def _on_messages_sent(self, response, error, sent_map, to_peer_id, account=None, source=None):
+        """
+        Records the destination ids of freshly sent copies so later replies can thread to them.
+        `source` is the (chat, message id) a send with no sources of its own, like a split-off part, belongs to.
+        """
+        account = self._active_account() if account is None else account
+        if error:
+            log(f"[{self.id}] Send to {to_peer_id} failed: {getattr(error, 'text', error)}")
+            self._record_rule_error(sent_map, getattr(error, 'text', None) or str(error), account)
+            self._settle_content_claims(sent_map, sent=False, account=account)
+            return
+        self._settle_content_claims(sent_map, sent=True, account=account)
+        try:
+            sent_ids = self._extract_sent_message_ids(response, sent_map)
+            self._remember_own_copies(sent_messages=[(to_peer_id, dest_msg_id) for dest_msg_id in sent_ids.values()], account=account)
+            for random_id, dest_msg_id in sent_ids.items():
+                for source_chat_id, source_msg_id in sent_map[random_id]:
+                    self.message_id_map.put(account, source_chat_id, source_msg_id, to_peer_id, dest_msg_id)
+            self._queue_chain_hop(account, next((pair for pairs in sent_map.values() for pair in pairs), source), to_peer_id, sorted(sent_ids.values()))
         except Exception:
-            log(f"[{self.id}] ERROR in _send_album: {traceback.format_exc()}")
-            
+            log(f"[{self.id}] ERROR recording sent message ids: {traceback.format_exc()}")
+
+    def _queue_chain_hop(self, account, source, to_peer_id, dest_msg_ids):
+        """
+        With chain short-circuiting on, hands fresh copies in a chat that is itself a rule's source
+        to that rule's lane, where they go through its whole pipeline as their echoes would have.
+        A hop is taken only while it is downstream of the chain's origin rule, so a loop ends
+        before a chat would receive the message a second time.
+        """
+        if not self.chain_short_circuit or not source or not dest_msg_ids:
+            return
+        hop_key = self._rule_key(to_peer_id, account)
+        hop_rule = self.forwarding_rules.get(hop_key)
+        if not hop_rule or not hop_rule.get("enabled", False):
+            return
+        origin = self.chain_origins.get((account,) + tuple(source)) or self._rule_key(source[0], account)
+        if hop_key not in self.rule_graph.downstream(origin):
+            return
+        for dest_msg_id in dest_msg_ids:
+            self.chain_origins.put((account, to_peer_id, dest_msg_id), origin)
+        self._get_processing_queue(account).put(("hop", to_peer_id, dest_msg_ids))
+
+    def _ingest_chain_hop(self, source_chat_id, message_ids):
+        """Runs our copies in a chain's next chat through that chat's rule, fetched as the server stored them."""
+        for message_object in self._fetch_messages_sync(source_chat_id, message_ids):
+            if getattr(message_object.messageOwner, 'grouped_id', 0):
+                self._buffer_album_part(message_object)
+            else:
+                self.super_handle_message_event(message_object)
+
+    def _record_rule_error(self, sent_map, error_text, account=None):
+        """Remembers the latest send failure of the rule a send belonged to, for the rules list."""
+        account = self._active_account() if account is None else account
+        source_chat_id = self._get_sent_map_source(sent_map)
+        if source_chat_id:
+            self.rule_errors[(account, source_chat_id)] = (time.time(), error_text)
+
+    def _extract_sent_message_ids(self, response, sent_map):
+        """Maps request random_ids to the message ids the server assigned to them."""
+        sent_ids = {}
+        if isinstance(response, TLRPC.TL_updateShortSentMessage):
+            if len(sent_map) == 1:
+                sent_ids[next(iter(sent_map))] = response.id
+            return sent_ids
+        updates = getattr(response, 'updates', None)
+        if updates:
+            # Scheduled sends get temporary ids that change on delivery, so they can't be threaded to.
+            if any(isinstance(updates.get(i), TLRPC.TL_updateNewScheduledMessage) for i in range(updates.size())):
+                return sent_ids
+            for i in range(updates.size()):
+                update = updates.get(i)
+                if isinstance(update, TLRPC.TL_updateMessageID) and update.random_id in sent_map:
+                    sent_ids[update.random_id] = update.id
+        return sent_ids
+
     def _build_reply_quote(self, message_object):
         """Builds a formatted blockquote string for a replied-to message."""
         replied_message_obj = message_object.replyMessageObject
@@ -789,7 +3413,7 @@ class AutoForwarderPlugin(BasePlugin):
         is_group = isinstance(source_entity, TLRPC.TL_chat) or (isinstance(source_entity, TLRPC.TL_channel) and getattr(source_entity, 'megagroup', True))
         if is_channel: return self._build_channel_header(message, source_entity)
         if is_group: return self._build_group_header(message, source_entity, author_entity)
-        me = get_user_config().getCurrentUser()
+        me = self._user_config().getCurrentUser()
         sender, receiver = (author_entity, source_entity) if message.out else (author_entity, me)
         return self._build_private_header(message, sender, receiver)
 
@@ -837,33 +3461,39 @@ class AutoForwarderPlugin(BasePlugin):
     # --- UI & Dialog Methods ---
     def create_settings(self) -> list:
         """Creates the list of UI components for the main plugin settings screen."""
+        from ui.settings import Header, Text, Divider, Input, Switch
+        # Rules are kept current in memory by _save_rule/_remove_rule; only the plain settings need a reload.
         self._load_configurable_settings()
-        self._load_forwarding_rules()
         settings_ui = [
             Header(text="General Settings"),
             Input(key="deferral_timeout_ms", text="Media Deferral Timeout (ms)", default=str(DEFAULT_SETTINGS["deferral_timeout_ms"]), subtext="Safety net for slow media downloads. Increase if files fail to send."),
             Input(key="album_timeout_ms", text="Album Buffering Timeout (ms)", default=str(DEFAULT_SETTINGS["album_timeout_ms"]), subtext="How long to wait for all media in an album before sending."),
             Input(key="sequential_delay_seconds", text="Sequential Delay (Seconds)", default=str(DEFAULT_SETTINGS["sequential_delay_seconds"]), subtext="Forces sequential order but slows down forwarding. 0 to disable."),
             Input(key="deduplication_window_seconds", text="Deduplication Window (Seconds)", default=str(DEFAULT_SETTINGS["deduplication_window_seconds"]), subtext="Time window to ignore duplicate notifications from the client."),
+            Input(key="content_dedup_window_seconds", text="Content Deduplication Window (Seconds)", default=str(DEFAULT_SETTINGS["content_dedup_window_seconds"]), subtext="Skip a file or text already sent to the same destination within this window, even from another source. 0 to disable."),
             Input(key="min_msg_length", text="Minimum Message Length", default=str(DEFAULT_SETTINGS["min_msg_length"]), subtext="For text-only messages."),
-            Input(key="max_msg_length", text="Maximum Message Length", default=str(DEFAULT_SETTINGS["max_msg_length"]), subtext="For text-only messages."),
+            Input(key="max_msg_length", text="Maximum Message Length", default=str(DEFAULT_SETTINGS["max_msg_length"]), subtext="For text-only messages. 0 means no limit."),
             Input(key="antispam_delay_seconds", text="Anti-Spam Delay (Seconds)", default=str(DEFAULT_SETTINGS["antispam_delay_seconds"]), subtext="Minimum time between forwards from the same user. 0 to disable."),
+            Input(key="antispam_burst", text="Anti-Spam Burst", default=str(DEFAULT_SETTINGS["antispam_burst"]), subtext="How many messages a user may send back-to-back before the delay applies."),
+            Input(key="backfill_rate_per_minute", text="Backfill Speed (Messages/Minute)", default=str(DEFAULT_SETTINGS["backfill_rate_per_minute"]), subtext="Throughput budget for history backfills. Lower it if you hit flood limits."),
+            Switch(key="chain_short_circuit", text="Short-Circuit Rule Chains", default=DEFAULT_SETTINGS["chain_short_circuit"], subtext="For chains like A→B→C, hand our copies straight to the next rule instead of waiting for their echoes, and never loop."),
             Divider(),
             Header(text="Active Forwarding Rules")
         ]
+        for cycle in self.rule_graph.cycles:
+            loop_names = " → ".join(self._get_chat_name(chat_id, account) for account, chat_id in cycle + cycle[:1])
+            consequence = "Each chat in it receives a message once." if self.chain_short_circuit else "Messages will bounce between these chats."
+            settings_ui.append(Text(text=f"Forwarding loop: {loop_names}\n{consequence} Disable or change one of these rules.", icon="msg_report", red=True))
         if not self.forwarding_rules:
             settings_ui.append(Text(text="No rules configured. Set one from any chat's menu.", icon="msg_info"))
         else:
-            sorted_rules = sorted(self.forwarding_rules.items(), key=lambda item: self._get_chat_name(item[0]).lower())
-            for source_id, rule_data in sorted_rules:
-                source_name = self._get_chat_name(source_id)
-                dest_name = self._get_chat_name(rule_data.get("destination", 0)) if rule_data.get("destination") else "Not Set"
-                style = "(Copy)"
-                settings_ui.append(Text(
-                    text=f"From: {source_name}\nTo: {dest_name} {style}",
-                    icon="msg_edit",
-                    on_click=lambda v, sid=source_id: self._show_rule_action_dialog(sid)
-                ))
+            settings_ui.extend(self._build_rule_list_items())
+        settings_ui.append(Text(text="Export Rules", icon="msg_share", accent=True, on_click=lambda v: self._export_rules()))
+        settings_ui.append(Text(text="Import Rules from Clipboard", icon="msg_download", accent=True, on_click=lambda v: self._import_rules_from_clipboard()))
+        settings_ui.append(Divider())
+        settings_ui.append(Header(text="Engine Health"))
+        for text, is_problem in self._get_health_rows():
+            settings_ui.append(Text(text=text, icon="msg_report" if is_problem else "msg_info", red=is_problem))
         settings_ui.append(Divider())
         settings_ui.extend([
             Header(text="About & Support"),
@@ -881,6 +3511,434 @@ class AutoForwarderPlugin(BasePlugin):
         ])
         return settings_ui
 
+    # --- Rules List ---
+    def _get_rule_name_index(self):
+        """
+        Returns [(rule_key, source_name, destination_name, search_text)] sorted by account and
+        source name. Built once and reused until the rules change, so opening the settings
+        screen costs no entity lookups per rule.
+        """
+        index = self.rule_name_index
+        if index is not None and time.time() - self.rule_name_index_built_at < self.RULE_NAME_INDEX_TTL_SECONDS:
+            return index
+        index = []
+        for (account, source_id), rule_data in self.forwarding_rules.items():
+            source_name = self._get_rule_chat_name(source_id, account, rule_data.get("source_name"))
+            destination = rule_data.get("destination")
+            dest_name = self._get_rule_chat_name(destination, account, rule_data.get("destination_name")) if destination else "Not Set"
+            index.append(((account, source_id), source_name, dest_name, f"{source_name}\n{dest_name}\n{source_id}\n{destination}".lower()))
+        index.sort(key=lambda entry: (entry[0][0], entry[1].lower()))
+        self.rule_name_index, self.rule_name_index_built_at = index, time.time()
+        return index
+
+    def _get_rule_chat_name(self, chat_id, account, stored_name):
+        """A chat's current name, or the name saved with the rule while the chat isn't loaded yet."""
+        name = self._get_chat_name(chat_id, account)
+        return stored_name if name == "Unknown" and stored_name else name
+
+    def _build_rule_list_items(self):
+        """Builds the search bar, one page of matching rules with status badges, and the page controls."""
+        from ui.settings import Text
+        items = []
+        query = self.rule_list_query.strip().lower()
+        index = self._get_rule_name_index()
+        matches = [entry for entry in index if query in entry[3]] if query else index
+        page_count = max(1, -(-len(matches) // self.RULES_PAGE_SIZE))
+        page = self.rule_list_page = min(self.rule_list_page, page_count - 1)
+
+        search_text = f"Search: \"{self.rule_list_query.strip()}\" ({len(matches)} of {len(index)})" if query else f"Search {len(index)} Rules..."
+        items.append(Text(text=search_text, icon="msg_search", accent=True, on_click=lambda v: self._show_rule_search_dialog()))
+        if query:
+            items.append(Text(text="Clear Search", icon="msg_clear", accent=True, on_click=lambda v: self._set_rule_list_view("", 0)))
+
+        multi_account = len({account for account, _ in self.forwarding_rules}) > 1 or len(self._get_active_accounts()) > 1
+        backlogs = self._get_rule_backlogs()
+        now = time.time()
+        for (account, source_id), source_name, dest_name, _ in matches[page * self.RULES_PAGE_SIZE:(page + 1) * self.RULES_PAGE_SIZE]:
+            rule_data = self.forwarding_rules.get((account, source_id))
+            if rule_data is None:
+                continue
+            badges = ["Enabled" if rule_data.get("enabled", False) else "Paused"]
+            if rule_data.get("shadow", False):
+                badges[0] += " (shadow)"
+            if backlogs.get((account, source_id)):
+                badges.append(f"{backlogs[(account, source_id)]} queued")
+            if (account, source_id) in self.backfill_jobs:
+                badges.append("backfilling")
+            error = self.rule_errors.get((account, source_id))
+            recent_error = bool(error) and now - error[0] < 60 * 60
+            if error:
+                badges.append(f"last error {self._format_age(now - error[0])} ago: {error[1]}")
+            account_tag = f"\nAccount: {self._get_account_label(account)}" if multi_account else ""
+            items.append(Text(
+                text=f"From: {source_name}\nTo: {dest_name} (Copy)\n{' · '.join(badges)}{account_tag}",
+                icon="msg_edit",
+                red=recent_error,
+                on_click=lambda v, acc=account, sid=source_id: self._open_rule_for_account(acc, sid)
+            ))
+        if not matches:
+            items.append(Text(text="No rules match the search.", icon="msg_info"))
+
+        if page_count > 1:
+            items.append(Text(text=f"Page {page + 1} of {page_count}", icon="msg_info"))
+            if page > 0:
+                items.append(Text(text="Previous Page", icon="msg_arrow_back", accent=True, on_click=lambda v: self._set_rule_list_view(self.rule_list_query, page - 1)))
+            if page < page_count - 1:
+                items.append(Text(text="Next Page", icon="msg_arrow_forward", accent=True, on_click=lambda v: self._set_rule_list_view(self.rule_list_query, page + 1)))
+        return items
+
+    def _get_rule_backlogs(self):
+        """Returns the number of queued items per rule key, from one snapshot of each account's lanes."""
+        with self.queues_lock:
+            queues = list(self.processing_queues.items())
+        return {(account, lane): size for account, processing_queue in queues
+                for lane, size in processing_queue.lane_sizes().items() if lane is not None}
+
+    def _format_age(self, seconds):
+        if seconds < 60: return f"{int(seconds)}s"
+        if seconds < 60 * 60: return f"{int(seconds // 60)}m"
+        if seconds < 24 * 60 * 60: return f"{int(seconds // 3600)}h"
+        return f"{int(seconds // 86400)}d"
+
+    def _set_rule_list_view(self, query, page):
+        """Changes the rules list's search query or page and rebuilds the settings screen."""
+        self.rule_list_query, self.rule_list_page = query, max(0, page)
+        self._refresh_settings_ui()
+
+    def _show_rule_search_dialog(self):
+        """Asks for a search term matched against source and destination names and ids."""
+        from ui.alert import AlertDialogBuilder
+        from android.widget import EditText, LinearLayout
+        from android.util import TypedValue
+        from org.telegram.ui.ActionBar import Theme
+        activity = get_last_fragment().getParentActivity()
+        if not activity: return
+        try:
+            builder = AlertDialogBuilder(activity)
+            builder.set_title("Search Rules")
+            margin_px = int(TypedValue.applyDimension(TypedValue.COMPLEX_UNIT_DIP, 20, activity.getResources().getDisplayMetrics()))
+            layout = LinearLayout(activity)
+            layout.setOrientation(LinearLayout.VERTICAL)
+            layout.setPadding(margin_px, margin_px // 4, margin_px, 0)
+            search_input = EditText(activity)
+            search_input.setHint("Chat name or ID")
+            search_input.setText(self.rule_list_query)
+            search_input.setTextColor(Theme.getColor(Theme.key_dialogTextBlack))
+            search_input.setHintTextColor(Theme.getColor(Theme.key_dialogTextHint))
+            layout.addView(search_input)
+            builder.set_view(layout)
+            builder.set_positive_button("Search", lambda b, w: self._set_rule_list_view(search_input.getText().toString().strip(), 0))
+            builder.set_negative_button("Cancel", None)
+            run_on_ui_thread(builder.show)
+        except Exception:
+            log(f"[{self.id}] ERROR showing rule search dialog: {traceback.format_exc()}")
+
+    # --- Rule Import/Export ---
+    def _export_rules(self):
+        """Copies the active account's rules and changed general settings to the clipboard as JSON."""
+        try:
+            config = self._build_rule_config()
+            self._copy_to_clipboard(json.dumps(config, indent=1, ensure_ascii=False), "Rules", f"{len(config['rules'])} rule(s) copied to clipboard!")
+        except Exception:
+            log(f"[{self.id}] ERROR exporting rules: {traceback.format_exc()}")
+            BulletinHelper.show_error("Could not export the rules.", get_last_fragment())
+
+    def _build_rule_config(self):
+        """Builds the versioned export document for the active account."""
+        account = self._active_account()
+        self._load_configurable_settings()
+        # Exported in the default's type, which is what _validate_config_setting expects back.
+        settings = {key: type(default)(getattr(self, key)) for key, default in DEFAULT_SETTINGS.items() if getattr(self, key) != default}
+        rules = []
+        for (rule_account, source_id), rule_data in sorted(self.forwarding_rules.items()):
+            if rule_account != account:
+                continue
+            destination = rule_data.get("destination", 0)
+            rule = {"source": source_id, "destination": destination}
+            rule.update(self._normalize_rule_config(rule_data))
+            rule["source_name"] = self._get_rule_chat_name(source_id, account, rule_data.get("source_name"))
+            rule["destination_name"] = self._get_rule_chat_name(destination, account, rule_data.get("destination_name"))
+            rules.append(rule)
+        return {
+            "format": RULE_CONFIG_FORMAT,
+            "version": RULE_CONFIG_VERSION,
+            "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "settings": settings,
+            "rules": rules
+        }
+
+    def _normalize_rule_config(self, rule_data):
+        """The rule's options with every missing one set to its default, in RULE_CONFIG_FIELDS order."""
+        rule = collections.OrderedDict((field, rule_data.get(field, default)) for field, default in RULE_CONFIG_FIELDS.items())
+        rule["filters"] = {key: rule["filters"].get(key, True) for key in FILTER_TYPES}
+        return rule
+
+    def _import_rules_from_clipboard(self):
+        """Validates the rules document on the clipboard, resolves its destinations in one batch and shows a preview."""
+        text = self._read_clipboard_text()
+        if not text.strip():
+            BulletinHelper.show_error("The clipboard is empty. Copy an exported rules file first.", get_last_fragment())
+            return
+        settings, rules, errors = self._parse_rule_config(text)
+        if errors:
+            self._show_import_errors_dialog(errors)
+            return
+        account = self._active_account()
+        log(f"[{self.id}] Importing {len(rules)} rule(s) for account {account}, resolving destinations.")
+        BulletinHelper.show_info(f"Checking {len(rules)} rule(s)...", get_last_fragment())
+
+        def on_resolved(results):
+            resolved, failures = {}, []
+            for source_id, (query, rule) in rules.items():
+                result, error_text = results.get(query, (None, "not resolved"))
+                if not result:
+                    failures.append((source_id, query, error_text))
+                    continue
+                rule_data = dict(rule)
+                rule_data["destination"] = result[0]
+                rule_data["source_name"] = self._get_rule_chat_name(source_id, account, rule.get("source_name"))
+                rule_data["destination_name"] = result[1]
+                resolved[source_id] = rule_data
+            run_on_ui_thread(lambda: self._show_import_preview(account, settings, resolved, failures))
+        self.destination_resolver.resolve_many(account, [query for query, _ in rules.values()], on_resolved)
+
+    def _read_clipboard_text(self):
+        from android.content import Context
+        activity = get_last_fragment().getParentActivity()
+        if not activity: return ""
+        try:
+            clip = activity.getSystemService(Context.CLIPBOARD_SERVICE).getPrimaryClip()
+            if clip is None or clip.getItemCount() == 0:
+                return ""
+            text = clip.getItemAt(0).coerceToText(activity)
+            return str(text) if text is not None else ""
+        except Exception:
+            log(f"[{self.id}] Failed to read the clipboard: {traceback.format_exc()}")
+            return ""
+
+    def _parse_rule_config(self, text):
+        """
+        Parses and validates a rules document without applying anything. Returns (settings, rules,
+        errors), where rules maps each source id to (destination query, normalized rule options).
+        """
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            return {}, {}, [f"Not valid JSON: {e}"]
+        if not isinstance(data, dict) or data.get("format") != RULE_CONFIG_FORMAT:
+            return {}, {}, ["This is not an Auto Forwarder rules export."]
+        version = data.get("version")
+        if not self._is_config_int(version) or not 1 <= version <= RULE_CONFIG_VERSION:
+            return {}, {}, [f"Unsupported format version {version!r}. This plugin reads versions up to {RULE_CONFIG_VERSION}."]
+
+        errors = [f"Unknown key '{key}'." for key in data if key not in ("format", "version", "exported_at", "settings", "rules")]
+        settings = {}
+        raw_settings = data.get("settings", {})
+        if not isinstance(raw_settings, dict):
+            errors.append("'settings' must be an object.")
+            raw_settings = {}
+        for key, value in raw_settings.items():
+            error = self._validate_config_setting(key, value)
+            if error:
+                errors.append(f"settings.{key}: {error}")
+            else:
+                settings[key] = type(DEFAULT_SETTINGS[key])(value)
+
+        rules = {}
+        raw_rules = data.get("rules", [])
+        if not isinstance(raw_rules, list):
+            errors.append("'rules' must be a list.")
+            raw_rules = []
+        for position, raw_rule in enumerate(raw_rules, 1):
+            try:
+                source_id, destination, rule = self._validate_config_rule(raw_rule)
+            except ValueError as e:
+                errors.append(f"Rule {position}: {e}")
+                continue
+            if source_id in rules:
+                errors.append(f"Rule {position}: source {source_id} already has a rule earlier in the file.")
+                continue
+            rules[source_id] = (destination, rule)
+        return settings, rules, errors
+
+    def _is_config_int(self, value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    def _validate_config_setting(self, key, value):
+        """Returns why an imported general setting is invalid, or None."""
+        if key not in DEFAULT_SETTINGS:
+            return "unknown setting"
+        default = DEFAULT_SETTINGS[key]
+        if isinstance(default, bool):
+            return None if isinstance(value, bool) else "must be true or false"
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return "must be a number"
+        if isinstance(default, int) and not float(value).is_integer():
+            return "must be a whole number"
+        return "must not be negative" if value < 0 else None
+
+    def _validate_config_rule(self, raw_rule):
+        """
+        Checks one imported rule against RULE_CONFIG_FIELDS and the same checks as the rule dialog.
+        Returns (source_id, destination query, rule options). Raises ValueError.
+        """
+        if not isinstance(raw_rule, dict):
+            raise ValueError("must be an object")
+        unknown = set(raw_rule) - set(RULE_CONFIG_FIELDS) - {"source", "destination", "source_name", "destination_name"}
+        if unknown:
+            raise ValueError(f"unknown option(s): {', '.join(sorted(unknown))}")
+        source_id = raw_rule.get("source")
+        if not self._is_config_int(source_id) or source_id == 0:
+            raise ValueError("'source' must be a chat ID")
+
+        destination = raw_rule.get("destination")
+        if isinstance(destination, str):
+            destination = destination.strip()
+            try:
+                destination = int(destination)
+            except ValueError:
+                if "/joinchat/" in destination or "/+" in destination:
+                    raise ValueError("invite links can't be imported, use the chat ID or @username")
+        if not destination or not (self._is_config_int(destination) or isinstance(destination, str)):
+            raise ValueError("'destination' must be a chat ID or @username")
+
+        filters = raw_rule.get("filters", {})
+        if not isinstance(filters, dict) or any(key not in FILTER_TYPES or not isinstance(value, bool) for key, value in filters.items()):
+            raise ValueError(f"'filters' must map {', '.join(FILTER_TYPES)} to true or false")
+        rule = self._normalize_rule_config(raw_rule)
+        for field, default in RULE_CONFIG_FIELDS.items():
+            value = rule[field]
+            if isinstance(default, bool) and not isinstance(value, bool):
+                raise ValueError(f"'{field}' must be true or false")
+            if self._is_config_int(default) and (not self._is_config_int(value) or value < 0):
+                raise ValueError(f"'{field}' must be a whole number")
+            if isinstance(default, str) and not isinstance(value, str):
+                raise ValueError(f"'{field}' must be a string")
+        if rule["near_duplicate_threshold"] > self.MAX_NEAR_DUPLICATE_THRESHOLD:
+            raise ValueError(f"'near_duplicate_threshold' must be at most {self.MAX_NEAR_DUPLICATE_THRESHOLD}")
+        if rule["antispam_mode"] not in ("drop", "delay"):
+            raise ValueError("'antispam_mode' must be \"drop\" or \"delay\"")
+        if rule["priority"] not in RULE_PRIORITIES:
+            raise ValueError(f"'priority' must be one of {', '.join(RULE_PRIORITIES)}")
+        keyword_pattern = rule["keyword_pattern"].strip()
+        if keyword_pattern:
+            try:
+                _, _, keyword_warning = self._compile_keyword_pattern(keyword_pattern)
+            except ValueError as e:
+                raise ValueError(f"keyword filter rejected: {e}")
+            if keyword_warning:
+                log(f"[{self.id}] Imported keyword pattern '{keyword_pattern}' may be slow: {keyword_warning}")
+        try:
+            self._parse_delivery_windows(rule["delivery_window"])
+        except ValueError as e:
+            raise ValueError(f"delivery window rejected: {e}")
+        if isinstance(raw_rule.get("source_name"), str):
+            rule["source_name"] = raw_rule["source_name"]
+        return source_id, destination, rule
+
+    def _diff_rule_config(self, account, settings, resolved):
+        """
+        Compares an import with the account's current rules and settings. Returns the added and
+        changed source ids (changed as (source_id, [option names])), the unchanged count, the
+        account's source ids missing from the import, and the changed settings as {key: (old, new)}.
+        """
+        added, changed, unchanged = [], [], 0
+        for source_id, rule_data in resolved.items():
+            current = self.forwarding_rules.get((account, source_id))
+            if current is None:
+                added.append(source_id)
+                continue
+            current_options, new_options = self._normalize_rule_config(current), self._normalize_rule_config(rule_data)
+            fields = [field for field in current_options if current_options[field] != new_options[field]]
+            if current.get("destination") != rule_data["destination"]:
+                fields.insert(0, "destination")
+            if fields:
+                changed.append((source_id, fields))
+            else:
+                unchanged += 1
+        missing = [source_id for rule_account, source_id in self.forwarding_rules if rule_account == account and source_id not in resolved]
+        self._load_configurable_settings()
+        changed_settings = {key: (getattr(self, key), value) for key, value in settings.items() if getattr(self, key) != value}
+        return added, changed, unchanged, missing, changed_settings
+
+    def _show_import_preview(self, account, settings, resolved, failures):
+        """Shows what an import would change and applies it on confirmation."""
+        from ui.alert import AlertDialogBuilder
+        activity = get_last_fragment().getParentActivity()
+        if not activity: return
+        try:
+            added, changed, unchanged, missing, changed_settings = self._diff_rule_config(account, settings, resolved)
+            names = {source_id: f"{rule_data['source_name']} → {rule_data['destination_name']}" for source_id, rule_data in resolved.items()}
+            lines = [f"Account: {self._get_account_label(account)}"]
+            def add_section(title, entries):
+                if not entries: return
+                lines.append("")
+                lines.append(f"{title} ({len(entries)}):")
+                lines.extend(f"• {entry}" for entry in entries[:self.IMPORT_PREVIEW_LINES])
+                if len(entries) > self.IMPORT_PREVIEW_LINES:
+                    lines.append(f"… and {len(entries) - self.IMPORT_PREVIEW_LINES} more")
+            add_section("New rules", [names[source_id] for source_id in added])
+            add_section("Changed rules", [f"{names[source_id]}: {', '.join(fields)}" for source_id, fields in changed])
+            add_section("Changed settings", [f"{key}: {old} → {new}" for key, (old, new) in changed_settings.items()])
+            add_section("Skipped, destination not found", [f"{self._get_chat_name(source_id, account)}: {query} ({error_text})" for source_id, query, error_text in failures])
+            add_section("Not in the file", [self._get_rule_chat_name(source_id, account, self.forwarding_rules[(account, source_id)].get("source_name")) for source_id in missing])
+            lines.append("")
+            lines.append(f"Unchanged rules: {unchanged}")
+
+            to_save = {source_id: resolved[source_id] for source_id in added + [source_id for source_id, _ in changed]}
+            new_settings = {key: new for key, (_, new) in changed_settings.items()}
+            builder = AlertDialogBuilder(activity)
+            builder.set_title("Import Rules")
+            if not (to_save or new_settings):
+                lines.append("\nNothing to import.")
+                builder.set_message("\n".join(lines))
+                builder.set_positive_button("Close", None)
+            else:
+                if missing:
+                    lines.append("\"Import\" keeps rules that are not in the file. \"Replace All\" deletes them.")
+                builder.set_message("\n".join(lines))
+                builder.set_positive_button("Import", lambda b, w: self._apply_rule_import(account, to_save, new_settings))
+                if missing:
+                    builder.set_neutral_button("Replace All", lambda b, w: self._apply_rule_import(account, to_save, new_settings, missing))
+                builder.set_negative_button("Cancel", None)
+            run_on_ui_thread(builder.show)
+        except Exception:
+            log(f"[{self.id}] ERROR showing import preview: {traceback.format_exc()}")
+
+    def _show_import_errors_dialog(self, errors):
+        from ui.alert import AlertDialogBuilder
+        activity = get_last_fragment().getParentActivity()
+        if not activity: return
+        try:
+            shown = errors[:self.IMPORT_PREVIEW_LINES]
+            more = f"\n… and {len(errors) - len(shown)} more" if len(errors) > len(shown) else ""
+            builder = AlertDialogBuilder(activity)
+            builder.set_title("Import Failed")
+            builder.set_message("Nothing was imported. Fix these problems and copy the file again:\n\n" + "\n".join(f"• {error}" for error in shown) + more)
+            builder.set_positive_button("Close", None)
+            run_on_ui_thread(builder.show)
+        except Exception:
+            log(f"[{self.id}] ERROR showing import errors: {traceback.format_exc()}")
+
+    def _apply_rule_import(self, account, to_save, new_settings, removed_sources=()):
+        """Writes the previewed rules and settings. Does nothing if the user switched accounts meanwhile."""
+        if account != self._active_account():
+            BulletinHelper.show_error("The account was switched. Import the rules again.", get_last_fragment())
+            return
+        try:
+            for key, value in new_settings.items():
+                self.set_setting(key, value if isinstance(value, bool) else str(value))
+            self._load_configurable_settings()
+            self._save_rules(to_save, removed_sources)
+            for source_id in removed_sources:
+                if self._rule_key(source_id) in self.backfill_jobs: self._stop_backfill(source_id)
+            log(f"[{self.id}] Imported {len(to_save)} rule(s) and {len(new_settings)} setting(s) for account {account}, removed {len(removed_sources)} rule(s).")
+            BulletinHelper.show_info(f"Imported {len(to_save)} rule(s).", get_last_fragment())
+            self._refresh_settings_ui()
+        except Exception:
+            log(f"[{self.id}] ERROR applying rule import: {traceback.format_exc()}")
+            BulletinHelper.show_error("Import failed. See the log for details.", get_last_fragment())
+
     def _add_chat_menu_item(self):
         """Adds the 'Auto Forward...' option to the chat three-dots menu."""
         self.add_menu_item(MenuItemData(menu_type=MenuItemType.CHAT_ACTION_MENU, text="Auto Forward...", icon="msg_forward", on_click=self._on_menu_item_click))
@@ -890,27 +3948,177 @@ class AutoForwarderPlugin(BasePlugin):
         current_chat_id = context.get("dialog_id")
         if not current_chat_id: return
         current_chat_id = int(current_chat_id)
-        if current_chat_id in self.forwarding_rules:
+        if self._rule_key(current_chat_id) in self.forwarding_rules:
             run_on_ui_thread(lambda: self._show_rule_action_dialog(current_chat_id))
         else:
             source_name = self._get_chat_name(current_chat_id)
             run_on_ui_thread(lambda: self._show_destination_input_dialog(current_chat_id, source_name))
 
+    def _get_account_label(self, account):
+        """Returns a short display label for a logged-in account."""
+        try:
+            user = UserConfig.getInstance(account).getCurrentUser()
+            if user: return self._get_entity_name(user)
+        except Exception:
+            pass
+        return f"Account {account + 1}"
+
+    def _open_rule_for_account(self, account, source_id):
+        """Opens a rule's actions, or asks the user to switch to the account that owns it."""
+        if account != self._active_account():
+            BulletinHelper.show_info(f"This rule belongs to {self._get_account_label(account)}. Switch to that account to manage it.", get_last_fragment())
+            return
+        self._show_rule_action_dialog(source_id)
+
     def _show_rule_action_dialog(self, source_id):
         """Shows a dialog to Modify, Cancel, or Delete an existing rule."""
+        from ui.alert import AlertDialogBuilder
+        from android.widget import LinearLayout
+        from android.util import TypedValue
         activity = get_last_fragment().getParentActivity()
         if not activity: return
         builder = AlertDialogBuilder(activity)
         builder.set_title("Manage Rule")
-        builder.set_message(f"What would you like to do with the rule for '{self._get_chat_name(source_id)}'?")
+        message = f"What would you like to do with the rule for '{self._get_chat_name(source_id)}'?"
+        report = self.shadow_reports.get(self._rule_key(source_id))
+        if report:
+            stats = report.snapshot()
+            message += f"\n\nShadow mode: would forward {stats['forwarded']} of {stats['seen']} message(s), about {stats['requests_per_minute']:.1f} send requests/min."
+        builder.set_message(message)
+
+        margin_px = int(TypedValue.applyDimension(TypedValue.COMPLEX_UNIT_DIP, 20, activity.getResources().getDisplayMetrics()))
+        actions_layout = LinearLayout(activity)
+        actions_layout.setOrientation(LinearLayout.VERTICAL)
+        actions_layout.setPadding(margin_px, margin_px // 4, margin_px, 0)
+        dialog_holder = {}
+        def run_action(action):
+            if dialog_holder.get('dialog'): dialog_holder['dialog'].dismiss()
+            action()
+        self._add_dialog_link(activity, actions_layout, "Backfill History...", lambda v: run_action(lambda: self._show_backfill_dialog(source_id)))
+        rule = self._get_rule(source_id) or {}
+        if rule.get("shadow", False) or self._rule_key(source_id) in self.shadow_reports:
+            self._add_dialog_link(activity, actions_layout, "Shadow Report...", lambda v: run_action(lambda: self._show_shadow_report_dialog(source_id)))
+        builder.set_view(actions_layout)
+
         builder.set_positive_button("Modify", lambda b, w: self._launch_modification_dialog(source_id))
         builder.set_neutral_button("Cancel", lambda b, w: b.dismiss())
         builder.set_negative_button("Delete", lambda b, w: self._delete_rule_with_confirmation(source_id))
-        run_on_ui_thread(builder.show)
+        dialog = builder.create()
+        dialog_holder['dialog'] = dialog
+        run_on_ui_thread(dialog.show)
+
+    def _add_dialog_link(self, activity, layout, text, on_click):
+        """Adds a link-styled, clickable TextView to a dialog layout."""
+        from android.widget import TextView
+        from android.util import TypedValue
+        from org.telegram.ui.ActionBar import Theme
+        link = TextView(activity)
+        link.setText(text)
+        link.setTextColor(Theme.getColor(Theme.key_dialogTextLink))
+        link.setTextSize(TypedValue.COMPLEX_UNIT_SP, 16)
+        padding_px = int(TypedValue.applyDimension(TypedValue.COMPLEX_UNIT_DIP, 8, activity.getResources().getDisplayMetrics()))
+        link.setPadding(0, padding_px, 0, padding_px)
+        link.setOnClickListener(self.OnClickListenerProxy(on_click))
+        layout.addView(link)
+        return link
+
+    def _show_backfill_dialog(self, source_id):
+        """Shows a dialog to start, or check on, a history backfill for a rule."""
+        from ui.alert import AlertDialogBuilder
+        from android.widget import EditText, LinearLayout
+        from android.util import TypedValue
+        from org.telegram.ui.ActionBar import Theme
+        activity = get_last_fragment().getParentActivity()
+        if not activity: return
+        try:
+            builder = AlertDialogBuilder(activity)
+            builder.set_title("Backfill History")
+            if (self._get_rule(source_id) or {}).get("shadow", False):
+                builder.set_message("This rule is in shadow mode, which never sends anything. Turn shadow mode off to backfill its history.")
+                builder.set_positive_button("Close", None)
+                run_on_ui_thread(builder.show)
+                return
+            job = self.backfill_jobs.get(self._rule_key(source_id))
+            if job:
+                builder.set_message(f"A backfill for '{self._get_chat_name(source_id)}' is running. {job.get('sent', 0)} message(s) forwarded so far.")
+                builder.set_positive_button("Close", None)
+                builder.set_negative_button("Stop", lambda b, w: self._stop_backfill(source_id))
+                run_on_ui_thread(builder.show)
+                return
+
+            builder.set_message("Forward existing messages through this rule. Enter how many of the latest messages to copy, or a start date.")
+            margin_px = int(TypedValue.applyDimension(TypedValue.COMPLEX_UNIT_DIP, 20, activity.getResources().getDisplayMetrics()))
+            layout = LinearLayout(activity)
+            layout.setOrientation(LinearLayout.VERTICAL)
+            layout.setPadding(margin_px, margin_px // 4, margin_px, 0)
+            backfill_input = EditText(activity)
+            backfill_input.setHint("Last N messages (e.g. 500) or date YYYY-MM-DD")
+            backfill_input.setTextColor(Theme.getColor(Theme.key_dialogTextBlack))
+            backfill_input.setHintTextColor(Theme.getColor(Theme.key_dialogTextHint))
+            layout.addView(backfill_input)
+            builder.set_view(layout)
+
+            def on_start(b, w):
+                value = backfill_input.getText().toString().strip()
+                if value.isdigit() and int(value) > 0:
+                    self._start_backfill(source_id, limit=int(value))
+                else:
+                    try:
+                        since_ts = int(time.mktime(time.strptime(value, "%Y-%m-%d")))
+                    except ValueError:
+                        BulletinHelper.show_error("Enter a message count or a date as YYYY-MM-DD.", get_last_fragment())
+                        return
+                    self._start_backfill(source_id, since_ts=since_ts)
+                BulletinHelper.show_info(f"Backfill started for '{self._get_chat_name(source_id)}'.", get_last_fragment())
+
+            builder.set_positive_button("Start", on_start)
+            builder.set_negative_button("Cancel", None)
+            run_on_ui_thread(builder.show)
+        except Exception:
+            log(f"[{self.id}] ERROR showing backfill dialog: {traceback.format_exc()}")
+
+    def _show_shadow_report_dialog(self, source_id):
+        """Shows what a shadow-mode rule would have forwarded, and what it dropped and why."""
+        from ui.alert import AlertDialogBuilder
+        activity = get_last_fragment().getParentActivity()
+        if not activity: return
+        try:
+            rule_key = self._rule_key(source_id)
+            report = self.shadow_reports.get(rule_key)
+            builder = AlertDialogBuilder(activity)
+            builder.set_title("Shadow Report")
+            if not (self._get_rule(source_id) or {}).get("shadow", False):
+                note = "Shadow mode is off, so this rule sends normally. The numbers below are from before."
+            else:
+                note = "Shadow mode is on: messages go through the whole rule, but nothing is sent."
+            if report is None:
+                builder.set_message(f"{note}\n\nNo messages have arrived since shadow mode was turned on.")
+            else:
+                stats = report.snapshot()
+                lines = [
+                    note, "",
+                    f"Since: {time.strftime('%Y-%m-%d %H:%M', time.localtime(stats['started_at']))} ({self._format_age(time.time() - stats['started_at'])})",
+                    f"Messages seen: {stats['seen']}",
+                    f"Would forward: {stats['forwarded']}",
+                    f"Send requests: {stats['requests']} (avg {stats['requests_per_minute']:.1f}/min, peak {stats['peak_requests_per_minute']}/min)",
+                    f"Media re-sent: {self._format_bytes(stats['media_bytes'])}, text: {self._format_bytes(stats['text_bytes'])}"
+                ]
+                if stats["drops"]:
+                    lines.append("")
+                    lines.append("Dropped:")
+                    lines.extend(f"• {reason}: {count}" for reason, count in stats["drops"])
+                lines.append("")
+                lines.append("Counts reset when the plugin restarts.")
+                builder.set_message("\n".join(lines))
+                builder.set_negative_button("Reset", lambda b, w: self.shadow_reports.pop(rule_key, None))
+            builder.set_positive_button("Close", None)
+            run_on_ui_thread(builder.show)
+        except Exception:
+            log(f"[{self.id}] ERROR showing shadow report: {traceback.format_exc()}")
 
     def _launch_modification_dialog(self, source_id):
         """Launches the main settings dialog to modify an existing rule."""
-        rule_data = self.forwarding_rules.get(source_id)
+        rule_data = self._get_rule(source_id)
         if not rule_data:
             BulletinHelper.show_error("Could not find rule to modify.", get_last_fragment())
             return
@@ -919,6 +4127,13 @@ class AutoForwarderPlugin(BasePlugin):
             
     def _show_destination_input_dialog(self, source_id, source_name, existing_rule=None):
         """Shows the main, complex dialog for creating or editing a rule."""
+        from ui.alert import AlertDialogBuilder
+        from android.widget import EditText, CheckBox, LinearLayout, TextView, ScrollView, CompoundButton, RadioGroup, RadioButton
+        from android.text import InputType
+        from android.util import TypedValue
+        from android.view import ViewGroup
+        from android.content.res import ColorStateList
+        from org.telegram.ui.ActionBar import Theme
         activity = get_last_fragment().getParentActivity()
         if not activity: return
         try:
@@ -1049,6 +4264,70 @@ class AutoForwarderPlugin(BasePlugin):
                 cb = CheckBox(activity); cb.setText(label); cb.setTextColor(Theme.getColor(Theme.key_dialogTextBlack))
                 cb.setButtonTintList(checkbox_tint_list); cb.setLayoutParams(checkbox_params)
                 main_layout.addView(cb); filter_checkboxes[key] = cb
+
+            divider_three = View(activity); divider_three.setBackgroundColor(Theme.getColor(Theme.key_divider)); divider_three.setLayoutParams(divider_params); main_layout.addView(divider_three)
+
+            advanced_header = TextView(activity)
+            advanced_header.setText("Advanced:")
+            advanced_header.setTextColor(Theme.getColor(Theme.key_dialogTextBlack)); advanced_header.setTextSize(TypedValue.COMPLEX_UNIT_SP, 16)
+            advanced_header_params = LinearLayout.LayoutParams(ViewGroup.LayoutParams.MATCH_PARENT, ViewGroup.LayoutParams.WRAP_CONTENT)
+            advanced_header_params.setMargins(margin_px, 0, margin_px, 0); advanced_header.setLayoutParams(advanced_header_params); main_layout.addView(advanced_header)
+
+            advanced_input_params = LinearLayout.LayoutParams(ViewGroup.LayoutParams.MATCH_PARENT, ViewGroup.LayoutParams.WRAP_CONTENT)
+            advanced_input_params.setMargins(margin_px, 0, margin_px, margin_px // 4)
+
+            near_duplicate_input = EditText(activity)
+            near_duplicate_input.setHint(f"Near-Duplicate Filter, 1-{self.MAX_NEAR_DUPLICATE_THRESHOLD} bits (optional)")
+            near_duplicate_input.setInputType(InputType.TYPE_CLASS_NUMBER)
+            near_duplicate_input.setTextColor(Theme.getColor(Theme.key_dialogTextBlack)); near_duplicate_input.setHintTextColor(Theme.getColor(Theme.key_dialogTextHint))
+            near_duplicate_input.setLayoutParams(advanced_input_params); main_layout.addView(near_duplicate_input)
+
+            antispam_delay_checkbox = CheckBox(activity)
+            antispam_delay_checkbox.setText("Delay Rate-Limited Messages (instead of dropping)")
+            antispam_delay_checkbox.setTextColor(Theme.getColor(Theme.key_dialogTextBlack)); antispam_delay_checkbox.setButtonTintList(checkbox_tint_list)
+            antispam_delay_checkbox.setLayoutParams(checkbox_params); main_layout.addView(antispam_delay_checkbox)
+
+            digest_window_input = EditText(activity)
+            digest_window_input.setHint("Digest Window in Seconds (optional)")
+            digest_window_input.setInputType(InputType.TYPE_CLASS_NUMBER)
+            digest_window_input.setTextColor(Theme.getColor(Theme.key_dialogTextBlack)); digest_window_input.setHintTextColor(Theme.getColor(Theme.key_dialogTextHint))
+            digest_window_input.setLayoutParams(advanced_input_params); main_layout.addView(digest_window_input)
+
+            digest_max_chars_input = EditText(activity)
+            digest_max_chars_input.setHint("Digest Max Characters (optional)")
+            digest_max_chars_input.setInputType(InputType.TYPE_CLASS_NUMBER)
+            digest_max_chars_input.setTextColor(Theme.getColor(Theme.key_dialogTextBlack)); digest_max_chars_input.setHintTextColor(Theme.getColor(Theme.key_dialogTextHint))
+            digest_max_chars_input.setLayoutParams(advanced_input_params); main_layout.addView(digest_max_chars_input)
+
+            delivery_window_input = EditText(activity)
+            delivery_window_input.setHint("Delivery Window, e.g. 09:00-18:00 (optional)")
+            delivery_window_input.setTextColor(Theme.getColor(Theme.key_dialogTextBlack)); delivery_window_input.setHintTextColor(Theme.getColor(Theme.key_dialogTextHint))
+            delivery_window_input.setLayoutParams(advanced_input_params); main_layout.addView(delivery_window_input)
+
+            server_schedule_checkbox = CheckBox(activity)
+            server_schedule_checkbox.setText("Let Telegram Hold Messages (scheduled send)")
+            server_schedule_checkbox.setTextColor(Theme.getColor(Theme.key_dialogTextBlack)); server_schedule_checkbox.setButtonTintList(checkbox_tint_list)
+            server_schedule_checkbox.setLayoutParams(checkbox_params); main_layout.addView(server_schedule_checkbox)
+
+            priority_label = TextView(activity)
+            priority_label.setText("Queue Priority:")
+            priority_label.setTextColor(Theme.getColor(Theme.key_dialogTextBlack))
+            priority_label.setLayoutParams(advanced_input_params); main_layout.addView(priority_label)
+
+            priority_group = RadioGroup(activity)
+            priority_group.setOrientation(LinearLayout.HORIZONTAL)
+            priority_group.setLayoutParams(checkbox_params)
+            priority_buttons = {}
+            for key in RULE_PRIORITIES:
+                rb = RadioButton(activity); rb.setId(View.generateViewId()); rb.setText(key.capitalize())
+                rb.setTextColor(Theme.getColor(Theme.key_dialogTextBlack)); rb.setButtonTintList(checkbox_tint_list)
+                priority_group.addView(rb); priority_buttons[key] = rb
+            main_layout.addView(priority_group)
+
+            shadow_checkbox = CheckBox(activity)
+            shadow_checkbox.setText("Shadow Mode (measure only, send nothing)")
+            shadow_checkbox.setTextColor(Theme.getColor(Theme.key_dialogTextBlack)); shadow_checkbox.setButtonTintList(checkbox_tint_list)
+            shadow_checkbox.setLayoutParams(checkbox_params); main_layout.addView(shadow_checkbox)
     
             if existing_rule:
                 dest_entity = self._get_chat_entity(existing_rule.get("destination", 0))
@@ -1065,39 +4344,43 @@ class AutoForwarderPlugin(BasePlugin):
                 forward_users_checkbox.setChecked(existing_rule.get("forward_users", True)); forward_bots_checkbox.setChecked(existing_rule.get("forward_bots", True))
                 forward_outgoing_checkbox.setChecked(existing_rule.get("forward_outgoing", True))
                 for key, cb in filter_checkboxes.items(): cb.setChecked(existing_rule.get("filters", {}).get(key, True))
+                if existing_rule.get("near_duplicate_threshold", 0): near_duplicate_input.setText(str(existing_rule["near_duplicate_threshold"]))
+                antispam_delay_checkbox.setChecked(existing_rule.get("antispam_mode", "drop") == "delay")
+                if existing_rule.get("digest_window_seconds", 0): digest_window_input.setText(str(existing_rule["digest_window_seconds"]))
+                if existing_rule.get("digest_max_chars", 0): digest_max_chars_input.setText(str(existing_rule["digest_max_chars"]))
+                delivery_window_input.setText(existing_rule.get("delivery_window", "")); server_schedule_checkbox.setChecked(existing_rule.get("server_schedule", False))
+                priority_buttons.get(existing_rule.get("priority", "normal"), priority_buttons["normal"]).setChecked(True)
+                shadow_checkbox.setChecked(existing_rule.get("shadow", False))
             else:
                 drop_author_checkbox.setChecked(False); quote_replies_checkbox.setChecked(True)
                 forward_users_checkbox.setChecked(True); forward_bots_checkbox.setChecked(True); forward_outgoing_checkbox.setChecked(True)
                 for cb in filter_checkboxes.values(): cb.setChecked(True)
+                priority_buttons["normal"].setChecked(True)
     
             update_author_filter_visibility()
             scroller.addView(main_layout)
             builder.set_view(scroller)
     
-            def on_set_click(d, w):
-                topic_id_str = topic_id_input.getText().toString()
-                topic_id = int(topic_id_str) if forward_to_topic_checkbox.isChecked() and topic_id_str.isdigit() else 0
-                filter_settings = {key: cb.isChecked() for key, cb in filter_checkboxes.items()}
-                self._process_destination_input(
-                    source_id, source_name, input_field.getText().toString(),
-                    keyword_filter_input.getText().toString(), author_filter_input.getText().toString(),
-                    drop_author_checkbox.isChecked(), quote_replies_checkbox.isChecked(),
-                    forward_to_topic_checkbox.isChecked(), topic_id,
-                    forward_users_checkbox.isChecked(), forward_bots_checkbox.isChecked(),
-                    forward_outgoing_checkbox.isChecked(), filter_settings)
-    
-            builder.set_positive_button("Set", on_set_click)
-            builder.set_negative_button("Cancel", lambda d, w: d.dismiss())
-            dialog = builder.create()
-    
             all_ui_elements = {
                 'input_field': input_field, 'keyword_filter_input': keyword_filter_input,
                 'drop_author_checkbox': drop_author_checkbox, 'quote_replies_checkbox': quote_replies_checkbox,
                 'forward_to_topic_checkbox': forward_to_topic_checkbox, 'topic_id_input': topic_id_input,
                 'author_filter_input': author_filter_input, 'forward_users_checkbox': forward_users_checkbox,
                 'forward_bots_checkbox': forward_bots_checkbox, 'forward_outgoing_checkbox': forward_outgoing_checkbox,
-                'filter_checkboxes': filter_checkboxes
+                'filter_checkboxes': filter_checkboxes, 'near_duplicate_input': near_duplicate_input,
+                'antispam_delay_checkbox': antispam_delay_checkbox, 'digest_window_input': digest_window_input,
+                'digest_max_chars_input': digest_max_chars_input, 'delivery_window_input': delivery_window_input,
+                'server_schedule_checkbox': server_schedule_checkbox, 'priority_buttons': priority_buttons,
+                'shadow_checkbox': shadow_checkbox
             }
+
+            def on_set_click(d, w):
+                self._process_destination_input(source_id, source_name, input_field.getText().toString(), self._collect_rule_settings(all_ui_elements))
+    
+            builder.set_positive_button("Set", on_set_click)
+            builder.set_negative_button("Cancel", lambda d, w: d.dismiss())
+            dialog = builder.create()
+    
             on_reply_click_callback = lambda v: self._show_set_by_replying_prompt(activity, dialog, source_id, source_name, all_ui_elements)
             set_by_reply_button.setOnClickListener(self.OnClickListenerProxy(on_reply_click_callback))
             
@@ -1107,23 +4390,14 @@ class AutoForwarderPlugin(BasePlugin):
 
     def _show_set_by_replying_prompt(self, activity, main_dialog, source_id, source_name, ui_elements):
         """Shows the prompt instructing the user how to use the 'Set by Replying' feature."""
+        from ui.alert import AlertDialogBuilder
         builder = AlertDialogBuilder(activity)
         builder.set_title("Set Destination by Replying")
         builder.set_message("Click 'Proceed', then go to your desired destination chat (or topic) and REPLY to ANY message with the exact word 'set'. The reply will be auto-deleted.")
         
         def on_proceed(b, w):
-            rule_settings = {
-                "keyword_pattern": ui_elements['keyword_filter_input'].getText().toString(),
-                "author_filter": ui_elements['author_filter_input'].getText().toString(),
-                "drop_author": ui_elements['drop_author_checkbox'].isChecked(),
-                "quote_replies": ui_elements['quote_replies_checkbox'].isChecked(),
-                "forward_to_topic": ui_elements['forward_to_topic_checkbox'].isChecked(),
-                "destination_topic_id": 0,
-                "forward_users": ui_elements['forward_users_checkbox'].isChecked(),
-                "forward_bots": ui_elements['forward_bots_checkbox'].isChecked(),
-                "forward_outgoing": ui_elements['forward_outgoing_checkbox'].isChecked(),
-                "filter_settings": {key: cb.isChecked() for key, cb in ui_elements['filter_checkboxes'].items()}
-            }
+            rule_settings = self._collect_rule_settings(ui_elements)
+            rule_settings["destination_topic_id"] = 0
             
             self._start_reply_listening(source_id, source_name, rule_settings)
             main_dialog.dismiss()
@@ -1133,6 +4407,35 @@ class AutoForwarderPlugin(BasePlugin):
         builder.set_negative_button("Cancel", None)
         run_on_ui_thread(builder.show)
 
+    def _collect_rule_settings(self, ui_elements):
+        """Reads the rule options out of the rule setup dialog's widgets."""
+        topic_id_str = ui_elements['topic_id_input'].getText().toString()
+        forward_to_topic = ui_elements['forward_to_topic_checkbox'].isChecked()
+        near_duplicate_str = ui_elements['near_duplicate_input'].getText().toString().strip()
+        near_duplicate_threshold = int(near_duplicate_str) if near_duplicate_str.isdigit() else 0
+        digest_window_str = ui_elements['digest_window_input'].getText().toString().strip()
+        digest_max_chars_str = ui_elements['digest_max_chars_input'].getText().toString().strip()
+        return {
+            "keyword_pattern": ui_elements['keyword_filter_input'].getText().toString(),
+            "author_filter": ui_elements['author_filter_input'].getText().toString(),
+            "drop_author": ui_elements['drop_author_checkbox'].isChecked(),
+            "quote_replies": ui_elements['quote_replies_checkbox'].isChecked(),
+            "forward_to_topic": forward_to_topic,
+            "destination_topic_id": int(topic_id_str) if forward_to_topic and topic_id_str.isdigit() else 0,
+            "forward_users": ui_elements['forward_users_checkbox'].isChecked(),
+            "forward_bots": ui_elements['forward_bots_checkbox'].isChecked(),
+            "forward_outgoing": ui_elements['forward_outgoing_checkbox'].isChecked(),
+            "filter_settings": {key: cb.isChecked() for key, cb in ui_elements['filter_checkboxes'].items()},
+            "near_duplicate_threshold": min(near_duplicate_threshold, self.MAX_NEAR_DUPLICATE_THRESHOLD),
+            "antispam_mode": "delay" if ui_elements['antispam_delay_checkbox'].isChecked() else "drop",
+            "digest_window_seconds": int(digest_window_str) if digest_window_str.isdigit() else 0,
+            "digest_max_chars": int(digest_max_chars_str) if digest_max_chars_str.isdigit() else 0,
+            "delivery_window": ui_elements['delivery_window_input'].getText().toString().strip(),
+            "server_schedule": ui_elements['server_schedule_checkbox'].isChecked(),
+            "priority": next((key for key, rb in ui_elements['priority_buttons'].items() if rb.isChecked()), "normal"),
+            "shadow": ui_elements['shadow_checkbox'].isChecked()
+        }
+
     class ReplyListenerTimeoutTask(dynamic_proxy(Runnable)):
         """A proxy class to handle the timeout for the reply listener."""
         def __init__(self, plugin):
@@ -1217,36 +4520,28 @@ class AutoForwarderPlugin(BasePlugin):
             self.is_listening_for_reply = False
 
     # --- Rule Processing and Resolution ---
-    def _process_destination_input(self, source_id, source_name, user_input, *args):
+    def _process_destination_input(self, source_id, source_name, user_input, rule_settings):
         """Processes the destination provided manually in the settings dialog."""
-        (keyword_pattern, author_filter, drop_author, quote_replies, forward_to_topic, 
-         topic_id, forward_users, forward_bots, forward_outgoing, filter_settings) = args
-
         cleaned_input = (user_input or "").strip()
         if not cleaned_input: 
             BulletinHelper.show_error("Destination cannot be empty.")
             return
 
-        rule_settings = {
-            "keyword_pattern": keyword_pattern, "author_filter": author_filter, "drop_author": drop_author, 
-            "quote_replies": quote_replies, "forward_to_topic": forward_to_topic, "destination_topic_id": topic_id,
-            "forward_users": forward_users, "forward_bots": forward_bots, 
-            "forward_outgoing": forward_outgoing, "filter_settings": filter_settings
-        }
-
         if "/joinchat/" in cleaned_input or "/+" in cleaned_input:
             self._resolve_as_invite_link(cleaned_input, source_id, source_name, rule_settings)
             return
         
         try:
-            input_as_int = int(cleaned_input)
-            cached_entity = self._get_chat_entity_from_input_id(input_as_int)
-            if cached_entity:
-                self._finalize_rule(source_id, source_name, self._get_id_for_storage(cached_entity), self._get_entity_name(cached_entity), rule_settings)
-                return
-            self._resolve_by_id_shotgun(input_as_int, source_id, source_name, rule_settings)
+            query = int(cleaned_input)
         except ValueError:
-            self._resolve_as_username(cleaned_input, source_id, source_name, rule_settings)
+            query = cleaned_input
+
+        def on_resolved(result, error_text):
+            if result:
+                self._finalize_rule(source_id, source_name, result[0], result[1], rule_settings)
+            else:
+                BulletinHelper.show_error(f"Could not resolve '{cleaned_input}': {error_text}", get_last_fragment())
+        self.destination_resolver.resolve(self._active_account(), query, on_resolved)
 
     def _resolve_as_invite_link(self, cleaned_input, source_id, source_name, rule_settings):
         """Resolves a destination using a t.me/joinchat/... or t.me/+... link."""
@@ -1261,75 +4556,14 @@ class AutoForwarderPlugin(BasePlugin):
                     return
                 dest_entity = response.chat
                 if dest_entity:
-                    get_messages_controller().putChat(dest_entity, False)
+                    self._messages_controller().putChat(dest_entity, False)
                     dest_id = self._get_id_for_storage(dest_entity)
                     self._finalize_rule(source_id, source_name, dest_id, self._get_entity_name(dest_entity), rule_settings)
             
-            send_request(req, RequestCallback(on_check_invite))
+            self._send_request(req, RequestCallback(on_check_invite))
         except Exception as e:
             log(f"[{self.id}] Failed to process invite link: {e}")
 
-    def _resolve_by_id_shotgun(self, input_as_int, source_id, source_name, rule_settings):
-        """Resolves a numeric ID that is not in the local cache by making a network request."""
-        log(f"[{self.id}] ID {input_as_int} not in cache. Attempting network lookup.")
-        
-        def on_get_chats_complete(response, error):
-            if error or not response or not hasattr(response, 'chats') or response.chats.isEmpty():
-                error_text = getattr(error, 'text', 'Not found')
-                BulletinHelper.show_error(f"Could not find chat by ID: {input_as_int}. Reason: {error_text}", get_last_fragment())
-                return
-            
-            dest_entity = response.chats.get(0)
-            if dest_entity:
-                get_messages_controller().putChat(dest_entity, True)
-                dest_id = self._get_id_for_storage(dest_entity)
-                self._finalize_rule(source_id, source_name, dest_id, self._get_entity_name(dest_entity), rule_settings)
-            else:
-                BulletinHelper.show_error(f"Could not find chat by ID: {input_as_int}", get_last_fragment())
-
-        req = TLRPC.TL_messages_getChats()
-        id_list = ArrayList()
-        possible_ids = HashSet()
-        sanitized_short_id = self._sanitize_chat_id_for_request(input_as_int)
-        possible_ids.add(sanitized_short_id)
-        possible_ids.add(-sanitized_short_id)
-        possible_ids.add(abs(input_as_int))
-        possible_ids.add(-abs(input_as_int))
-        id_list.addAll(possible_ids)
-        req.id = id_list
-        send_request(req, RequestCallback(on_get_chats_complete))
-
-    def _resolve_as_username(self, username, source_id, source_name, rule_settings):
-        """Resolver for public links (t.me/...) and @usernames."""
-        log(f"[{self.id}] Resolving '{username}' as a username/public link.")
-        
-        def on_resolve_complete(response, error):
-            if error or not response:
-                error_text = getattr(error, 'text', 'Not found')
-                BulletinHelper.show_error(f"Could not resolve '{username}': {error_text}", get_last_fragment())
-                return
-            
-            dest_entity = None
-            if hasattr(response, 'chats') and response.chats and not response.chats.isEmpty():
-                dest_entity = response.chats.get(0)
-                get_messages_controller().putChats(response.chats, False)
-            elif hasattr(response, 'users') and response.users and not response.users.isEmpty():
-                dest_entity = response.users.get(0)
-                get_messages_controller().putUsers(response.users, False)
-            
-            if dest_entity:
-                dest_id = self._get_id_for_storage(dest_entity)
-                self._finalize_rule(source_id, source_name, dest_id, self._get_entity_name(dest_entity), rule_settings)
-            else:
-                BulletinHelper.show_error(f"Could not resolve '{username}'.", get_last_fragment())
-        
-        try:
-            req = TLRPC.TL_contacts_resolveUsername()
-            req.username = username.replace("@", "").split("/")[-1]
-            send_request(req, RequestCallback(on_resolve_complete))
-        except Exception:
-            log(f"[{self.id}] ERROR resolving username: {traceback.format_exc()}")
-
     def _finalize_rule(self, source_id, source_name, destination_id, dest_name, rule_settings):
         """Saves the final, resolved rule to storage and notifies the user."""
         if destination_id == 0:
@@ -1337,6 +4571,23 @@ class AutoForwarderPlugin(BasePlugin):
             BulletinHelper.show_error("Failed to save rule: Invalid destination chat resolved.", get_last_fragment())
             return
     
+        keyword_pattern = (rule_settings.get("keyword_pattern") or "").strip()
+        keyword_warning = None
+        if keyword_pattern:
+            try:
+                compiled = self.compiled_keyword_patterns[keyword_pattern] = self._compile_keyword_pattern(keyword_pattern)
+                keyword_warning = compiled[2]
+            except ValueError as e:
+                log(f"[{self.id}] Rejecting keyword pattern '{keyword_pattern}': {e}")
+                BulletinHelper.show_error(f"Rule not saved. Keyword filter rejected: {e}", get_last_fragment())
+                return
+
+        try:
+            self._parse_delivery_windows(rule_settings.get("delivery_window", ""))
+        except ValueError as e:
+            BulletinHelper.show_error(f"Rule not saved. Delivery window rejected: {e}", get_last_fragment())
+            return
+
         topic_id = rule_settings.get("destination_topic_id", 0)
     
         rule_data = {
@@ -1350,16 +4601,30 @@ class AutoForwarderPlugin(BasePlugin):
             "forward_users": rule_settings["forward_users"],
             "forward_bots": rule_settings["forward_bots"],
             "forward_outgoing": rule_settings["forward_outgoing"],
-            "filters": rule_settings["filter_settings"]
+            "filters": rule_settings["filter_settings"],
+            "near_duplicate_threshold": rule_settings.get("near_duplicate_threshold", 0),
+            "antispam_mode": rule_settings.get("antispam_mode", "drop"),
+            "digest_window_seconds": rule_settings.get("digest_window_seconds", 0),
+            "digest_max_chars": rule_settings.get("digest_max_chars", 0),
+            "delivery_window": rule_settings.get("delivery_window", ""),
+            "server_schedule": rule_settings.get("server_schedule", False),
+            "priority": rule_settings.get("priority", "normal"),
+            "shadow": rule_settings.get("shadow", False),
+            "source_name": source_name,
+            "destination_name": dest_name
         }
         log(f"[{self.id}] Finalizing rule. Saving topic ID: {topic_id}")
     
-        self.forwarding_rules[source_id] = rule_data
-        self._save_forwarding_rules()
+        self._save_rule(source_id, rule_data)
+        if keyword_warning:
+            log(f"[{self.id}] Keyword pattern '{keyword_pattern}' for {source_id}: {keyword_warning}")
+            BulletinHelper.show_info(f"Rule saved: '{source_name}' → '{dest_name}'. Keyword filter may be slow: {keyword_warning}.", get_last_fragment())
+            return
         BulletinHelper.show_info(f"Rule saved: '{source_name}' → '{dest_name}'", get_last_fragment())
 
     def _delete_rule_with_confirmation(self, source_id):
         """Shows a confirmation dialog before deleting a rule."""
+        from ui.alert import AlertDialogBuilder
         activity = get_last_fragment().getParentActivity()
         if not activity: return
         try:
@@ -1373,10 +4638,10 @@ class AutoForwarderPlugin(BasePlugin):
 
     def _execute_delete(self, source_id):
         """Performs the actual deletion of a rule."""
-        if source_id in self.forwarding_rules:
+        if self._rule_key(source_id) in self.forwarding_rules:
             source_name = self._get_chat_name(source_id)
-            del self.forwarding_rules[source_id]
-            self._save_forwarding_rules()
+            self._remove_rule(source_id)
+            if self._rule_key(source_id) in self.backfill_jobs: self._stop_backfill(source_id)
             BulletinHelper.show_info(f"Rule for '{source_name}' deleted.", get_last_fragment())
             self._refresh_settings_ui()
 
@@ -1389,7 +4654,7 @@ class AutoForwarderPlugin(BasePlugin):
             channel_id = 0
             if str(chat_id).startswith("-100"):
                 channel_id = int(str(chat_id)[4:])
-            get_messages_controller().deleteMessages(id_list, None, None, chat_id, 0, True, channel_id)
+            self._messages_controller().deleteMessages(id_list, None, None, chat_id, 0, True, channel_id)
             log(f"[{self.id}] Delete command sent for message {message_id} in chat {chat_id}.")
         except Exception:
             log(f"[{self.id}] ERROR in _delete_message_by_id: {traceback.format_exc()}")
@@ -1426,35 +4691,90 @@ class AutoForwarderPlugin(BasePlugin):
             return "bot"
         return "user"
 
+    def _get_message_type_key(self, message_object):
+        """Classifies a message into one of the FILTER_TYPES content keys."""
+        if message_object.isPhoto(): return "photos"
+        if message_object.isSticker(): return "stickers"
+        if message_object.isVoice(): return "voice"
+        if message_object.isRoundVideo(): return "video_messages"
+        if message_object.isGif(): return "gifs"
+        if message_object.isMusic(): return "audio"
+        if message_object.isVideo(): return "videos"
+        if message_object.isDocument(): return "documents"
+        return "text"
+
     def _is_message_allowed_by_filters(self, message_object, rule):
         """Checks if a message should be forwarded based on the rule's media filters."""
         filters = rule.get("filters", {})
         if not filters:
             return True
-        if message_object.isPhoto(): return filters.get("photos", True)
-        if message_object.isSticker(): return filters.get("stickers", True)
-        if message_object.isVoice(): return filters.get("voice", True)
-        if message_object.isRoundVideo(): return filters.get("video_messages", True)
-        if message_object.isGif(): return filters.get("gifs", True)
-        if message_object.isMusic(): return filters.get("audio", True)
-        if message_object.isVideo(): return filters.get("videos", True)
-        if message_object.isDocument(): return filters.get("documents", True)
-        return filters.get("text", True)
+        return filters.get(self._get_message_type_key(message_object), True)
         
-    def _passes_keyword_filter(self, text_to_check, pattern):
+    def _passes_keyword_filter(self, text_to_check, pattern, source_chat_id=None):
         """Checks if a given text matches a keyword or regex pattern."""
         if not pattern:
             return True
         if not text_to_check:
             return False
+        kind, matcher, _ = self._get_compiled_keyword_pattern(pattern)
+        if kind == "literal":
+            return matcher in text_to_check.lower()
+
+        suspension_key = (self._rule_key(source_chat_id), pattern)
+        if suspension_key in self.suspended_regex_rules:
+            return False
+        # Python's regex engine holds the GIL and cannot be interrupted. Exponential patterns
+        # are rejected when saved and steep polynomial ones get a warning; the timing below
+        # suspends a pattern that keeps running over budget on real messages.
+        started = time.perf_counter()
+        matched = matcher.search(text_to_check) is not None
+        elapsed = time.perf_counter() - started
+        if elapsed > self.REGEX_TIME_BUDGET_SECONDS:
+            self.regex_budget_violations[suspension_key] += 1
+            violations = self.regex_budget_violations[suspension_key]
+            log(f"[{self.id}] Keyword regex for {source_chat_id} took {elapsed * 1000:.0f} ms (violation {violations}/{self.REGEX_VIOLATION_LIMIT}).")
+            if violations >= self.REGEX_VIOLATION_LIMIT:
+                self.suspended_regex_rules.add(suspension_key)
+                log(f"[{self.id}] Suspending keyword regex for {source_chat_id}; its messages are dropped until the pattern is edited.")
+        return matched
+
+    def _get_compiled_keyword_pattern(self, pattern):
+        """Returns the cached matcher for a pattern, compiling it on first use."""
+        compiled = self.compiled_keyword_patterns.get(pattern)
+        if compiled is None:
+            try:
+                compiled = self._compile_keyword_pattern(pattern)
+            except ValueError as e:
+                # Only rules saved before validation existed can get here; keep their old literal behavior.
+                log(f"[{self.id}] Stored keyword pattern '{pattern}' is invalid ({e}); matching it as plain text.")
+                compiled = ("literal", pattern.lower(), None)
+            self.compiled_keyword_patterns[pattern] = compiled
+        return compiled
+
+    def _compile_keyword_pattern(self, pattern):
+        """
+        Validates and compiles a keyword filter into (kind, matcher, warning). Patterns without
+        regex syntax become a fast case-insensitive substring match. Raises ValueError for
+        invalid regexes and ones that can backtrack exponentially; `warning` describes a
+        regex whose worst case grows faster than n ** MAX_QUIET_REGEX_DEGREE, or is None.
+        """
+        if not any(c in self.REGEX_METACHARACTERS for c in pattern):
+            return ("literal", pattern.lower(), None)
         try:
-            compiled_regex = re.compile(pattern, re.IGNORECASE)
-            if compiled_regex.search(text_to_check):
-                return True
-        except re.error:
-            if pattern.lower() in text_to_check.lower():
-                return True
-        return False
+            matcher = re.compile(pattern, re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f"invalid regex: {e}")
+        try:
+            risk = RegexRisk(pattern)
+        except Exception as e:
+            raise ValueError(f"the regex can't be checked for catastrophic backtracking here ({e})")
+        if risk.unsafe:
+            raise ValueError(f"{risk.unsafe}, which can backtrack catastrophically")
+        warning = None
+        if risk.degree > self.MAX_QUIET_REGEX_DEGREE:
+            warning = (f"its unbounded repeats can overlap, so on some long messages it takes time growing with "
+                       f"the length to the power of {risk.degree}; it is suspended if it keeps running over budget")
+        return ("regex", matcher, warning)
 
     def _get_java_len(self, py_string: str) -> int:
         """Gets the length of a Python string as Java would see it, crucial for entity offsets."""
@@ -1506,6 +4826,19 @@ class AutoForwarderPlugin(BasePlugin):
             log(f"[{self.id}] Failed to get input media: {traceback.format_exc()}")
         return None
 
+    def _get_media_size(self, message):
+        """The size in bytes of a message's document, or of its photo's largest size. 0 if unknown."""
+        media = getattr(message, "media", None)
+        try:
+            if isinstance(media, TLRPC.TL_messageMediaPhoto) and getattr(media, "photo", None) and media.photo.sizes:
+                sizes = media.photo.sizes
+                return max(getattr(sizes.get(i), "size", 0) or 0 for i in range(sizes.size()))
+            if isinstance(media, TLRPC.TL_messageMediaDocument) and getattr(media, "document", None):
+                return int(media.document.size or 0)
+        except Exception:
+            log(f"[{self.id}] Failed to read media size: {traceback.format_exc()}")
+        return 0
+
     def _prepare_final_entities(self, prefix_text, prefix_entities, original_entities):
         """Combines prefix entities with original message entities, adjusting offsets correctly."""
         final_entities = ArrayList()
@@ -1514,13 +4847,19 @@ class AutoForwarderPlugin(BasePlugin):
             offset_shift = self._get_java_len(prefix_text) + 2 if prefix_text else 0
             for i in range(original_entities.size()):
                 old = original_entities.get(i)
-                new = type(old)()
-                new.offset, new.length = old.offset + offset_shift, old.length
-                if hasattr(old, 'url'): new.url = old.url
-                if hasattr(old, 'user_id'): new.user_id = old.user_id
-                final_entities.add(new)
+                final_entities.add(self._copy_entity(old, old.offset + offset_shift, old.length))
         return final_entities
 
+    def _copy_entity(self, entity, offset, length):
+        """Copies a message entity to a new position."""
+        new = type(entity)()
+        new.offset, new.length = offset, length
+        if hasattr(entity, 'url'): new.url = entity.url
+        if hasattr(entity, 'user_id'): new.user_id = entity.user_id
+        if hasattr(entity, 'language'): new.language = entity.language
+        if hasattr(entity, 'document_id'): new.document_id = entity.document_id
+        return new
+
     def _get_id_from_peer(self, peer):
         """Utility to extract a numeric ID from a Peer object."""
         if not peer: return 0
@@ -1534,15 +4873,6 @@ class AutoForwarderPlugin(BasePlugin):
         if not entity: return 0
         return -entity.id if not isinstance(entity, TLRPC.TL_user) else entity.id
 
-    def _get_chat_entity_from_input_id(self, input_id: int):
-        """Gets a chat/user entity from the local cache using a numeric ID."""
-        if input_id == 0: return None
-        abs_id, controller = abs(input_id), get_messages_controller()
-        entity = controller.getChat(abs_id)
-        if entity: return entity
-        if input_id > 0: return controller.getUser(input_id)
-        return None
-
     def _sanitize_chat_id_for_request(self, input_id: int) -> int:
         """Sanitizes a supergroup ID for use in certain API requests."""
         id_str = str(abs(input_id))
@@ -1551,12 +4881,13 @@ class AutoForwarderPlugin(BasePlugin):
             except (ValueError, IndexError): pass
         return abs(input_id)
 
-    def _get_chat_entity(self, dialog_id):
-        """Gets a user or chat entity object from a dialog ID."""
+    def _get_chat_entity(self, dialog_id, account=None):
+        """Gets a user or chat entity object from a dialog ID, optionally as seen by a given account."""
         if not isinstance(dialog_id, int):
             try: dialog_id = int(dialog_id)
             except (ValueError, TypeError): return None
-        return get_messages_controller().getUser(dialog_id) if dialog_id > 0 else get_messages_controller().getChat(abs(dialog_id))
+        controller = MessagesController.getInstance(account) if account is not None else self._messages_controller()
+        return controller.getUser(dialog_id) if dialog_id > 0 else controller.getChat(abs(dialog_id))
 
     def _get_entity_name(self, entity):
         """Gets a display-friendly name from a user or chat entity."""
@@ -1567,9 +4898,9 @@ class AutoForwarderPlugin(BasePlugin):
             return name if name else f"ID: {entity.id}"
         return f"ID: {getattr(entity, 'id', 'N/A')}"
 
-    def _get_chat_name(self, chat_id):
+    def _get_chat_name(self, chat_id, account=None):
         """Convenience function to get a chat name directly from a chat ID."""
-        return self._get_entity_name(self._get_chat_entity(int(chat_id)))
+        return self._get_entity_name(self._get_chat_entity(int(chat_id), account))
 
     def _get_original_author_details(self, fwd_header):
         """Extracts author details from a fwd_from header."""
@@ -1584,21 +4915,24 @@ class AutoForwarderPlugin(BasePlugin):
     # --- Misc UI and Utilities ---
     def _refresh_settings_ui(self):
         """Forces the plugin settings screen to rebuild its views."""
+        from com.exteragram.messenger.plugins.ui import PluginSettingsActivity
         try:
             last_fragment = get_last_fragment()
             if isinstance(last_fragment, PluginSettingsActivity) and hasattr(last_fragment, 'rebuildViews'):
                 run_on_ui_thread(last_fragment.rebuildViews)
         except Exception: log(f"[{self.id}] ERROR during UI refresh: {traceback.format_exc()}")
 
-    def _copy_to_clipboard(self, text_to_copy: str, label: str):
+    def _copy_to_clipboard(self, text_to_copy: str, label: str, toast_text: str = None):
         """Copies text to the clipboard and shows a toast notification."""
+        from android.widget import Toast
+        from android.content import ClipData, Context
         activity = get_last_fragment().getParentActivity()
         if not activity: return
         try:
             clipboard = activity.getSystemService(Context.CLIPBOARD_SERVICE)
             clip = ClipData.newPlainText(label, text_to_copy)
             clipboard.setPrimaryClip(clip)
-            Toast.makeText(activity, f"{label} address copied to clipboard!", Toast.LENGTH_SHORT).show()
+            Toast.makeText(activity, toast_text or f"{label} address copied to clipboard!", Toast.LENGTH_SHORT).show()
         except Exception: log(f"[{self.id}] Failed to copy to clipboard: {traceback.format_exc()}")
 
     def _process_changelog_markdown(self, text):
@@ -1625,6 +4959,12 @@ class AutoForwarderPlugin(BasePlugin):
 
     def _show_faq_dialog(self):
         """Displays the formatted FAQ and Disclaimer dialog."""
+        from ui.alert import AlertDialogBuilder
+        from android.widget import LinearLayout, TextView, ScrollView
+        from android.text import Html
+        from android.text.method import LinkMovementMethod
+        from android.util import TypedValue
+        from org.telegram.ui.ActionBar import Theme
         activity = get_last_fragment().getParentActivity()
         if not activity: return
         try:
@@ -1687,11 +5027,20 @@ class AutoForwarderPlugin(BasePlugin):
             log(f"[{self.id}] ERROR showing FAQ dialog: {traceback.format_exc()}")
 
     # --- Update Mechanism ---
+    def _ensure_updater_thread(self):
+        """Starts the auto-updater thread if it is not already running."""
+        if self.updater_thread is None or not self.updater_thread.is_alive():
+            self.updater_thread = threading.Thread(target=self._updater_loop)
+            self.updater_thread.daemon = True
+            self.updater_thread.start()
+            log(f"[{self.id}] Auto-updater thread started.")
+
     def _updater_loop(self):
         """A background thread that periodically checks for new plugin updates."""
         log(f"[{self.id}] Updater loop started.")
-        time.sleep(60)
+        self.stop_updater_thread.wait(60)
         while not self.stop_updater_thread.is_set():
+            self.last_update_check = time.time()
             self.check_for_updates(is_manual=False)
             self.stop_updater_thread.wait(self.UPDATE_INTERVAL_SECONDS)
         log(f"[{self.id}] Updater loop finished.")
@@ -1702,46 +5051,122 @@ class AutoForwarderPlugin(BasePlugin):
         threading.Thread(target=self._perform_update_check, args=[is_manual]).start()
 
     def _perform_update_check(self, is_manual):
-        """Connects to the GitHub API to check for the latest release."""
+        """
+        Checks the latest GitHub release. The request is conditional (ETag / If-Modified-Since),
+        so an unchanged release costs a bodyless 304 that doesn't count against the API's
+        rate limit, and rate-limit responses push the next automatic check back.
+        """
+        from java.net import URL, HttpURLConnection
+        connection = None
         try:
+            cache = self._load_update_cache()
+            wait = cache.get("retry_after", 0) - time.time()
+            if wait > 0:
+                log(f"[{self.id}] Skipping update check, rate-limited for another {int(wait)}s.")
+                if is_manual: BulletinHelper.show_error(f"GitHub is rate-limiting update checks. Try again in {int(wait // 60) + 1} min.", get_last_fragment())
+                return
             api_url = URL(f"https://api.github.com/repos/{self.GITHUB_OWNER}/{self.GITHUB_REPO}/releases/latest")
             connection = api_url.openConnection()
+            connection.setConnectTimeout(self.HTTP_TIMEOUT_MS)
+            connection.setReadTimeout(self.HTTP_TIMEOUT_MS)
             connection.setRequestMethod("GET")
+            connection.setRequestProperty("Accept", "application/vnd.github+json")
+            if cache.get("body"):
+                if cache.get("etag"): connection.setRequestProperty("If-None-Match", cache["etag"])
+                if cache.get("last_modified"): connection.setRequestProperty("If-Modified-Since", cache["last_modified"])
             connection.connect()
-            if connection.getResponseCode() == HttpURLConnection.HTTP_OK:
-                stream = connection.getInputStream()
-                scanner = Scanner(stream, "UTF-8").useDelimiter("\\A")
-                response_str = scanner.next() if scanner.hasNext() else ""
-                scanner.close()
-                release_data = json.loads(response_str)
-                latest_version_tag = release_data.get("tag_name", "0.0.0").lstrip('v')
-                current_version = __version__.split('-')[0]
-                
-                latest_v_tuple = tuple(map(int, latest_version_tag.split('.')))
-                current_v_tuple = tuple(map(int, current_version.split('.')))
-
-                if latest_v_tuple > current_v_tuple:
-                    changelog = release_data.get("body", "No changelog provided.")
-                    assets = release_data.get("assets", [])
-                    download_url = None
-                    for asset in assets:
-                        if asset.get("name", "").endswith(".py"):
-                            download_url = asset.get("browser_download_url")
-                            break
-                    if download_url:
-                        run_on_ui_thread(lambda: self._show_update_dialog(latest_version_tag, changelog, download_url))
-                    elif is_manual:
-                        BulletinHelper.show_error("Update found, but no download file available.", get_last_fragment())
-                elif is_manual:
-                    BulletinHelper.show_info("You are on the latest version!", get_last_fragment())
-            elif is_manual:
-                BulletinHelper.show_error(f"Failed to fetch updates (HTTP {connection.getResponseCode()})", get_last_fragment())
+            status = connection.getResponseCode()
+            if status == HttpURLConnection.HTTP_NOT_MODIFIED:
+                response_str = cache["body"]
+                if cache.pop("failures", None):
+                    self._save_update_cache(cache)
+            elif status == HttpURLConnection.HTTP_OK:
+                response_str = self._read_stream(connection.getInputStream()).decode("utf-8")
+                cache = {"etag": connection.getHeaderField("ETag"), "last_modified": connection.getHeaderField("Last-Modified"), "body": response_str}
+                self._save_update_cache(cache)
+            elif status in (403, 429):
+                cache["failures"] = cache.get("failures", 0) + 1
+                cache["retry_after"] = time.time() + self._get_update_backoff_seconds(connection, cache["failures"])
+                self._save_update_cache(cache)
+                log(f"[{self.id}] Update check rate-limited (HTTP {status}), backing off until {time.ctime(cache['retry_after'])}.")
+                if is_manual: BulletinHelper.show_error("GitHub is rate-limiting update checks. Try again later.", get_last_fragment())
+                return
+            else:
+                if is_manual: BulletinHelper.show_error(f"Failed to fetch updates (HTTP {status})", get_last_fragment())
+                return
+            self._handle_release_data(json.loads(response_str), is_manual)
         except Exception as e:
             log(f"[{self.id}] Update check failed: {traceback.format_exc()}")
             if is_manual: BulletinHelper.show_error("Update check failed. See logs.", get_last_fragment())
+        finally:
+            if connection is not None:
+                connection.disconnect()
+
+    def _handle_release_data(self, release_data, is_manual):
+        """Offers the release if it is newer than the running version."""
+        latest_version_tag = release_data.get("tag_name", "0.0.0").lstrip('v')
+        current_version = __version__.split('-')[0]
+
+        latest_v_tuple = tuple(map(int, latest_version_tag.split('.')))
+        current_v_tuple = tuple(map(int, current_version.split('.')))
+
+        if latest_v_tuple > current_v_tuple:
+            changelog = release_data.get("body", "No changelog provided.")
+            assets = release_data.get("assets", [])
+            download_url, checksum_url = None, None
+            for asset in assets:
+                name = asset.get("name", "")
+                if name.endswith(".py") and not download_url:
+                    download_url = asset.get("browser_download_url")
+                elif name.endswith(".sha256") or name.upper() in ("SHA256SUMS", "SHA256SUMS.TXT", "CHECKSUMS.TXT"):
+                    checksum_url = asset.get("browser_download_url")
+            if download_url:
+                run_on_ui_thread(lambda: self._show_update_dialog(latest_version_tag, changelog, download_url, checksum_url))
+            elif is_manual:
+                BulletinHelper.show_error("Update found, but no download file available.", get_last_fragment())
+        elif is_manual:
+            BulletinHelper.show_info("You are on the latest version!", get_last_fragment())
+
+    def _load_update_cache(self):
+        """Returns the cached release metadata and rate-limit state."""
+        try:
+            return json.loads(self.get_setting(UPDATE_CACHE_KEY, "{}"))
+        except Exception:
+            return {}
+
+    def _save_update_cache(self, cache):
+        self.set_setting(UPDATE_CACHE_KEY, json.dumps(cache))
+
+    def _get_update_backoff_seconds(self, connection, failures):
+        """How long to wait after a rate-limit response: what GitHub asks for, else exponential from 15 minutes."""
+        retry_after = connection.getHeaderField("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return int(retry_after)
+        reset_at = connection.getHeaderField("X-RateLimit-Reset")
+        if connection.getHeaderField("X-RateLimit-Remaining") == "0" and reset_at and reset_at.isdigit():
+            return max(60, int(reset_at) - int(time.time()))
+        return min(self.UPDATE_INTERVAL_SECONDS, 15 * 60 * 2 ** (failures - 1))
+
+    def _read_stream(self, input_stream):
+        """Reads a Java InputStream to the end and returns its bytes."""
+        data, buffer = bytearray(), bytearray(self.DOWNLOAD_BUFFER_SIZE)
+        try:
+            bytes_read = input_stream.read(buffer)
+            while bytes_read != -1:
+                data.extend(buffer[:bytes_read])
+                bytes_read = input_stream.read(buffer)
+        finally:
+            input_stream.close()
+        return bytes(data)
 
-    def _show_update_dialog(self, version, changelog, download_url):
+    def _show_update_dialog(self, version, changelog, download_url, checksum_url=None):
         """Displays a dialog with changelog and an option to update."""
+        from ui.alert import AlertDialogBuilder
+        from android.widget import TextView, ScrollView
+        from android.text import Html
+        from android.text.method import LinkMovementMethod
+        from android.util import TypedValue
+        from org.telegram.ui.ActionBar import Theme
         activity = get_last_fragment().getParentActivity()
         if not activity: return
         builder = AlertDialogBuilder(activity)
@@ -1765,52 +5190,147 @@ class AutoForwarderPlugin(BasePlugin):
         scroller.addView(changelog_view)
         builder.set_view(scroller)
 
-        on_update_click = lambda b, w: threading.Thread(target=self._download_and_install, args=[download_url, version]).start()
+        on_update_click = lambda b, w: threading.Thread(target=self._download_and_install, args=[download_url, version, checksum_url]).start()
         builder.set_positive_button("Update", on_update_click)
         builder.set_negative_button("Cancel", None)
         run_on_ui_thread(builder.show)
 
-    def _download_and_install(self, url, version):
-        """Downloads the new plugin file and initiates the installation process."""
+    def _download_and_install(self, url, version, checksum_url=None):
+        """
+        Downloads the new plugin file and initiates the installation process. The download goes
+        to a .part file and resumes with a Range request if it was interrupted; it is verified
+        against the release's SHA-256 checksum asset (when published) before it is installed.
+        """
+        from java.io import File
+        from com.exteragram.messenger.plugins import PluginsController
         try:
             BulletinHelper.show_info(f"Downloading update v{version}...", get_last_fragment())
-            connection = URL(url).openConnection()
+            plugins_controller = PluginsController.getInstance()
+            cache_dir = File(plugins_controller.pluginsDir, ".cache")
+            cache_dir.mkdirs()
+            temp_file = File(cache_dir, f"temp_{self.id}_v{version}.py")
+            part_file = File(cache_dir, f"temp_{self.id}_v{version}.py.part")
+            if not self._download_to_file(url, part_file):
+                BulletinHelper.show_error("Download failed. It will resume where it stopped next time.", get_last_fragment())
+                return
+
+            expected_digest = self._fetch_expected_sha256(checksum_url, url) if checksum_url else None
+            if checksum_url and not expected_digest:
+                BulletinHelper.show_error("Could not read the update's checksum. Try again later.", get_last_fragment())
+                return
+            if expected_digest:
+                actual_digest = self._sha256_of_file(part_file.getAbsolutePath())
+                if actual_digest != expected_digest:
+                    log(f"[{self.id}] Update v{version} failed verification: SHA-256 {actual_digest}, expected {expected_digest}.")
+                    part_file.delete()
+                    BulletinHelper.show_error("The downloaded update is corrupted and was discarded.", get_last_fragment())
+                    return
+                log(f"[{self.id}] Update v{version} passed SHA-256 verification.")
+            else:
+                log(f"[{self.id}] Release v{version} publishes no checksum asset; installing without verification.")
+            if temp_file.exists():
+                temp_file.delete()
+            part_file.renameTo(temp_file)
+            log(f"[{self.id}] Download complete. Installing from {temp_file.getAbsolutePath()}")
+
+            def on_install_callback(error_msg):
+                if error_msg:
+                    log(f"[{self.id}] Installation failed: {error_msg}")
+                    BulletinHelper.show_error(f"Update failed: {error_msg}", get_last_fragment())
+                else:
+                    log(f"[{self.id}] Update to v{version} successful! Restart ExteraGram to apply.")
+                    def close_settings_action():
+                        fragment = get_last_fragment()
+                        if fragment and hasattr(fragment, 'finishFragment'):
+                            run_on_ui_thread(fragment.finishFragment)
+                    BulletinHelper.show_with_button(f"Update v{version} installed! Please restart.", R.raw.chats_infotip, "DONE",
+                        lambda: close_settings_action(), fragment=get_last_fragment())
+                if temp_file.exists():
+                    temp_file.delete()
+
+            install_callback_proxy = self.InstallCallback(on_install_callback)
+            plugins_controller.loadPluginFromFile(temp_file.getAbsolutePath(), install_callback_proxy)
+        except Exception:
+            log(f"[{self.id}] Download and install failed: {traceback.format_exc()}")
+            BulletinHelper.show_error("An error occurred during update.", get_last_fragment())
+
+    def _download_to_file(self, url, part_file):
+        """Streams `url` into `part_file`, continuing a partial download when the server allows it. Returns True when complete."""
+        from java.net import URL, HttpURLConnection
+        from java.io import FileOutputStream
+        offset = part_file.length() if part_file.exists() else 0
+        connection = URL(url).openConnection()
+        try:
+            connection.setConnectTimeout(self.HTTP_TIMEOUT_MS)
+            connection.setReadTimeout(self.HTTP_TIMEOUT_MS)
+            if offset:
+                connection.setRequestProperty("Range", f"bytes={offset}-")
             connection.connect()
-            if connection.getResponseCode() == HttpURLConnection.HTTP_OK:
-                plugins_controller = PluginsController.getInstance()
-                cache_dir = File(plugins_controller.pluginsDir, ".cache")
-                cache_dir.mkdirs()
-                temp_file = File(cache_dir, f"temp_{self.id}_v{version}.py")
-                input_stream = connection.getInputStream()
-                output_stream = FileOutputStream(temp_file)
-                buffer = bytearray(4096)
+            status = connection.getResponseCode()
+            if status == 416:
+                # The partial file doesn't fit what the server has now (say, the asset was replaced
+                # by a shorter one), so it can't be resumed: discard it and download from the start.
+                connection.disconnect()
+                part_file.delete()
+                if not offset:
+                    return False
+                log(f"[{self.id}] Server rejected resuming the update download at byte {offset}, restarting it.")
+                return self._download_to_file(url, part_file)
+            if status not in (HttpURLConnection.HTTP_OK, HttpURLConnection.HTTP_PARTIAL):
+                log(f"[{self.id}] Update download failed with HTTP {status}.")
+                return False
+            resuming = status == HttpURLConnection.HTTP_PARTIAL
+            if offset:
+                log(f"[{self.id}] " + (f"Resuming update download at byte {offset}." if resuming else "Server ignored the Range request, downloading from the start."))
+            input_stream = connection.getInputStream()
+            output_stream = FileOutputStream(part_file, resuming)
+            try:
+                buffer = bytearray(self.DOWNLOAD_BUFFER_SIZE)
                 bytes_read = input_stream.read(buffer)
                 while bytes_read != -1:
                     output_stream.write(buffer, 0, bytes_read)
                     bytes_read = input_stream.read(buffer)
+            finally:
                 output_stream.close()
                 input_stream.close()
-                log(f"[{self.id}] Download complete. Installing from {temp_file.getAbsolutePath()}")
-
-                def on_install_callback(error_msg):
-                    if error_msg:
-                        log(f"[{self.id}] Installation failed: {error_msg}")
-                        BulletinHelper.show_error(f"Update failed: {error_msg}", get_last_fragment())
-                    else:
-                        log(f"[{self.id}] Update to v{version} successful! Restart ExteraGram to apply.")
-                        def close_settings_action():
-                            fragment = get_last_fragment()
-                            if fragment and hasattr(fragment, 'finishFragment'):
-                                run_on_ui_thread(fragment.finishFragment)
-                        BulletinHelper.show_with_button(f"Update v{version} installed! Please restart.", R.raw.chats_infotip, "DONE",
-                            lambda: close_settings_action(), fragment=get_last_fragment())
-                    if temp_file.exists():
-                        temp_file.delete()
-                
-                install_callback_proxy = self.InstallCallback(on_install_callback)
-                plugins_controller.loadPluginFromFile(temp_file.getAbsolutePath(), install_callback_proxy)
-            else:
-                BulletinHelper.show_error("Download failed.", get_last_fragment())
+            return True
+        finally:
+            connection.disconnect()
+
+    def _fetch_expected_sha256(self, checksum_url, download_url):
+        """
+        Reads the expected digest from a checksum asset: either a bare digest or
+        `sha256sum`-style lines, in which case the line for the downloaded file is used.
+        """
+        from java.net import URL, HttpURLConnection
+        connection = None
+        try:
+            connection = URL(checksum_url).openConnection()
+            connection.setConnectTimeout(self.HTTP_TIMEOUT_MS)
+            connection.setReadTimeout(self.HTTP_TIMEOUT_MS)
+            connection.connect()
+            if connection.getResponseCode() != HttpURLConnection.HTTP_OK:
+                return None
+            text = self._read_stream(connection.getInputStream()).decode("utf-8", "replace")
         except Exception:
-            log(f"[{self.id}] Download and install failed: {traceback.format_exc()}")
-            BulletinHelper.show_error("An error occurred during update.", get_last_fragment())
+            log(f"[{self.id}] Fetching the update checksum failed: {traceback.format_exc()}")
+            return None
+        finally:
+            if connection is not None:
+                connection.disconnect()
+        file_name = download_url.rsplit("/", 1)[-1]
+        digests = []
+        for line in text.splitlines():
+            parts = line.strip().split()
+            if not parts or not re.fullmatch(r"[0-9a-fA-F]{64}", parts[0]):
+                continue
+            if len(parts) == 1 or parts[-1].lstrip("*") == file_name:
+                digests.append(parts[0].lower())
+        return digests[0] if len(digests) == 1 else None
+
+    def _sha256_of_file(self, path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.DOWNLOAD_BUFFER_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
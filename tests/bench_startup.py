@@ -0,0 +1,87 @@
+"""
+Cold-start benchmark. Each run starts a fresh interpreter, imports auto_forwarder with the
+stand-in modules from stubs.py and calls on_plugin_load(). Every Java class the module
+resolves costs --class-load-ms, which stands in for a Chaquopy reflection lookup on a phone.
+
+    python tests/bench_startup.py [--runs N] [--class-load-ms MS] [--baseline REV]
+
+--baseline also measures auto_forwarder.py as of git revision REV, for a before/after table.
+Numbers are medians over the runs.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+
+
+def cold_start(path, class_load_ms):
+    """Imports the module at `path` and loads the plugin in this interpreter. Returns the timings in ms."""
+    sys.path.insert(0, TESTS_DIR)
+    import stubs
+    stubs.install()
+    stubs.class_load_seconds = class_load_ms / 1000.0
+    loads_before = stubs.class_loads
+    started = time.perf_counter()
+    spec = importlib.util.spec_from_file_location("auto_forwarder", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["auto_forwarder"] = module
+    spec.loader.exec_module(module)
+    imported = time.perf_counter()
+    plugin = module.AutoForwarderPlugin()
+    plugin.on_plugin_load()
+    loaded = time.perf_counter()
+    stubs.class_load_seconds = 0.0
+    plugin.on_plugin_unload()
+    return {"import_ms": (imported - started) * 1000, "load_ms": (loaded - imported) * 1000,
+            "class_loads": stubs.class_loads - loads_before}
+
+
+def measure(path, runs, class_load_ms):
+    """Median cold-start timings of `path` over `runs` fresh interpreters."""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, __file__, "--child", path, "--class-load-ms", str(class_load_ms)],
+                                check=True, capture_output=True, text=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--class-load-ms", type=float, default=2.0)
+    parser.add_argument("--baseline", metavar="REV")
+    parser.add_argument("--child", metavar="PATH", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(cold_start(args.child, args.class_load_ms)))
+        sys.stdout.flush()
+        os._exit(0)  # The plugin's daemon threads don't need to wind down.
+
+    variants = [("working tree", os.path.join(REPO_DIR, "auto_forwarder.py"))]
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.baseline:
+            source = subprocess.run(["git", "show", f"{args.baseline}:auto_forwarder.py"], cwd=REPO_DIR,
+                                    check=True, capture_output=True).stdout
+            baseline_path = os.path.join(tmp, "auto_forwarder.py")
+            with open(baseline_path, "wb") as f:
+                f.write(source)
+            variants.insert(0, (args.baseline, baseline_path))
+        print(f"{args.runs} cold starts each, {args.class_load_ms:g} ms per Java class lookup")
+        print(f"{'version':<16}{'import ms':>12}{'load ms':>12}{'total ms':>12}{'classes':>10}")
+        for name, path in variants:
+            result = measure(path, args.runs, args.class_load_ms)
+            total = result["import_ms"] + result["load_ms"]
+            print(f"{name:<16}{result['import_ms']:>12.1f}{result['load_ms']:>12.1f}{total:>12.1f}{result['class_loads']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
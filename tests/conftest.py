@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stubs  # noqa: E402
+
+stubs.install()
+
+import auto_forwarder  # noqa: E402
+
+
+@pytest.fixture
+def plugin():
+    stubs.network.reset()
+    stubs.MessagesController.chats.clear()
+    stubs.MessagesController.users.clear()
+    instance = auto_forwarder.AutoForwarderPlugin()
+    yield instance
+    instance.stop_supervisor_thread.set()
+    instance.stop_backfill_thread.set()
+    instance.stop_updater_thread.set()
+    instance.stop_worker_thread.set()
+    instance.handler.removeCallbacksAndMessages(None)
+    with instance.queues_lock:
+        for processing_queue in instance.processing_queues.values():
+            processing_queue.put(None)
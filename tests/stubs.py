@@ -0,0 +1,473 @@
+"""
+Headless stand-ins for the Chaquopy, Android, Telegram and exteraGram modules the plugin
+imports, so auto_forwarder.py can be imported and driven by plain CPython.
+
+Everything not modelled explicitly resolves to an auto-created placeholder class, so UI
+code imports fine but does nothing. The parts the engine depends on (settings storage,
+the main-looper Handler, MessagesController, ConnectionsManager, java.net/java.io for the
+updater) have small working fakes.
+"""
+import http.client
+import importlib.abc
+import importlib.util
+import itertools
+import os
+import sys
+import threading
+import time
+import types
+import urllib.parse
+
+ROOTS = ("java", "android", "androidx", "org", "com", "ui", "base_plugin", "client_utils", "android_utils")
+
+# Simulated cost of resolving a Java class through Chaquopy's reflection, in seconds.
+# Only the startup benchmark sets it; `class_loads` counts the resolutions.
+class_load_seconds = 0.0
+class_loads = 0
+
+LOG = []
+
+
+def _load_class():
+    global class_loads
+    class_loads += 1
+    if class_load_seconds:
+        time.sleep(class_load_seconds)
+
+
+# --- Placeholders ---
+
+class _Null:
+    """A falsy do-nothing object returned by placeholder calls."""
+    def __call__(self, *args, **kwargs): return self
+    def __getattr__(self, name):
+        if name.startswith("__"): raise AttributeError(name)
+        return self
+    def __bool__(self): return False
+    def __iter__(self): return iter(())
+    def __int__(self): return 0
+
+NULL = _Null()
+
+
+class _AutoMeta(type):
+    """Creates (and caches) a nested placeholder class for every attribute that is read."""
+    def __getattr__(cls, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        _load_class()
+        sub = _AutoMeta(name, (TLObject,), {})
+        setattr(cls, name, sub)
+        return sub
+
+
+class TLObject(metaclass=_AutoMeta):
+    """A TL object or Java class: accepts any fields, reads unset ones as None."""
+    flags = 0
+
+    def __init__(self, *args, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return None
+
+
+class StubModule(types.ModuleType):
+    def __init__(self, name):
+        super().__init__(name)
+        self.__path__ = []
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        _load_class()
+        cls = _AutoMeta(name, (TLObject,), {})
+        setattr(self, name, cls)
+        return cls
+
+
+class _StubFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    def find_spec(self, fullname, path, target=None):
+        if fullname.split(".")[0] in ROOTS:
+            return importlib.util.spec_from_loader(fullname, self, is_package=True)
+        return None
+
+    def create_module(self, spec):
+        return StubModule(spec.name)
+
+    def exec_module(self, module):
+        pass
+
+
+# --- java.* ---
+
+def dynamic_proxy(interface):
+    class Proxy:
+        def __init__(self, *args, **kwargs):
+            pass
+    return Proxy
+
+
+class ArrayList(list):
+    def add(self, item):
+        self.append(item)
+        return True
+    def addAll(self, items):
+        self.extend(items)
+        return True
+    def size(self): return len(self)
+    def get(self, index): return self[index]
+    def isEmpty(self): return not self
+
+
+class HashSet(set):
+    def add(self, item):
+        new = item not in self
+        set.add(self, item)
+        return new
+    def size(self): return len(self)
+
+
+class JavaString(str):
+    def length(self):
+        return len(self.encode("utf-16-le")) // 2
+
+
+class _InputStream:
+    def __init__(self, response):
+        self._response = response
+    def read(self, buffer):
+        data = self._response.read(len(buffer))
+        if not data:
+            return -1
+        buffer[:len(data)] = data
+        return len(data)
+    def close(self):
+        self._response.close()
+
+
+class HttpURLConnection:
+    """java.net.HttpURLConnection over http.client. `URL.redirects` maps URL prefixes to a test server."""
+    HTTP_OK = 200
+    HTTP_PARTIAL = 206
+    HTTP_NOT_MODIFIED = 304
+    open_connections = set()  # Connected and not yet disconnected, so tests can spot leaks.
+
+    def __init__(self, url):
+        self._url = url
+        self._headers = {}
+        self._method = "GET"
+        self._timeout = 15.0
+        self._connection = None
+        self._response = None
+
+    def setConnectTimeout(self, ms): self._timeout = ms / 1000.0
+    def setReadTimeout(self, ms): self._timeout = ms / 1000.0
+    def setRequestMethod(self, method): self._method = method
+    def setRequestProperty(self, key, value): self._headers[key] = value
+
+    def connect(self):
+        if self._response is not None:
+            return
+        parts = urllib.parse.urlsplit(self._url)
+        self._connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=self._timeout)
+        self._connection.request(self._method, parts.path + (f"?{parts.query}" if parts.query else ""), headers=self._headers)
+        self._response = self._connection.getresponse()
+        HttpURLConnection.open_connections.add(self)
+
+    def getResponseCode(self):
+        self.connect()
+        return self._response.status
+
+    def getHeaderField(self, name):
+        self.connect()
+        return self._response.getheader(name)
+
+    def getInputStream(self):
+        self.connect()
+        return _InputStream(self._response)
+
+    def disconnect(self):
+        if self._connection:
+            self._connection.close()
+        HttpURLConnection.open_connections.discard(self)
+
+
+class URL:
+    redirects = {}
+
+    def __init__(self, url):
+        for prefix, target in URL.redirects.items():
+            if url.startswith(prefix):
+                url = target + url[len(prefix):]
+        self._url = url
+
+    def openConnection(self):
+        return HttpURLConnection(self._url)
+
+
+class File:
+    def __init__(self, parent, name=None):
+        if name is None:
+            self._path = str(parent)
+        else:
+            self._path = os.path.join(parent.getAbsolutePath() if isinstance(parent, File) else str(parent), name)
+
+    def getAbsolutePath(self): return self._path
+    def exists(self): return os.path.exists(self._path)
+    def length(self): return os.path.getsize(self._path) if os.path.exists(self._path) else 0
+    def mkdirs(self):
+        os.makedirs(self._path, exist_ok=True)
+        return True
+    def delete(self):
+        if os.path.exists(self._path):
+            os.remove(self._path)
+            return True
+        return False
+    def renameTo(self, other):
+        os.replace(self._path, other.getAbsolutePath())
+        return True
+
+
+class FileOutputStream:
+    def __init__(self, file, append=False):
+        self._file = open(file.getAbsolutePath(), "ab" if append else "wb")
+    def write(self, buffer, offset, length):
+        self._file.write(bytes(buffer[offset:offset + length]))
+    def close(self):
+        self._file.close()
+
+
+# --- android.* ---
+
+class Handler:
+    """The main-looper Handler: runnables fire on timer threads after their delay."""
+    def __init__(self, looper=None):
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def postDelayed(self, runnable, delay_ms):
+        timer = threading.Timer(max(0, delay_ms) / 1000.0, self._run, args=(runnable,))
+        timer.daemon = True
+        with self._lock:
+            self._timers.setdefault(id(runnable), []).append(timer)
+        timer.start()
+        return True
+
+    def post(self, runnable):
+        return self.postDelayed(runnable, 0)
+
+    def _run(self, runnable):
+        with self._lock:
+            timers = self._timers.get(id(runnable), [])
+            current = threading.current_thread()
+            self._timers[id(runnable)] = [t for t in timers if t is not current]
+            if not self._timers[id(runnable)]:
+                del self._timers[id(runnable)]
+        runnable.run()
+
+    def removeCallbacks(self, runnable):
+        with self._lock:
+            timers = self._timers.pop(id(runnable), [])
+        for timer in timers:
+            timer.cancel()
+
+    def removeCallbacksAndMessages(self, token):
+        with self._lock:
+            timers = [t for ts in self._timers.values() for t in ts]
+            self._timers.clear()
+        for timer in timers:
+            timer.cancel()
+
+
+def log(message):
+    LOG.append(message)
+
+
+def run_on_ui_thread(func, *args):
+    func()
+
+
+# --- base_plugin / client_utils ---
+
+class BasePlugin:
+    def __init__(self):
+        self.settings = {}
+        self.setting_writes = 0
+
+    def get_setting(self, key, default=None):
+        return self.settings.get(key, default)
+
+    def set_setting(self, key, value):
+        self.setting_writes += 1
+        self.settings[key] = value
+
+    def add_menu_item(self, *args, **kwargs):
+        pass
+
+
+def get_last_fragment():
+    return NULL
+
+
+def RequestCallback(func):
+    return func
+
+
+# --- org.telegram.* ---
+
+class UserConfig:
+    selectedAccount = 0
+    MAX_ACCOUNT_COUNT = 3
+    active_accounts = {0}
+
+    def __init__(self, account):
+        self.account = account
+
+    @classmethod
+    def getInstance(cls, account):
+        return cls(account)
+
+    def isClientActivated(self): return self.account in UserConfig.active_accounts
+    def getClientUserId(self): return 1000 + self.account
+    def getCurrentUser(self): return None
+
+
+class MessagesController:
+    chats = {}
+    users = {}
+
+    def __init__(self, account):
+        self.account = account
+
+    @classmethod
+    def getInstance(cls, account):
+        return cls(account)
+
+    def getChat(self, chat_id): return MessagesController.chats.get(chat_id)
+    def getUser(self, user_id): return MessagesController.users.get(user_id)
+    def getInputPeer(self, peer_id): return TLRPC.TL_inputPeer(peer_id=peer_id)
+    def putChat(self, chat, from_cache): MessagesController.chats[chat.id] = chat
+    def putChats(self, chats, from_cache): pass
+    def putUsers(self, users, from_cache): pass
+    def deleteMessages(self, *args): pass
+
+
+class Network:
+    """Answers requests the plugin sends. Tests replace `handler(account, req) -> (response, error)`."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+        self.message_ids = itertools.count(1)
+        self.handler = self.default_handler
+
+    def default_handler(self, account, req):
+        return TLRPC.TL_updateShortSentMessage(id=next(self.message_ids)), None
+
+    def reset(self):
+        with self.lock:
+            self.requests = []
+        self.handler = self.default_handler
+
+
+network = Network()
+
+
+class ConnectionsManager:
+    def __init__(self, account):
+        self.account = account
+
+    @classmethod
+    def getInstance(cls, account):
+        return cls(account)
+
+    def sendRequest(self, req, callback):
+        with network.lock:
+            network.requests.append((self.account, req))
+        response, error = network.handler(self.account, req)
+        callback(response, error)
+
+
+TLRPC = _AutoMeta("TLRPC", (TLObject,), {})
+
+
+class NotificationCenter(TLObject):
+    didReceiveNewMessages = 1
+    observers = []
+
+    def addObserver(self, observer, event): NotificationCenter.observers.append((observer, event))
+    def removeObserver(self, observer, event):
+        if (observer, event) in NotificationCenter.observers:
+            NotificationCenter.observers.remove((observer, event))
+
+
+class AccountInstance:
+    def __init__(self, account):
+        self.account = account
+
+    @classmethod
+    def getInstance(cls, account):
+        return cls(account)
+
+    def getNotificationCenter(self): return NotificationCenter()
+
+
+class MessageObject:
+    def __init__(self, account, message, *args):
+        self.currentAccount = account
+        self.messageOwner = message
+        self.replyMessageObject = None
+
+    def isPhoto(self): return isinstance(self.messageOwner.media, TLRPC.TL_messageMediaPhoto)
+    def isDocument(self): return isinstance(self.messageOwner.media, TLRPC.TL_messageMediaDocument)
+    def isSticker(self): return False
+    def isVoice(self): return False
+    def isRoundVideo(self): return False
+    def isGif(self): return False
+    def isMusic(self): return False
+    def isVideo(self): return False
+
+
+def make_message(chat_id, message_id, text="", grouped_id=0, media=None, out=False, from_id=555, account=0):
+    """A MessageObject for a message in a channel (`chat_id` < 0) or private chat."""
+    peer = TLRPC.TL_peerChannel(channel_id=-chat_id) if chat_id < 0 else TLRPC.TL_peerUser(user_id=chat_id)
+    message = TLRPC.TL_message(
+        id=message_id, peer_id=peer, out=out, message=text, media=media, entities=ArrayList(),
+        reply_to=None, grouped_id=grouped_id, from_id=TLRPC.TL_peerUser(user_id=from_id),
+        random_id=0, fwd_from=None, date=int(time.time()))
+    return MessageObject(account, message)
+
+
+def make_photo(photo_id, size=1000):
+    photo = TLRPC.TL_photo(id=photo_id, access_hash=1, file_reference=b"ref", sizes=ArrayList([TLRPC.TL_photoSize(size=size)]))
+    return TLRPC.TL_messageMediaPhoto(photo=photo)
+
+
+def _module(name, **attrs):
+    module = StubModule(name)
+    for key, value in attrs.items():
+        setattr(module, key, value)
+    sys.modules[name] = module
+    return module
+
+
+def install():
+    """Registers the stand-in modules. Safe to call more than once."""
+    if any(isinstance(finder, _StubFinder) for finder in sys.meta_path):
+        return
+    sys.meta_path.insert(0, _StubFinder())
+    _module("java.chaquopy", dynamic_proxy=dynamic_proxy)
+    _module("java.util", ArrayList=ArrayList, HashSet=HashSet)
+    _module("java.lang", String=JavaString, Integer=int, Long=int)
+    _module("java.net", URL=URL, HttpURLConnection=HttpURLConnection)
+    _module("java.io", File=File, FileOutputStream=FileOutputStream)
+    _module("android.os", Handler=Handler)
+    _module("android_utils", log=log, run_on_ui_thread=run_on_ui_thread)
+    _module("base_plugin", BasePlugin=BasePlugin)
+    _module("client_utils", get_last_fragment=get_last_fragment, RequestCallback=RequestCallback)
+    _module("org.telegram.messenger", UserConfig=UserConfig, MessagesController=MessagesController, MessageObject=MessageObject,
+            NotificationCenter=NotificationCenter, AccountInstance=AccountInstance)
+    _module("org.telegram.tgnet", TLRPC=TLRPC, ConnectionsManager=ConnectionsManager)
@@ -0,0 +1,48 @@
+import json
+
+import auto_forwarder
+import stubs
+
+TEXT = "Same announcement seen by both accounts"
+
+
+def _rule():
+    return {"destination": -20, "enabled": True, "filters": {key: True for key in auto_forwarder.FILTER_TYPES},
+            "drop_author": True, "quote_replies": False}
+
+
+def test_two_accounts_forwarding_the_same_chat_keep_their_own_reply_map(plugin):
+    for account, dest_msg_id in ((0, 100), (1, 200)):
+        plugin.account_context.account = account
+        plugin._on_messages_sent(stubs.TLRPC.TL_updateShortSentMessage(id=dest_msg_id), None, {7: [(-10, 1)]}, -20)
+    assert plugin.message_id_map.get(0, -10, 1, -20) == (-20, 100)
+    assert plugin.message_id_map.get(1, -10, 1, -20) == (-20, 200)
+
+
+def test_legacy_reply_map_keys_belong_to_the_selected_account(plugin):
+    stubs.UserConfig.selectedAccount = 1
+    try:
+        plugin.set_setting(auto_forwarder.MESSAGE_ID_MAP_KEY, json.dumps({"-10:1": [-20, 5], "-10:2:-30": [-30, 6]}))
+        message_id_map = auto_forwarder.MessageIdMap(plugin, 4, 16, 0)
+        assert message_id_map.get(1, -10, 1, -20) == (-20, 5)
+        assert message_id_map.get(1, -10, 2, -30) == (-30, 6)
+        assert message_id_map.get(0, -10, 1, -20) is None
+    finally:
+        stubs.UserConfig.selectedAccount = 0
+
+
+def test_content_sent_by_one_account_does_not_block_the_other(plugin):
+    plugin.content_dedup_window_seconds = plugin.content_dedup_cache.ttl = 600
+    for account in (0, 1):
+        plugin.account_context.account = account
+        plugin._send_forwarded_message(stubs.make_message(-10, 1, text=TEXT, account=account), _rule())
+    assert sorted(account for account, _ in stubs.network.requests) == [0, 1]
+
+
+def test_own_copies_are_recognised_per_account(plugin):
+    plugin.account_context.account = 0
+    plugin._remember_own_copies(random_ids=[42], sent_messages=[(-20, 5)])
+    echo = stubs.make_message(-20, 5, out=True).messageOwner
+    echo.random_id = 42
+    assert plugin._is_own_copy(0, -20, echo)
+    assert not plugin._is_own_copy(1, -20, echo)
@@ -0,0 +1,117 @@
+import threading
+
+import auto_forwarder
+import stubs
+
+ArrayList = stubs.ArrayList
+SOURCE = -10
+DESTINATION = -20
+
+
+class History:
+    """Answers getHistory like the server (newest first, offset_id exclusive) and records forwards."""
+    def __init__(self, messages):
+        self.messages = sorted(messages, key=lambda m: -m.id)
+        self.forwarded = []
+        self.fail_forwards = 0
+        self.copied = []
+        self.copy_errors = {}  # message text -> error texts to answer with, in turn
+
+    def __call__(self, account, req):
+        name = type(req).__name__
+        if name == "TL_messages_getHistory":
+            start = 0
+            if req.offset_id:
+                start = next((n for n, m in enumerate(self.messages) if m.id < req.offset_id), len(self.messages))
+            start += req.add_offset
+            page = self.messages[max(start, 0):max(start + req.limit, 0)]
+            return stubs.TLRPC.TL_messages_messages(messages=ArrayList(page), users=ArrayList(), chats=ArrayList()), None
+        if name == "TL_messages_forwardMessages":
+            if self.fail_forwards:
+                self.fail_forwards -= 1
+                return None, stubs.TLRPC.TL_error(code=500, text="INTERNAL")
+            self.forwarded.append([int(message_id) for message_id in req.id])
+            return stubs.TLRPC.TL_updates(updates=ArrayList()), None
+        if name == "TL_messages_sendMessage":
+            errors = self.copy_errors.get(req.message.split()[-1])
+            if errors:
+                return None, stubs.TLRPC.TL_error(code=420, text=errors.pop(0))
+            self.copied.append(req.message)
+            return stubs.TLRPC.TL_updateShortSentMessage(id=len(self.copied)), None
+        return None, stubs.TLRPC.TL_error(text="UNEXPECTED")
+
+
+class Waits(threading.Event):
+    """A stop event that records the waits instead of sleeping through them."""
+    def __init__(self):
+        super().__init__()
+        self.waits = []
+
+    def wait(self, timeout=None):
+        self.waits.append(timeout)
+        return self.is_set()
+
+
+def _setup(plugin, messages, **options):
+    history = History([m.messageOwner for m in messages])
+    stubs.network.handler = history
+    plugin.BACKFILL_PAGE_SIZE = 10
+    plugin.backfill_rate_per_minute = 0
+    rule = {"destination": DESTINATION, "enabled": True, "drop_author": True, "quote_replies": False,
+            "filters": {key: True for key in auto_forwarder.FILTER_TYPES}}
+    rule.update(options)
+    plugin._save_rule(SOURCE, rule)
+    with plugin.lock:
+        plugin.backfill_jobs[plugin._rule_key(SOURCE)] = {"cursor": 0, "end_id": max(m.messageOwner.id for m in messages),
+                                                          "limit": 0, "since": 0, "sent": 0}
+    return history
+
+
+def test_album_across_a_page_boundary_is_forwarded_whole(plugin):
+    messages = [stubs.make_message(SOURCE, n, text=f"m{n}", grouped_id=77 if 9 <= n <= 12 else 0) for n in range(1, 26)]
+    history = _setup(plugin, messages)
+    plugin._run_backfill_job(SOURCE)
+    assert history.forwarded[0] == list(range(1, 9))
+    assert any(set(range(9, 13)) <= set(batch) for batch in history.forwarded)
+    assert sorted(n for batch in history.forwarded for n in batch) == list(range(1, 26))
+    assert plugin._rule_key(SOURCE) not in plugin.backfill_jobs
+
+
+def test_unconfirmed_forward_keeps_the_cursor(plugin):
+    messages = [stubs.make_message(SOURCE, n, text=f"m{n}") for n in range(1, 16)]
+    history = _setup(plugin, messages)
+    history.fail_forwards = 1
+    sent = []
+    send_request_sync = plugin._send_request_sync
+
+    def time_out_once(req, timeout=30):
+        if type(req).__name__ == "TL_messages_forwardMessages" and not sent:
+            sent.append(req)
+            return None, None
+        return send_request_sync(req, timeout)
+
+    plugin._send_request_sync = time_out_once
+    plugin._run_backfill_job(SOURCE)
+    job = plugin.backfill_jobs[plugin._rule_key(SOURCE)]
+    assert (job["cursor"], job["sent"]) == (0, 0)
+    plugin._run_backfill_job(SOURCE)  # The server error also leaves the cursor alone.
+    assert plugin.backfill_jobs[plugin._rule_key(SOURCE)]["cursor"] == 0
+    plugin._run_backfill_job(SOURCE)
+    assert history.forwarded == [list(range(1, 11)), list(range(11, 16))]
+    assert plugin._rule_key(SOURCE) not in plugin.backfill_jobs
+
+
+def test_copied_messages_are_sent_one_at_a_time_through_flood_waits(plugin):
+    messages = [stubs.make_message(SOURCE, n, text=f"m{n}") for n in range(1, 5)]
+    history = _setup(plugin, messages, drop_author=False)
+    plugin.stop_backfill_thread = Waits()
+    plugin.backfill_rate_per_minute = 60
+    history.copy_errors = {"m2": ["FLOOD_WAIT_7"], "m3": ["CHAT_WRITE_FORBIDDEN"]}
+    plugin._run_backfill_job(SOURCE)
+    assert [text.split()[-1] for text in history.copied] == ["m1", "m2"]
+    assert 7 in plugin.stop_backfill_thread.waits
+    assert plugin.stop_backfill_thread.waits.count(1.0) == 2  # Paced per message.
+    job = plugin.backfill_jobs[plugin._rule_key(SOURCE)]
+    assert (job["cursor"], job["sent"]) == (2, 2)
+    plugin._run_backfill_job(SOURCE)
+    assert [text.split()[-1] for text in history.copied] == ["m1", "m2", "m3", "m4"]
@@ -0,0 +1,40 @@
+import auto_forwarder
+import stubs
+
+TEXT = "Same announcement reposted by several channels"
+
+
+def _rule():
+    return {"destination": -20, "enabled": True, "filters": {key: True for key in auto_forwarder.FILTER_TYPES},
+            "drop_author": True, "quote_replies": False}
+
+
+def _sends(errors):
+    """Answers sendMessage with the queued error texts first, then successes. Returns the sent texts."""
+    sent = []
+
+    def handler(account, req):
+        if errors:
+            return None, stubs.TLRPC.TL_error(code=420, text=errors.pop(0))
+        sent.append(req.message)
+        return stubs.TLRPC.TL_updateShortSentMessage(id=len(sent)), None
+    stubs.network.handler = handler
+    return sent
+
+
+def test_content_already_sent_is_skipped(plugin):
+    plugin.content_dedup_window_seconds = plugin.content_dedup_cache.ttl = 600
+    sent = _sends([])
+    plugin._send_forwarded_message(stubs.make_message(-10, 1, text=TEXT), _rule())
+    plugin._send_forwarded_message(stubs.make_message(-11, 1, text=TEXT), _rule())
+    assert sent == [TEXT]
+
+
+def test_failed_send_gives_the_content_back(plugin):
+    plugin.content_dedup_window_seconds = plugin.content_dedup_cache.ttl = 600
+    sent = _sends(["FLOOD_WAIT_30"])
+    plugin._send_forwarded_message(stubs.make_message(-10, 1, text=TEXT), _rule())
+    assert sent == []
+    plugin._send_forwarded_message(stubs.make_message(-11, 1, text=TEXT), _rule())
+    assert sent == [TEXT]
+    assert len(plugin.content_claims) == 0
@@ -0,0 +1,25 @@
+import auto_forwarder
+import stubs
+
+
+def test_holds_are_batched_into_one_write(plugin):
+    scheduler = plugin.delivery_scheduler
+    writes = plugin.setting_writes
+    for n in range(50):
+        scheduler.hold(1000.0 + n, 0, -10, [stubs.make_message(-10, n)])
+    assert plugin.setting_writes == writes
+    scheduler.flush(force=True)
+    assert plugin.setting_writes - writes == 1
+    restored = auto_forwarder.DeliveryScheduler(plugin, 5)
+    assert len(restored) == 50
+
+
+def test_released_entries_are_persisted_right_away(plugin):
+    scheduler = plugin.delivery_scheduler
+    scheduler.hold(1000.0, 0, -10, [stubs.make_message(-10, 1)])
+    scheduler.hold(5000.0, 0, -10, [stubs.make_message(-10, 2)])
+    writes = plugin.setting_writes
+    released = scheduler.pop_due(2000.0)
+    assert [ids for _, _, ids, _ in released] == [(1,)]
+    assert plugin.setting_writes - writes == 1
+    assert len(auto_forwarder.DeliveryScheduler(plugin, 5)) == 1
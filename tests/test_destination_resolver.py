@@ -0,0 +1,65 @@
+import stubs
+
+ArrayList = stubs.ArrayList
+
+
+def _channel(channel_id, title):
+    return stubs.TLRPC.TL_channel(id=channel_id, title=title, access_hash=7)
+
+
+def _network(channels, usernames=None, invalid=()):
+    """Answers lookups from `channels` ({id: title}); a getChannels batch with an `invalid` id fails whole."""
+    def handler(account, req):
+        name = type(req).__name__
+        if name == "TL_contacts_resolveUsername":
+            channel_id = (usernames or {}).get(req.username.lower())
+            if channel_id is None:
+                return None, stubs.TLRPC.TL_error(text="USERNAME_NOT_OCCUPIED")
+            return stubs.TLRPC.TL_contacts_resolvedPeer(chats=ArrayList([_channel(channel_id, channels[channel_id])]), users=ArrayList()), None
+        if name == "TL_channels_getChannels":
+            ids = [input_channel.channel_id for input_channel in req.id]
+            if any(channel_id in invalid for channel_id in ids):
+                return None, stubs.TLRPC.TL_error(text="CHANNEL_INVALID")
+            return stubs.TLRPC.TL_messages_chats(chats=ArrayList([_channel(i, channels[i]) for i in ids if i in channels])), None
+        if name == "TL_messages_getChats":
+            return stubs.TLRPC.TL_messages_chats(chats=ArrayList()), None
+        return None, stubs.TLRPC.TL_error(text="UNEXPECTED")
+    return handler
+
+
+def _resolve_many(plugin, queries):
+    results = {}
+    plugin.destination_resolver.resolve_many(0, queries, results.update)
+    return results
+
+
+def _requests(name):
+    return [req for _, req in stubs.network.requests if type(req).__name__ == name]
+
+
+def test_one_invalid_channel_does_not_fail_the_batch(plugin):
+    channels = {1000000001: "One", 1000000002: "Two", 1000000003: "Three"}
+    stubs.network.handler = _network(channels, invalid={1000000004})
+    queries = [-1001000000001, -1001000000002, -1001000000003, -1001000000004]
+    results = _resolve_many(plugin, queries)
+    assert results[-1001000000001] == ((-1000000001, "One"), None)
+    assert results[-1001000000003] == ((-1000000003, "Three"), None)
+    assert results[-1001000000004] == (None, "CHANNEL_INVALID")
+    # The failed batch of four is split into halves, and the failing half again.
+    assert [len(req.id) for req in _requests("TL_channels_getChannels")] == [4, 2, 2, 1, 1]
+
+
+def test_a_batch_is_cached_with_one_settings_write(plugin):
+    channels = {1000000001 + n: f"Channel {n}" for n in range(5)}
+    stubs.network.handler = _network(channels)
+    writes = plugin.setting_writes
+    results = _resolve_many(plugin, [-1001000000001 - n for n in range(5)])
+    assert all(result for result, _ in results.values())
+    assert plugin.setting_writes - writes == 1
+
+
+def test_queries_for_the_same_username_share_one_lookup(plugin):
+    stubs.network.handler = _network({1000000009: "Foo"}, usernames={"foo": 1000000009})
+    results = _resolve_many(plugin, ["@Foo", "foo", "https://t.me/foo"])
+    assert results == {query: ((-1000000009, "Foo"), None) for query in ("@Foo", "foo", "https://t.me/foo")}
+    assert len(_requests("TL_contacts_resolveUsername")) == 1
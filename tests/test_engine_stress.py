@@ -0,0 +1,161 @@
+"""
+Stress harness for the worker pipeline: interleaved plain messages, deferred replies and
+albums on two accounts, while another thread keeps swapping the rule table and one send
+hangs until the supervisor replaces its worker. The hung album may have arrived, so it is
+not retried; every other message must reach its destination exactly once.
+"""
+import collections
+import random
+import threading
+import time
+
+import auto_forwarder
+import stubs
+
+ACCOUNTS = (0, 1)
+SOURCES = (-10, -11, -12)
+MESSAGES_PER_SOURCE = 40
+ALBUM_PARTS = 3
+HUNG_PHOTO = (10 ** 4 + 11 * 1000 + 6) * 10  # First photo of the third album from -11 on account 0.
+
+
+def _rule(destination, **options):
+    rule = {"destination": destination, "enabled": True, "filters": {key: True for key in auto_forwarder.FILTER_TYPES},
+            "source_name": "", "destination_name": ""}
+    rule.update(options)
+    return rule
+
+
+def _rules(priority):
+    return {source: _rule(source - 100, priority=priority) for source in SOURCES}
+
+
+def _sent_items(req):
+    """What a send request delivers: album parts by photo id, other messages by text."""
+    if isinstance(req.message, str):
+        return [req.message]
+    return [f"photo {item.media.id.id}" for item in req.multi_media or ()]
+
+
+class Recorder:
+    """Network handler that counts delivered items per destination and hangs one send."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = collections.Counter()
+        self.hang_started = threading.Event()
+        self.release_hang = threading.Event()
+        self.message_ids = iter(range(1, 10 ** 9))
+
+    def __call__(self, account, req):
+        items = _sent_items(req)
+        if f"photo {HUNG_PHOTO}" in items and not self.hang_started.is_set():
+            # A native call that never returns; the supervisor has to route around it.
+            self.hang_started.set()
+            self.release_hang.wait()
+            return None, stubs.TLRPC.TL_error(code=500, text="hung call abandoned")
+        with self.lock:
+            for item in items:
+                self.sent[(account, req.peer.peer_id, item)] += 1
+            message_id = next(self.message_ids)
+        return stubs.TLRPC.TL_updateShortSentMessage(id=message_id), None
+
+
+def _traffic(account, source):
+    """The events one source produces, and the (account, destination, item) each must deliver."""
+    events, expected = [], []
+    for n in range(MESSAGES_PER_SOURCE):
+        caption = f"{account}/{source}/{'album' if n % 3 == 0 else 'reply' if n % 3 == 1 else 'text'}/{n}"
+        if n % 3 == 0:
+            grouped_id = account * 10 ** 6 + 10 ** 4 + -source * 1000 + n
+            for part in range(ALBUM_PARTS):
+                photo_id = grouped_id * 10 + part
+                events.append(stubs.make_message(source, n * 10 + part, text=f"{caption}/{part}", grouped_id=grouped_id,
+                                                 media=stubs.make_photo(photo_id), account=account))
+                expected.append((account, source - 100, f"photo {photo_id}"))
+        else:
+            message_object = stubs.make_message(source, n * 10, text=caption, account=account)
+            if n % 3 == 1:
+                # A reply whose quoted message isn't loaded waits for the deferral timeout.
+                message_object.messageOwner.reply_to = stubs.TLRPC.TL_messageReplyHeader(reply_to_msg_id=n * 10 - 5)
+            events.append(message_object)
+            expected.append((account, source - 100, caption))
+    return events, expected
+
+
+def test_no_lost_or_double_sends_under_load(plugin):
+    stubs.UserConfig.active_accounts = set(ACCOUNTS)
+    recorder = Recorder()
+    stubs.network.handler = recorder
+    plugin.album_timeout_ms = 40
+    plugin.deferral_timeout_ms = 30
+    plugin.sequential_delay_seconds = 0
+    plugin.antispam_delay_seconds = 0
+    plugin.SUPERVISOR_INTERVAL_SECONDS = 0.05
+    plugin.WORKER_STUCK_SECONDS = 0.5
+    plugin.stop_updater_thread.set()
+    for account in ACCOUNTS:
+        plugin.account_context.account = account
+        plugin._save_rules(_rules("normal"))
+    plugin.account_context.account = None
+    supervisor = threading.Thread(target=plugin._supervisor_loop, daemon=True)
+    supervisor.start()
+
+    expected, streams = [], []
+    for account in ACCOUNTS:
+        for source in SOURCES:
+            events, wanted = _traffic(account, source)
+            streams.append(events)
+            expected.extend(wanted)
+    hung_album = {(0, -111, f"photo {HUNG_PHOTO + part}") for part in range(ALBUM_PARTS)}
+    expected = [key for key in expected if key not in hung_album]
+
+    stop_editing = threading.Event()
+
+    def edit_rules(account):
+        # Rule edits swap the whole table; lanes reclassify under whatever table is current.
+        plugin.account_context.account = account
+        priorities = ("high", "low", "normal")
+        edits = 0
+        while not stop_editing.is_set():
+            plugin._save_rules(_rules(priorities[edits % 3]))
+            edits += 1
+            time.sleep(0.002)
+
+    def produce(events, seed):
+        shuffle = random.Random(seed)
+        for message_object in events:
+            plugin.handle_message_event(message_object)
+            if shuffle.random() < 0.05:
+                time.sleep(0.001)
+
+    editors = [threading.Thread(target=edit_rules, args=(account,), daemon=True) for account in ACCOUNTS]
+    producers = [threading.Thread(target=produce, args=(events, seed)) for seed, events in enumerate(streams)]
+    for thread in editors + producers:
+        thread.start()
+    for thread in producers:
+        thread.join()
+
+    try:
+        deadline = time.time() + 20
+        while time.time() < deadline:
+            with recorder.lock:
+                if sum(recorder.sent.values()) >= len(expected):
+                    break
+            time.sleep(0.05)
+        time.sleep(0.3)  # Anything sent twice would show up by now.
+        stop_editing.set()
+        for thread in editors:
+            thread.join()
+
+        assert recorder.hang_started.is_set()
+        assert max(health["restarts"] for health in plugin.worker_health.values()) >= 1
+        assert (0, -11) in plugin.rule_errors
+        with recorder.lock:
+            sent = dict(recorder.sent)
+        assert sorted(key for key in expected if key not in sent) == []
+        assert {key: count for key, count in sent.items() if count != 1} == {}
+        assert set(sent) == set(expected)
+    finally:
+        stop_editing.set()
+        recorder.release_hang.set()
+        stubs.UserConfig.active_accounts = {0}
@@ -0,0 +1,62 @@
+import auto_forwarder
+import stubs
+
+ArrayList = stubs.ArrayList
+
+
+def _rule():
+    return {"destination": -20, "enabled": True, "filters": {key: True for key in auto_forwarder.FILTER_TYPES},
+            "drop_author": True, "quote_replies": False}
+
+
+def _photo_message(message_id, file_reference):
+    message_object = stubs.make_message(-10, message_id, media=stubs.make_photo(message_id))
+    message_object.messageOwner.media.photo.file_reference = file_reference
+    return message_object
+
+
+class Server:
+    """Rejects media with an old file reference and serves the source messages with fresh ones."""
+    def __init__(self, stored):
+        self.stored = {m.messageOwner.id: m.messageOwner for m in stored}
+        self.sent = []  # (photo id, file reference)
+        self.fetches = 0
+
+    def __call__(self, account, req):
+        name = type(req).__name__
+        if name == "TL_messages_sendMedia":
+            if req.media.id.file_reference != b"fresh":
+                return None, stubs.TLRPC.TL_error(code=400, text="FILE_REFERENCE_EXPIRED")
+            self.sent.append((req.media.id.id, req.media.id.file_reference))
+            return stubs.TLRPC.TL_updateShortSentMessage(id=100 + len(self.sent)), None
+        if name in ("TL_messages_getMessages", "TL_channels_getMessages"):
+            self.fetches += 1
+            messages = ArrayList([self.stored[m.id] for m in req.id if m.id in self.stored])
+            return stubs.TLRPC.TL_messages_messages(messages=messages, users=ArrayList(), chats=ArrayList()), None
+        return None, stubs.TLRPC.TL_error(text="UNEXPECTED")
+
+
+def test_expired_sends_share_one_refetch_and_are_retried(plugin):
+    plugin.stop_worker_thread.set()  # The test plays the worker.
+    server = Server([_photo_message(n, b"fresh") for n in (1, 2)])
+    stubs.network.handler = server
+    plugin._save_rule(-10, _rule())
+    for n in (1, 2):
+        plugin._send_forwarded_message(_photo_message(n, b"stale"), plugin._get_rule(-10))
+    processing_queue = plugin.processing_queues[0]
+    assert processing_queue.qsize() == 1
+    assert processing_queue.get(timeout=0) == ("refresh", -10)
+    plugin._retry_expired_media_sends(-10)
+    assert server.fetches == 1
+    assert server.sent == [(1, b"fresh"), (2, b"fresh")]
+
+
+def test_deleted_source_is_dropped(plugin):
+    plugin.stop_worker_thread.set()
+    server = Server([])
+    stubs.network.handler = server
+    plugin._save_rule(-10, _rule())
+    plugin._send_forwarded_message(_photo_message(1, b"stale"), plugin._get_rule(-10))
+    plugin._retry_expired_media_sends(-10)
+    assert server.sent == []
+    assert plugin.expired_media_sends == {}
@@ -0,0 +1,76 @@
+import json
+import time
+
+import auto_forwarder
+import stubs
+
+ArrayList = stubs.ArrayList
+
+
+def _rule():
+    return {"destination": -20, "enabled": True, "filters": {key: True for key in auto_forwarder.FILTER_TYPES},
+            "source_name": "", "destination_name": ""}
+
+
+def _setup(plugin, stored=()):
+    """Plays the worker of account 0 against a server that stores `stored` and records sent texts."""
+    stored = {m.messageOwner.id: m.messageOwner for m in stored}
+    sent = []
+
+    def handler(account, req):
+        name = type(req).__name__
+        if name in ("TL_messages_getMessages", "TL_channels_getMessages"):
+            messages = ArrayList([stored[m.id] for m in req.id if m.id in stored])
+            return stubs.TLRPC.TL_messages_messages(messages=messages, users=ArrayList(), chats=ArrayList()), None
+        sent.append(req.message)
+        return stubs.TLRPC.TL_updateShortSentMessage(id=100 + len(sent)), None
+    stubs.network.handler = handler
+    plugin.stop_worker_thread.set()
+    plugin.antispam_delay_seconds = 0
+    plugin.account_context.account = 0
+    plugin.account_context.state = auto_forwarder.EngineState()
+    plugin._save_rule(-10, _rule())
+    return plugin._get_processing_queue(0), sent
+
+
+def _handoff(plugin):
+    return json.loads(plugin.get_setting(auto_forwarder.PENDING_HANDOFF_KEY, "[]"))
+
+
+def test_drain_sends_queued_items_within_the_deadline(plugin):
+    processing_queue, sent = _setup(plugin)
+    for n in (1, 2):
+        processing_queue.put(stubs.make_message(-10, n, text=f"queued {n}"))
+    plugin._drain_worker(processing_queue, time.time() + 5)
+    assert sent == ["queued 1", "queued 2"]
+    assert _handoff(plugin) == []
+
+
+def test_work_left_at_the_deadline_is_handed_over(plugin):
+    processing_queue, sent = _setup(plugin)
+    for n in (1, 2):
+        processing_queue.put(stubs.make_message(-10, n, text=f"queued {n}"))
+    plugin._drain_worker(processing_queue, time.time() - 1)
+    assert sent == []
+    assert _handoff(plugin) == [[0, -10, [1], "new"], [0, -10, [2], "new"]]
+
+
+def test_parts_parked_by_a_flood_wait_are_handed_over_unsent(plugin):
+    processing_queue, sent = _setup(plugin)
+    req = stubs.TLRPC.TL_messages_sendMessage(message="part", random_id=7)
+    processing_queue.put(("parts", -10, -20, [(req, {7: [(-10, 5)]})], 5), front=True)
+    processing_queue.pause(-10, time.time() + 60)
+    plugin._drain_worker(processing_queue, time.time() + 5)
+    assert sent == []
+    assert _handoff(plugin) == [[0, -10, [5], "ready"]]
+
+
+def test_next_load_resumes_handed_over_messages(plugin):
+    processing_queue, sent = _setup(plugin, stored=[stubs.make_message(-10, 1, text="left over")])
+    plugin.set_setting(auto_forwarder.PENDING_HANDOFF_KEY, json.dumps([[0, -10, [1], "new"]]))
+    plugin._resume_handoff()
+    assert _handoff(plugin) == []
+    item = processing_queue.get(timeout=0)
+    assert item == ("resume", -10, (1,), "new")
+    plugin._handle_queue_item(item)
+    assert sent == ["left over"]
@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+import auto_forwarder
+
+
+@pytest.mark.parametrize("pattern", [
+    r"(a+)+", r"(\w*)*", r"(\s*\w+)+", r"(a+a)+", r"(a|aa)+$", r"(a|a)+", r"(\w|\d\d)+", r"(.*,)*", r"(?=(a+)+)b",
+])
+def test_exponential_patterns_are_rejected(plugin, pattern):
+    with pytest.raises(ValueError, match="backtrack catastrophically"):
+        plugin._compile_keyword_pattern(pattern)
+
+
+@pytest.mark.parametrize("pattern", [
+    r"[a-z]+(,[a-z]+)*", r"(\d+\.)+", r"(ab|ac)+", r"(foo|foobar)+", r"\b(btc|bitcoin|₿)\b", r"bitcoin.*price",
+    r"^\w+@\w+\.com$", r"price:\s*\d+",
+])
+def test_delimited_and_distinct_repeats_are_accepted_quietly(plugin, pattern):
+    assert plugin._compile_keyword_pattern(pattern)[::2] == ("regex", None)
+
+
+@pytest.mark.parametrize("pattern", [r"(btc|eth).*(usd|eur).*\d+", r"a.*b.*c.*d", r"\bprice\b.*\d+.*\$", r".*foo.*bar", r"\w+\s+\w+"])
+def test_overlapping_repeats_are_saved_with_a_warning(plugin, pattern):
+    kind, _, warning = plugin._compile_keyword_pattern(pattern)
+    assert kind == "regex" and "power of" in warning
+
+
+@pytest.mark.parametrize("pattern, text", [
+    (r"(btc|eth).*(usd|eur).*\d+", "BTC " + "x" * 100 + " USD 42"),
+    (r"a.*b.*c.*d", "a" + " " * 200 + "b c d"),
+    (r"\w+\s+\w+", "-" * 300 + "two words"),
+])
+def test_long_messages_are_searched_in_full(plugin, pattern, text):
+    assert plugin._passes_keyword_filter(text, pattern, -100)
+
+
+def test_quiet_quadratic_pattern_stays_fast_on_a_full_length_message(plugin):
+    assert plugin._compile_keyword_pattern(r"\s*x")[2] is None
+    started = time.perf_counter()
+    assert not plugin._passes_keyword_filter(" " * 4096, r"\s*x", -100)
+    assert time.perf_counter() - started < 1.0
+
+
+def test_invalid_pattern_is_reported(plugin):
+    with pytest.raises(ValueError, match="invalid regex"):
+        plugin._compile_keyword_pattern("(unclosed")
+
+
+def test_regexes_are_rejected_without_the_parser(plugin, monkeypatch):
+    monkeypatch.setattr(auto_forwarder, "sre_parse", None)
+    with pytest.raises(ValueError, match="can't be checked"):
+        plugin._compile_keyword_pattern(r"\bbtc\b")
+    assert plugin._compile_keyword_pattern("btc") == ("literal", "btc", None)
@@ -0,0 +1,107 @@
+import queue
+import threading
+import time
+
+import pytest
+
+import auto_forwarder
+import stubs
+
+
+def _scheduler(aging_seconds=30):
+    # Items are (lane, priority, payload) tuples; the scheduler classifies by the first two.
+    return auto_forwarder.LaneScheduler(lambda item: (item[0], item[1]), aging_seconds=aging_seconds)
+
+
+def test_best_priority_lane_goes_first_and_lanes_keep_their_order():
+    scheduler = _scheduler()
+    scheduler.put(("bulk", 2, "first"))
+    scheduler.put(("bulk", 2, "second"))
+    scheduler.put(("urgent", 0, "fresh"))
+    assert [scheduler.get(timeout=0)[2] for _ in range(3)] == ["fresh", "first", "second"]
+
+
+def test_waiting_lane_ages_past_newer_high_priority_items():
+    scheduler = _scheduler(aging_seconds=0.01)
+    scheduler.put(("bulk", 2, "old"))
+    time.sleep(0.05)
+    scheduler.put(("urgent", 0, "fresh"))
+    assert scheduler.get(timeout=0) == ("bulk", 2, "old")
+
+
+def test_retry_at_the_front_keeps_its_original_age():
+    scheduler = _scheduler()
+    scheduler.put(("bulk", 2, "old"), enqueued_at=time.time() - 90)
+    item, enqueued_at = scheduler.get_entry(timeout=0)
+    scheduler.put(("urgent", 0, "fresh"))
+    scheduler.put(item, front=True, enqueued_at=enqueued_at)
+    # Aged three levels, the low-priority retry now outranks the fresh high-priority item.
+    assert scheduler.get_entry(timeout=0) == (item, enqueued_at)
+    assert scheduler.get(timeout=0) == ("urgent", 0, "fresh")
+
+
+def test_supervisor_requeues_a_stuck_item_with_its_enqueue_time(plugin):
+    scheduler = auto_forwarder.LaneScheduler(lambda item: (1, 0), auto_forwarder.AutoForwarderPlugin.QUEUE_AGING_SECONDS)
+    dead_worker = threading.Thread(target=lambda: None)
+    dead_worker.start()
+    dead_worker.join()
+    stuck = ("refresh", -10)
+    plugin.processing_queues[0] = scheduler
+    plugin.worker_threads[0] = dead_worker
+    plugin.worker_health[0] = {"owner": dead_worker, "heartbeat": time.time(), "item": stuck, "item_started": time.time(),
+                               "item_enqueued_at": 1234.5, "item_sends": 0, "restarts": 0}
+    plugin._start_worker_thread = lambda account: None
+    plugin._check_worker_health()
+    assert scheduler.get_entry(timeout=0) == (("retry", stuck), 1234.5)
+
+
+def test_stop_signal_jumps_every_lane(plugin):
+    plugin.stop_worker_thread.set()  # The test plays the worker.
+    plugin._save_rule(-10, {"destination": -20, "enabled": True, "priority": "high"})
+    processing_queue = plugin._get_processing_queue(0)
+    processing_queue.put(stubs.make_message(-10, 1, text="queued"))
+    processing_queue.put(None)
+    assert processing_queue.get(timeout=0) is None
+
+
+def test_paused_lane_is_skipped_until_its_pause_ends():
+    scheduler = _scheduler()
+    scheduler.put(("flooded", 0, "first"))
+    scheduler.put(("other", 2, "second"))
+    scheduler.pause("flooded", time.time() + 0.2)
+    assert scheduler.get(timeout=0) == ("other", 2, "second")
+    assert scheduler.get(timeout=0, include_paused=True) == ("flooded", 0, "first")
+    scheduler.put(("flooded", 0, "third"))
+    scheduler.pause("flooded", time.time() + 0.2)
+    started = time.time()
+    assert scheduler.get(timeout=5) == ("flooded", 0, "third")
+    assert time.time() - started >= 0.15
+
+
+def test_flood_wait_between_split_parts_parks_the_rest_in_the_lane(plugin):
+    source, destination = -10, -20
+    sent, floods = [], ["b"]
+
+    def handler(account, req):
+        if floods and req.message.startswith(floods[0]):
+            floods.pop()
+            return None, stubs.TLRPC.TL_error(code=420, text="FLOOD_WAIT_30")
+        sent.append(req.message[0])
+        return stubs.TLRPC.TL_updateShortSentMessage(id=len(sent)), None
+
+    stubs.network.handler = handler
+    rule = {"destination": destination, "enabled": True, "filters": {key: True for key in auto_forwarder.FILTER_TYPES}}
+    plugin.stop_worker_thread.set()  # The test plays the worker.
+    plugin._save_rule(source, rule)
+    text = "\n\n".join(["a" * 4000, "b" * 4000, "c" * 100])
+    plugin._send_forwarded_message(stubs.make_message(source, 1, text=text), plugin._get_rule(source))
+    assert sent == ["a"]
+    processing_queue = plugin.processing_queues[0]
+    processing_queue.put(stubs.make_message(-11, 1, text="elsewhere"))
+    assert processing_queue.get(timeout=0).messageOwner.message == "elsewhere"  # Other lanes go on.
+    with pytest.raises(queue.Empty):
+        processing_queue.get(timeout=0)
+    item = processing_queue.get(timeout=0, include_paused=True)
+    assert item[:3] == ("parts", source, destination) and len(item[3]) == 2
+    plugin._handle_queue_item(item)
+    assert sent == ["a", "b", "c"]
@@ -0,0 +1,23 @@
+import time
+
+import auto_forwarder
+
+
+def test_membership_counts_none_values_and_keeps_order():
+    cache = auto_forwarder.LRUCache(2)
+    cache.put("a", None)
+    cache.put("b", 1)
+    assert "a" in cache
+    assert "missing" not in cache
+    cache.put("c", 2)  # A membership test is not a use, so "a" is still the eviction candidate.
+    assert "a" not in cache
+    assert "b" in cache and "c" in cache
+
+
+def test_membership_respects_expiry():
+    cache = auto_forwarder.LRUCache(4, ttl=60)
+    cache.put("a", 0)
+    assert "a" in cache
+    cache._data["a"] = (0, time.time() - 61)
+    assert "a" not in cache
+    assert len(cache) == 0
@@ -0,0 +1,37 @@
+import auto_forwarder
+import stubs
+
+SOURCE = -10
+TEXT = "bitcoin price hits a new record high today"
+
+
+def _rule(**options):
+    rule = {"destination": -20, "enabled": True, "filters": {key: True for key in auto_forwarder.FILTER_TYPES},
+            "source_name": "", "destination_name": "", "near_duplicate_threshold": 3}
+    rule.update(options)
+    return rule
+
+
+def _ingest(plugin, rule):
+    plugin._save_rule(SOURCE, rule)
+    plugin.account_context.account = 0
+    plugin.account_context.state = auto_forwarder.EngineState()
+    dispatched = []
+    plugin._dispatch_message = lambda message_object, rule, event_key: dispatched.append(message_object.messageOwner.id)
+    return dispatched
+
+
+def test_near_duplicate_of_a_forwarded_text_is_dropped(plugin):
+    dispatched = _ingest(plugin, _rule())
+    plugin.super_handle_message_event(stubs.make_message(SOURCE, 1, text=TEXT))
+    plugin.super_handle_message_event(stubs.make_message(SOURCE, 2, text=TEXT + "!", from_id=556))
+    assert dispatched == [1]
+
+
+def test_rate_limited_text_does_not_suppress_its_repost(plugin):
+    dispatched = _ingest(plugin, _rule(antispam_mode="drop"))
+    plugin.antispam_delay_seconds, plugin.antispam_burst = 60, 1
+    plugin.super_handle_message_event(stubs.make_message(SOURCE, 1, text="an unrelated first post from the author"))
+    plugin.super_handle_message_event(stubs.make_message(SOURCE, 2, text=TEXT))  # Over the author's limit.
+    plugin.super_handle_message_event(stubs.make_message(SOURCE, 3, text=TEXT, from_id=556))
+    assert dispatched == [1, 3]
@@ -0,0 +1,120 @@
+import auto_forwarder
+import stubs
+
+ArrayList = stubs.ArrayList
+
+
+def _rule(destination, **options):
+    rule = {"destination": destination, "enabled": True, "filters": {key: True for key in auto_forwarder.FILTER_TYPES},
+            "source_name": "", "destination_name": ""}
+    rule.update(options)
+    return rule
+
+
+class Server:
+    """Stores every copy the plugin sends as the server would, so hops can fetch them back."""
+    def __init__(self):
+        self.stored = {}
+        self.sent = []  # (destination, text)
+        self.ids = iter(range(100, 10 ** 6))
+
+    def store(self, peer_id, text, random_id, media=None, grouped_id=0):
+        message_object = stubs.make_message(peer_id, next(self.ids), text=text, out=True, media=media, grouped_id=grouped_id)
+        self.stored[message_object.messageOwner.id] = message_object.messageOwner
+        self.sent.append((peer_id, text))
+        return message_object.messageOwner.id
+
+    def __call__(self, account, req):
+        name = type(req).__name__
+        if name == "TL_messages_sendMessage":
+            return stubs.TLRPC.TL_updateShortSentMessage(id=self.store(req.peer.peer_id, req.message, req.random_id)), None
+        if name == "TL_messages_sendMultiMedia":
+            updates = ArrayList()
+            for item in req.multi_media:
+                message_id = self.store(req.peer.peer_id, item.message, item.random_id, stubs.make_photo(item.media.id.id), grouped_id=1)
+                updates.add(stubs.TLRPC.TL_updateMessageID(id=message_id, random_id=item.random_id))
+            return stubs.TLRPC.TL_updates(updates=updates), None
+        if name in ("TL_messages_getMessages", "TL_channels_getMessages"):
+            messages = ArrayList([self.stored[m.id] for m in req.id if m.id in self.stored])
+            return stubs.TLRPC.TL_messages_messages(messages=messages, users=ArrayList(), chats=ArrayList()), None
+        return None, stubs.TLRPC.TL_error(text="UNEXPECTED")
+
+
+def _setup(plugin, rules, short_circuit):
+    server = Server()
+    stubs.network.handler = server
+    plugin.stop_worker_thread.set()  # The test plays the worker.
+    plugin.chain_short_circuit = short_circuit
+    plugin.account_context.account = 0
+    plugin.account_context.state = auto_forwarder.EngineState()
+    for source_id, rule in rules.items():
+        plugin._save_rule(source_id, rule)
+    return server
+
+
+def _echo(plugin, server, random_id):
+    """Delivers the echo of the latest copy the way the client's notification would."""
+    copy = server.stored[max(server.stored)]
+    message_object = stubs.make_message(-copy.peer_id.channel_id, copy.id, text=copy.message, out=True)
+    message_object.messageOwner.random_id = random_id
+    plugin.handle_message_event(message_object)
+
+
+def _run_queue(plugin):
+    processing_queue = plugin.processing_queues[0]
+    while processing_queue.qsize():
+        plugin._handle_queue_item(processing_queue.get(timeout=0))
+
+
+def test_loop_never_returns_to_the_origin():
+    graph = auto_forwarder.RuleGraph({(0, 1): _rule(2), (0, 2): _rule(3), (0, 3): _rule(1)})
+    assert graph.cycles == [[(0, 1), (0, 2), (0, 3)]]
+    assert graph.downstream((0, 1)) == [(0, 2)]
+
+
+def test_tail_into_a_loop_serves_each_chat_once():
+    graph = auto_forwarder.RuleGraph({(0, 4): _rule(1), (0, 1): _rule(2), (0, 2): _rule(3), (0, 3): _rule(1)})
+    hops = graph.downstream((0, 4))
+    assert hops == [(0, 1), (0, 2)]
+    destinations = [1] + [graph.edges[hop][1] for hop in hops]
+    assert sorted(destinations) == [1, 2, 3]
+
+
+def test_without_short_circuit_the_echo_runs_through_the_next_rule(plugin):
+    server = _setup(plugin, {-10: _rule(-20), -20: _rule(-30)}, short_circuit=False)
+    plugin._send_forwarded_message(stubs.make_message(-10, 1, text="hello"), plugin._get_rule(-10))
+    _echo(plugin, server, stubs.network.requests[-1][1].random_id)
+    _run_queue(plugin)
+    assert server.sent == [(-20, "hello"), (-30, "hello")]
+
+
+def test_short_circuit_hands_the_copy_to_the_next_rule_and_ignores_its_echo(plugin):
+    server = _setup(plugin, {-10: _rule(-20), -20: _rule(-30), -30: _rule(-10)}, short_circuit=True)
+    plugin._send_forwarded_message(stubs.make_message(-10, 1, text="hello"), plugin._get_rule(-10))
+    _echo(plugin, server, stubs.network.requests[-1][1].random_id)
+    assert plugin.processing_queues[0].qsize() == 1  # The hop, not the echo.
+    _run_queue(plugin)
+    _echo(plugin, server, stubs.network.requests[-1][1].random_id)
+    _run_queue(plugin)
+    # The loop ends before the message would come back to its origin.
+    assert server.sent == [(-20, "hello"), (-30, "hello")]
+
+
+def test_hop_rule_filters_see_our_copy(plugin):
+    server = _setup(plugin, {-10: _rule(-20), -20: _rule(-30, forward_outgoing=False)}, short_circuit=True)
+    plugin._send_forwarded_message(stubs.make_message(-10, 1, text="hello"), plugin._get_rule(-10))
+    _run_queue(plugin)
+    assert server.sent == [(-20, "hello")]
+
+
+def test_album_hop_goes_through_the_album_buffer(plugin):
+    server = _setup(plugin, {-10: _rule(-20), -20: _rule(-30)}, short_circuit=True)
+    album = [stubs.make_message(-10, n, grouped_id=9, media=stubs.make_photo(n)) for n in (1, 2)]
+    plugin._send_album(album, plugin._get_rule(-10))
+    _run_queue(plugin)
+    album_buffer = plugin.account_context.state.album_buffer
+    assert [len(entry["messages"]) for entry in album_buffer.values()] == [2]
+    for grouped_id, entry in list(album_buffer.items()):
+        plugin.handler.removeCallbacks(entry["task"])
+        plugin._process_album(grouped_id)
+    assert [destination for destination, _ in server.sent] == [-20, -20, -30, -30]
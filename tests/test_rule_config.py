@@ -0,0 +1,84 @@
+import json
+
+import auto_forwarder
+import stubs
+
+
+def _channel(chat_id, title):
+    channel = stubs.TLRPC.TL_channel(id=chat_id, title=title, access_hash=7)
+    stubs.MessagesController.chats[chat_id] = channel
+    return channel
+
+
+def _rule(destination, **options):
+    rule = {"destination": destination, "enabled": True, "filters": {key: True for key in auto_forwarder.FILTER_TYPES},
+            "source_name": "", "destination_name": ""}
+    rule.update(options)
+    return rule
+
+
+def _import(plugin, text):
+    """Runs the import pipeline without the dialogs: parse, resolve in one batch, apply."""
+    settings, rules, errors = plugin._parse_rule_config(text)
+    assert errors == []
+    account = plugin._active_account()
+    results = {}
+    plugin.destination_resolver.resolve_many(account, [query for query, _ in rules.values()], results.update)
+    resolved = {}
+    for source_id, (query, rule) in rules.items():
+        result, error_text = results[query]
+        assert result, error_text
+        resolved[source_id] = dict(rule, destination=result[0], source_name="", destination_name=result[1])
+    added, changed, _, _, changed_settings = plugin._diff_rule_config(account, settings, resolved)
+    to_save = {source_id: resolved[source_id] for source_id in added + [source_id for source_id, _ in changed]}
+    plugin._apply_rule_import(account, to_save, {key: new for key, (_, new) in changed_settings.items()})
+    return added, changed, changed_settings
+
+
+def _export(plugin):
+    config = plugin._build_rule_config()
+    config.pop("exported_at")
+    for rule in config["rules"]:
+        rule.pop("source_name")
+        rule.pop("destination_name")
+    return config
+
+
+def test_export_then_import_reproduces_rules_and_settings(plugin):
+    _channel(200, "Mirror")
+    _channel(300, "Alerts")
+    plugin.set_setting("content_dedup_window_seconds", "30")
+    plugin.set_setting("deduplication_window_seconds", "12.5")
+    plugin.set_setting("min_msg_length", "3")
+    plugin.set_setting("chain_short_circuit", True)
+    plugin._save_rules({
+        -101: _rule(-200, keyword_pattern="bitcoin|btc", priority="high", delivery_window="09:00-18:00"),
+        -102: _rule(-300, drop_author=False, near_duplicate_threshold=3, antispam_mode="delay", shadow=True),
+    })
+    exported = _export(plugin)
+    assert exported["settings"]["content_dedup_window_seconds"] == 30.0
+
+    target = auto_forwarder.AutoForwarderPlugin()
+    added, changed, changed_settings = _import(target, json.dumps(plugin._build_rule_config()))
+
+    assert sorted(added) == [-102, -101]
+    assert changed == []
+    assert set(changed_settings) == set(exported["settings"])
+    assert _export(target) == exported
+    assert target.content_dedup_window_seconds == 30.0
+
+
+def test_reimporting_an_export_changes_nothing(plugin):
+    _channel(200, "Mirror")
+    plugin.set_setting("content_dedup_window_seconds", "45")
+    plugin._save_rules({-101: _rule(-200, author_filter="@alice")})
+    added, changed, changed_settings = _import(plugin, json.dumps(plugin._build_rule_config()))
+    assert (added, changed, changed_settings) == ([], [], {})
+
+
+def test_whole_floats_are_accepted_for_integer_settings(plugin):
+    text = json.dumps({"format": auto_forwarder.RULE_CONFIG_FORMAT, "version": 1,
+                       "settings": {"min_msg_length": 5.0, "album_timeout_ms": 1.5}, "rules": []})
+    settings, _, errors = plugin._parse_rule_config(text)
+    assert settings == {"min_msg_length": 5}
+    assert errors == ["settings.album_timeout_ms: must be a whole number"]
@@ -0,0 +1,57 @@
+import auto_forwarder
+import stubs
+
+
+def _rule(**options):
+    rule = {"destination": -20, "enabled": True, "filters": {key: True for key in auto_forwarder.FILTER_TYPES},
+            "source_name": "", "destination_name": ""}
+    rule.update(options)
+    return rule
+
+
+def _setup(plugin):
+    """Plays the worker of account 0 against a server that records what is sent."""
+    sent = []
+
+    def handler(account, req):
+        sent.append(req.message if isinstance(req.message, str) else type(req).__name__)
+        return stubs.TLRPC.TL_updateShortSentMessage(id=100 + len(sent)), None
+    stubs.network.handler = handler
+    plugin.stop_worker_thread.set()
+    plugin.antispam_delay_seconds = 0
+    plugin.content_dedup_window_seconds = 60.0
+    plugin.account_context.account = 0
+    plugin.account_context.state = auto_forwarder.EngineState()
+    return sent
+
+
+def _run_queue(plugin):
+    processing_queue = plugin._get_processing_queue(0)
+    while processing_queue.qsize():
+        plugin._handle_queue_item(processing_queue.get(timeout=0))
+
+
+def test_shadow_rule_reports_without_sending_or_claiming_content(plugin):
+    sent = _setup(plugin)
+    plugin._save_rules({-10: _rule(shadow=True, keyword_pattern="hello"), -11: _rule()})
+    for message_id, text in ((1, "hello there"), (2, "goodbye")):
+        plugin.handle_message_event(stubs.make_message(-10, message_id, text=text))
+    plugin.handle_message_event(stubs.make_message(-11, 1, text="hello there"))
+    _run_queue(plugin)
+    assert sent == ["hello there"]  # The live rule's copy; the shadow one didn't claim the content.
+    stats = plugin.shadow_reports[(0, -10)].snapshot()
+    assert (stats["seen"], stats["forwarded"], stats["requests"]) == (2, 1, 1)
+    assert stats["drops"] == [("keyword filter", 1)]
+    assert stats["text_bytes"] == len("hello there")
+
+
+def test_shadow_album_is_counted_once_per_part(plugin):
+    sent = _setup(plugin)
+    plugin._save_rules({-10: _rule(shadow=True)})
+    for message_id in (1, 2):
+        plugin._buffer_album_part(stubs.make_message(-10, message_id, grouped_id=9, media=stubs.make_photo(message_id)))
+    plugin._process_album(9)
+    assert sent == []
+    stats = plugin.shadow_reports[(0, -10)].snapshot()
+    assert (stats["seen"], stats["forwarded"], stats["requests"]) == (2, 2, 1)
+    assert stats["media_bytes"] == 2000
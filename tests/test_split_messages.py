@@ -0,0 +1,27 @@
+import auto_forwarder
+import stubs
+
+
+def test_long_text_is_cut_at_paragraphs_and_entities_follow_their_text(plugin):
+    text = "\n\n".join(["a" * 3000, "b" * 3000])
+    bold = stubs.TLRPC.TL_messageEntityBold(offset=2990, length=20)
+    chunks = plugin._split_text_with_entities(text, stubs.ArrayList([bold]), 4096, 4096)
+    assert [chunk for chunk, _ in chunks] == ["a" * 3000, "b" * 3000]
+    # The bold run straddled the cut, so each part keeps its own share of it, re-based.
+    assert [(e.offset, e.length) for e in chunks[0][1]] == [(2990, 10)]
+    assert [(e.offset, e.length) for e in chunks[1][1]] == [(0, 8)]
+
+
+def test_over_long_text_is_sent_in_parts_instead_of_dropped(plugin):
+    sent = []
+
+    def handler(account, req):
+        sent.append(req.message)
+        return stubs.TLRPC.TL_updateShortSentMessage(id=len(sent)), None
+
+    stubs.network.handler = handler
+    rule = {"destination": -20, "enabled": True, "filters": {key: True for key in auto_forwarder.FILTER_TYPES}}
+    text = " ".join(["word"] * 2000)
+    plugin._send_forwarded_message(stubs.make_message(-10, 1, text=text), rule)
+    assert len(sent) == 3 and all(len(part) <= 4096 for part in sent)
+    assert " ".join(sent) == text
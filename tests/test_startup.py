@@ -0,0 +1,9 @@
+import os
+
+import bench_startup
+
+
+def test_cold_start_benchmark_measures_the_module():
+    result = bench_startup.measure(os.path.join(bench_startup.REPO_DIR, "auto_forwarder.py"), runs=1, class_load_ms=0)
+    assert result["import_ms"] > 0 and result["load_ms"] > 0
+    assert result["class_loads"] > 0
@@ -0,0 +1,53 @@
+import threading
+import time
+
+import auto_forwarder
+import stubs
+
+
+def _rule():
+    return {"destination": -20, "enabled": True, "filters": {key: True for key in auto_forwarder.FILTER_TYPES},
+            "source_name": "", "destination_name": ""}
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_stuck_send_is_not_retried_and_the_old_worker_keeps_off_the_new_state(plugin):
+    hang_started, release_hang, sent = threading.Event(), threading.Event(), []
+
+    def handler(account, req):
+        if type(req).__name__ == "TL_messages_sendMultiMedia" and not hang_started.is_set():
+            hang_started.set()
+            release_hang.wait()
+        sent.append(type(req).__name__)
+        return stubs.TLRPC.TL_updateShortSentMessage(id=len(sent)), None
+
+    stubs.network.handler = handler
+    plugin.album_timeout_ms = 10
+    plugin.WORKER_STUCK_SECONDS = 0.1
+    plugin.account_context.account = 0
+    plugin._save_rules({-10: _rule()})
+    for n in (1, 2):
+        plugin.handle_message_event(stubs.make_message(-10, n, grouped_id=9, media=stubs.make_photo(n)))
+    try:
+        assert hang_started.wait(5)
+        old_worker, old_state = plugin.worker_threads[0], plugin.engine_states[0]
+        time.sleep(0.15)
+        plugin._check_worker_health()
+        new_state = plugin.engine_states[0]
+        assert new_state is not old_state and 9 in old_state.album_buffer and 9 not in new_state.album_buffer
+        assert plugin.worker_threads[0] is not old_worker
+        assert "not retried" in plugin.rule_errors[(0, -10)][1]
+        plugin.handle_message_event(stubs.make_message(-10, 3, text="after the hang"))
+        assert _wait_for(lambda: sent == ["TL_messages_sendMessage"])
+    finally:
+        release_hang.set()
+    old_worker.join(5)
+    assert not old_worker.is_alive()
+    assert sent == ["TL_messages_sendMessage", "TL_messages_sendMultiMedia"]  # The album went out once.
+    assert plugin.worker_threads[0].is_alive()
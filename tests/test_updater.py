@@ -0,0 +1,168 @@
+import hashlib
+import http.server
+import json
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+import stubs
+
+PAYLOAD = b"".join(b"# update line %d\n" % n for n in range(4000))
+
+
+class ReleaseServer(http.server.ThreadingHTTPServer):
+    """A local stand-in for the GitHub API and its release assets."""
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), ReleaseHandler)
+        self.log = []  # (path, request headers, status)
+        self.api_status = 200
+        self.api_headers = {}
+        self.etag = '"release-1"'
+        self.release = {"tag_name": "v0.0.1", "body": "", "assets": []}
+        self.payload = PAYLOAD
+        self.checksum = hashlib.sha256(PAYLOAD).hexdigest()
+
+    @property
+    def base(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class ReleaseHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body=b"", headers=None):
+        self.server.log.append((self.path, dict(self.headers), status))
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        if self.path.endswith("/releases/latest"):
+            if server.api_status != 200:
+                return self._reply(server.api_status, b"{}", server.api_headers)
+            if self.headers.get("If-None-Match") == server.etag:
+                return self._reply(304, headers={"ETag": server.etag})
+            return self._reply(200, json.dumps(server.release).encode(), {"ETag": server.etag})
+        if self.path == "/plugin.py.sha256":
+            return self._reply(200, f"{server.checksum}  plugin.py\n".encode())
+        if self.path == "/plugin.py":
+            requested = self.headers.get("Range")
+            if not requested:
+                return self._reply(200, server.payload)
+            start = int(requested.split("=")[1].rstrip("-"))
+            if start >= len(server.payload):
+                return self._reply(416, headers={"Content-Range": f"bytes */{len(server.payload)}"})
+            return self._reply(206, server.payload[start:], {"Content-Range": f"bytes {start}-{len(server.payload) - 1}/{len(server.payload)}"})
+        self._reply(404)
+
+
+@pytest.fixture
+def server():
+    instance = ReleaseServer()
+    thread = threading.Thread(target=instance.serve_forever, daemon=True)
+    thread.start()
+    stubs.URL.redirects["https://api.github.com"] = instance.base
+    yield instance
+    stubs.URL.redirects.clear()
+    instance.shutdown()
+    instance.server_close()
+
+
+@pytest.fixture
+def plugins_dir(tmp_path, monkeypatch):
+    """A fake PluginsController that records the files it is asked to install."""
+    installed = []
+
+    class PluginsController:
+        pluginsDir = str(tmp_path)
+
+        @classmethod
+        def getInstance(cls):
+            return cls()
+
+        def loadPluginFromFile(self, path, callback):
+            with open(path, "rb") as f:
+                installed.append(f.read())
+
+    module = types.ModuleType("com.exteragram.messenger.plugins")
+    module.PluginsController = PluginsController
+    monkeypatch.setitem(sys.modules, "com.exteragram.messenger.plugins", module)
+    return types.SimpleNamespace(path=tmp_path, installed=installed)
+
+
+def _part_file(plugins_dir, plugin, version="9.9.9"):
+    cache = plugins_dir.path / ".cache"
+    cache.mkdir(exist_ok=True)
+    return cache / f"temp_{plugin.id}_v{version}.py.part"
+
+
+def test_unchanged_release_is_revalidated_with_etag(plugin, server):
+    releases = []
+    plugin._handle_release_data = lambda data, is_manual: releases.append(data)
+    plugin._perform_update_check(False)
+    plugin._perform_update_check(False)
+    assert [status for _, _, status in server.log] == [200, 304]
+    assert server.log[1][1].get("If-None-Match") == server.etag
+    assert releases == [server.release, server.release]
+
+
+def test_rate_limit_backs_off_until_retry_after(plugin, server):
+    server.api_status, server.api_headers = 403, {"Retry-After": "120"}
+    plugin._perform_update_check(False)
+    cache = plugin._load_update_cache()
+    assert cache["failures"] == 1
+    assert 110 < cache["retry_after"] - time.time() <= 120
+    plugin._perform_update_check(False)
+    assert len(server.log) == 1  # Skipped while backing off.
+
+
+def test_rate_limit_without_hints_backs_off_exponentially(plugin, server):
+    server.api_status = 429
+    plugin._perform_update_check(False)
+    plugin._save_update_cache(dict(plugin._load_update_cache(), retry_after=0))
+    plugin._perform_update_check(False)
+    cache = plugin._load_update_cache()
+    assert cache["failures"] == 2
+    assert 29 * 60 < cache["retry_after"] - time.time() <= 30 * 60
+
+
+def test_every_update_check_closes_its_connection(plugin, server):
+    plugin._handle_release_data = lambda data, is_manual: None
+    for status in (200, 304, 429, 500):
+        server.api_status = 200 if status == 304 else status
+        plugin._perform_update_check(False)
+        plugin._save_update_cache(dict(plugin._load_update_cache(), retry_after=0))
+    assert [status for _, _, status in server.log] == [200, 304, 429, 500]
+    assert stubs.HttpURLConnection.open_connections == set()
+
+
+def test_interrupted_download_resumes_with_range(plugin, server, plugins_dir):
+    _part_file(plugins_dir, plugin).write_bytes(PAYLOAD[:1000])
+    plugin._download_and_install(f"{server.base}/plugin.py", "9.9.9", f"{server.base}/plugin.py.sha256")
+    downloads = [(headers.get("Range"), status) for path, headers, status in server.log if path == "/plugin.py"]
+    assert downloads == [("bytes=1000-", 206)]
+    assert plugins_dir.installed == [PAYLOAD]
+
+
+def test_unresumable_partial_file_is_discarded_and_downloaded_again(plugin, server, plugins_dir):
+    _part_file(plugins_dir, plugin).write_bytes(b"x" * (len(PAYLOAD) + 10))
+    plugin._download_and_install(f"{server.base}/plugin.py", "9.9.9", f"{server.base}/plugin.py.sha256")
+    downloads = [(headers.get("Range"), status) for path, headers, status in server.log if path == "/plugin.py"]
+    assert downloads == [(f"bytes={len(PAYLOAD) + 10}-", 416), (None, 200)]
+    assert plugins_dir.installed == [PAYLOAD]
+    assert stubs.HttpURLConnection.open_connections == set()
+
+
+def test_checksum_mismatch_discards_the_download(plugin, server, plugins_dir):
+    server.checksum = hashlib.sha256(b"something else").hexdigest()
+    plugin._download_and_install(f"{server.base}/plugin.py", "9.9.9", f"{server.base}/plugin.py.sha256")
+    assert plugins_dir.installed == []
+    assert not _part_file(plugins_dir, plugin).exists()